@@ -4,32 +4,125 @@
 # Filepath: `/agent/agent.py`
 # Updated: 10-28-2023
 
-# Import necessary modules and packages
-from .conversable_agent import ConversableAgent
-from .teachable_agent import TeachableAgent
-from .text_analyzer_agent import TextAnalyzerAgent
+import time
+import threading
+from ops.config import logger
+
+
+# Agent modules import autogen, openai and sentence_transformers, so they are only
+# imported when an agent is first needed
+def _create_conversable_agent(manager):
+    from .conversable_agent import ConversableAgent
+    return ConversableAgent(name="conversable", backend=manager.backend,
+                            response_cache=manager.response_cache)
+
+
+def _create_teachable_agent(manager):
+    from .teachable_agent import TeachableAgent
+    return TeachableAgent(name="teachable")
+
+
+def _create_text_analyzer_agent(manager):
+    from .text_analyzer_agent import TextAnalyzerAgent
+    return TextAnalyzerAgent(name="analyzer", backend=manager.backend)
 
 
 class AgentManager:
-    def __init__(self):
-        self.conversable_agent = ConversableAgent(name="conversable")
-        self.teachable_agent = TeachableAgent(name="teachable")
-        self.text_analyzer_agent = TextAnalyzerAgent(name="analyzer")
+    """
+    Manages the ConversableAgent, TeachableAgent and TextAnalyzerAgent.
 
-    def get_conversable_agent(self):
-        return self.conversable_agent
+    Agents are constructed on first use. `warm_up` builds them (and loads the embedding
+    model) in a background thread so the chat prompt can be shown immediately.
+    """
 
-    def get_teachable_agent(self):
-        return self.teachable_agent
+    _factories = {
+        "conversable": _create_conversable_agent,
+        "teachable": _create_teachable_agent,
+        "analyzer": _create_text_analyzer_agent,
+    }
 
-    def get_text_analyzer_agent(self):
-        return self.text_analyzer_agent
+    def __init__(self, lazy: bool = True, backend=None, response_cache=None):
+        """
+        Args:
+            lazy (bool, optional): Construct agents on first use. If False, build them all now. Defaults to True.
+            backend (LLMBackend, optional): LLM backend shared by the ConversableAgent and
+                TextAnalyzerAgent. Defaults to an OpenAICompletionBackend per agent.
+            response_cache (ResponseCache, optional): Semantic cache of LLM replies for the
+                ConversableAgent. Disabled if None.
+        """
+        self.backend = backend
+        self.response_cache = response_cache
+        self._agents = {}
+        self._locks = {name: threading.Lock() for name in self._factories}
+        self._warm_up_thread = None
+        if not lazy:
+            self.warm_up(background=False)
+
+    def _get_agent(self, name):
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        # Per-agent locks: a caller waits only for the agent it needs, never twice for the same build
+        with self._locks[name]:
+            agent = self._agents.get(name)
+            if agent is None:
+                start = time.perf_counter()
+                agent = self._factories[name](self)
+                self._agents[name] = agent
+                logger.info(
+                    f"AGENT-MANAGER: Constructed {name} agent in {time.perf_counter() - start:.2f}s.")
+        return agent
+
+    def warm_up(self, background: bool = True):
+        """
+        Constructs every agent and loads the embedding model ahead of first use.
+
+        Args:
+            background (bool, optional): Run in a daemon thread and return immediately. Defaults to True.
+        """
+        if background:
+            if self._warm_up_thread is None:
+                self._warm_up_thread = threading.Thread(
+                    target=self._warm_up, name="agent-warm-up", daemon=True)
+                self._warm_up_thread.start()
+            return self._warm_up_thread
+        self._warm_up()
+
+    def _warm_up(self):
+        start = time.perf_counter()
+        # Teachable first: its embedding model is the slowest thing to load
+        for name in ("teachable", "conversable", "analyzer"):
+            try:
+                agent = self._get_agent(name)
+                memo_store = getattr(agent, "memo_store", None)
+                if memo_store is not None:
+                    memo_store.warm_up()
+            except Exception as e:
+                # Left for the first real use to retry and report
+                logger.error(f"AGENT-MANAGER: Error warming up {name} agent: {e}")
+        logger.info(
+            f"AGENT-MANAGER: Warm-up finished in {time.perf_counter() - start:.2f}s.")
+
+    def shutdown(self):
+        """
+        Closes the memo store if the TeachableAgent was ever constructed.
+        """
+        if self.response_cache is not None:
+            self.response_cache.log_stats()
+        if self.backend is not None:
+            self.backend.close()
+        teachable = self._agents.get("teachable")
+        if teachable is not None:
+            teachable.close_db()
+
+    def is_ready(self) -> bool:
+        return len(self._agents) == len(self._factories)
 
     def get_conversable_agent(self):
-        return self.conversable_agent
+        return self._get_agent("conversable")
 
     def get_teachable_agent(self):
-        return self.teachable_agent
+        return self._get_agent("teachable")
 
     def get_text_analyzer_agent(self):
-        return self.text_analyzer_agent
+        return self._get_agent("analyzer")
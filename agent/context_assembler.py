@@ -0,0 +1,323 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Context Assembler
+# Filepath: `/agent/context_assembler.py`
+# Updated: 10-28-2023
+
+import re
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+from ops.config import logger
+from ops.metrics import metrics
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+MEMO_HEADER = "Relevant memories:"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximates the number of tokens of `text` for GPT-style BPE vocabularies.
+
+    English averages about four characters per token, and every word is at least one.
+    Pass an exact counter to ContextAssembler (e.g. a tiktoken encoding) where it matters.
+    """
+    if not text:
+        return 0
+    return max(len(text.split()), math.ceil(len(text) / 4))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> str:
+    """
+    Returns the longest word prefix of `text` that fits in `max_tokens`, marked with an ellipsis.
+
+    Returns "" if not even one word fits.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    # Largest prefix length whose truncated form fits, by binary search over the word count
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle]) + " ...") <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " ..." if low else ""
+
+
+def render_prompt(messages: List[Dict]) -> str:
+    """
+    Renders chat messages as one completion prompt, ending where the assistant's reply begins.
+    """
+    lines = []
+    for message in messages:
+        role = message.get('role', 'user')
+        if role == 'system':
+            lines.append(message['content'])
+        else:
+            lines.append(f"{role.capitalize()}: {message['content']}")
+    lines.append("Assistant:")
+    return "\n\n".join(lines)
+
+
+def memo_text(memo: Dict) -> str:
+    """
+    Renders a memo for the prompt as "input -> output", so the model sees both the teaching and its answer.
+    """
+    if memo.get('output_text'):
+        return f"{memo['input_text']} -> {memo['output_text']}"
+    return memo['input_text']
+
+
+def _words(text: str) -> set:
+    return set(_WORD.findall(text.lower()))
+
+
+class ConversationContext:
+    """
+    Context state one conversation keeps between turns.
+
+    `summary` condenses the oldest messages of the history, and `summarized` counts how many
+    messages at the start of the history it already covers. Only messages beyond that mark
+    are summarized on later turns, so the summary is updated incrementally, never rebuilt.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.summarized = 0
+        self.lock = threading.Lock()
+
+
+class ContextAssembler:
+    """
+    Builds the messages sent to the LLM for one user message within a token budget.
+
+    The current message is always included. The remaining budget goes to a running summary
+    of old history, then to retrieved memos (at most `memo_share` of it) ranked by embedding
+    relevance, then to the recent turns, ranked by recency with a bonus for sharing words with
+    the message. Items that mostly repeat an item already chosen are dropped, and the first
+    item that no longer fits is truncated to the space left rather than skipped.
+
+    Messages that fall out of the `recent_messages` window are folded into the conversation's
+    summary `summarize_every` messages at a time, so a long session costs a bounded prompt
+    and a summary update every few turns instead of one every turn.
+    """
+
+    def __init__(self, max_tokens: int = 2048, memo_share: float = 0.3, summary_tokens: int = 256,
+                 recent_messages: int = 12, summarize_every: int = 4, recency_half_life: float = 4.0,
+                 relevance_weight: float = 0.3, duplicate_overlap: float = 0.9, min_fragment_tokens: int = 24,
+                 summarizer: Optional[Callable[[str, List[Dict], int], str]] = None,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        """
+        Args:
+            max_tokens (int, optional): Budget of the assembled prompt. Defaults to 2048.
+            memo_share (float, optional): Largest share of the budget left after the message and
+                summary that memos may use; unused memo budget goes to history. Defaults to 0.3.
+            summary_tokens (int, optional): Size limit of the running summary. Defaults to 256.
+            recent_messages (int, optional): Latest history messages considered verbatim. Defaults to 12.
+            summarize_every (int, optional): Messages that must leave the recent window before the
+                summary is updated. Defaults to 4.
+            recency_half_life (float, optional): Age in messages at which a message's recency score
+                halves. Defaults to 4.
+            relevance_weight (float, optional): Weight of word overlap with the message in the score
+                of history messages; the rest is recency. Defaults to 0.3.
+            duplicate_overlap (float, optional): Share of an item's words found in one already chosen
+                item above which it is dropped as a duplicate. Defaults to 0.9.
+            min_fragment_tokens (int, optional): Smallest truncated item worth including. Defaults to 24.
+            summarizer (callable, optional): summarizer(previous summary, messages, max_tokens) -> str,
+                e.g. from `llm_summarizer`. Defaults to an extractive summary that needs no LLM call.
+            count_tokens (callable, optional): Token counter. Defaults to `estimate_tokens`.
+        """
+        self.max_tokens = max_tokens
+        self.memo_share = memo_share
+        self.summary_tokens = summary_tokens
+        self.recent_messages = recent_messages
+        self.summarize_every = summarize_every
+        self.recency_half_life = recency_half_life
+        self.relevance_weight = relevance_weight
+        self.duplicate_overlap = duplicate_overlap
+        self.min_fragment_tokens = min_fragment_tokens
+        self.summarizer = summarizer or self.extractive_summary
+        self.count_tokens = count_tokens
+
+    def extractive_summary(self, previous: str, messages: List[Dict], max_tokens: int) -> str:
+        """
+        Appends the first sentence of each message to the summary, dropping its oldest lines
+        once it exceeds `max_tokens`.
+        """
+        lines = previous.splitlines() if previous else []
+        for message in messages:
+            first_sentence = re.split(r"(?<=[.!?])\s", message['content'].strip(), maxsplit=1)[0]
+            line = truncate_to_tokens(f"{message.get('role', 'user').capitalize()}: {first_sentence}",
+                                      max(max_tokens // 4, 1), self.count_tokens)
+            if line:
+                lines.append(line)
+        while lines and self.count_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def update_summary(self, history: List[Dict], context: ConversationContext):
+        """
+        Folds the messages that have left the recent window into the conversation's summary.
+
+        Nothing happens until at least `summarize_every` messages are waiting, so the
+        summarizer runs every few turns, on only the new messages.
+        """
+        with context.lock:
+            window_start = max(len(history) - self.recent_messages, 0)
+            if window_start - context.summarized < self.summarize_every:
+                return
+            pending = history[context.summarized:window_start]
+            try:
+                summary = self.summarizer(context.summary, pending, self.summary_tokens)
+            except Exception as e:
+                # The messages stay pending and are retried with the next update
+                logger.error(f"CONTEXT-ASSEMBLER: Error in summarizing history: {e}")
+                return
+            context.summary = truncate_to_tokens(summary, self.summary_tokens, self.count_tokens)
+            context.summarized = window_start
+
+    def trim_history(self, history: List[Dict], context: ConversationContext, max_messages: int) -> int:
+        """
+        Deletes the oldest messages beyond `max_messages`, but only ones the summary already covers.
+
+        Returns:
+            int: The number of messages deleted.
+        """
+        with context.lock:
+            drop = min(len(history) - max_messages, context.summarized)
+            if drop <= 0:
+                return 0
+            del history[:drop]
+            context.summarized -= drop
+            return drop
+
+    def _is_duplicate(self, words: set, chosen: List[set]) -> bool:
+        if not words:
+            return True
+        return any(len(words & other) >= self.duplicate_overlap * len(words) for other in chosen)
+
+    def _fill(self, candidates: Iterable, budget: int, chosen: List[set], stats: Dict) -> List:
+        """
+        Takes (score, text, item) candidates by descending score while they fit in `budget`.
+
+        Returns:
+            list: (text, item) pairs in selection order; texts may be truncated.
+        """
+        selected = []
+        for _, text, item in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+            words = _words(text)
+            if self._is_duplicate(words, chosen):
+                stats['duplicates'] += 1
+                continue
+            cost = self.count_tokens(text)
+            if cost > budget:
+                if budget < self.min_fragment_tokens:
+                    stats['dropped'] += 1
+                    continue
+                text = truncate_to_tokens(text, budget, self.count_tokens)
+                cost = self.count_tokens(text)
+                stats['truncated'] += 1
+            selected.append((text, item))
+            chosen.append(words)
+            budget -= cost
+            stats['tokens'] += cost
+        return selected
+
+    def select_memos(self, memos: List[Dict], max_tokens: Optional[int] = None,
+                     chosen: Optional[List[set]] = None, stats: Optional[Dict] = None) -> List[Dict]:
+        """
+        Ranks memos by relevance (lowest distance first), drops duplicates and fits them in `max_tokens`.
+
+        Memos are measured and compared as rendered by `memo_text`, input and output together.
+
+        Returns:
+            list: The chosen memos, most relevant first, each with its rendered (possibly truncated) 'text'.
+        """
+        stats = stats if stats is not None else {'tokens': 0, 'dropped': 0, 'truncated': 0, 'duplicates': 0}
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        candidates = [(-memo.get('distance', 0.0), memo_text(memo), memo) for memo in memos]
+        return [dict(memo, text=text)
+                for text, memo in self._fill(candidates, budget, chosen if chosen is not None else [], stats)]
+
+    def assemble(self, user_input: str, history: Optional[List[Dict]] = None, memos: Optional[List[Dict]] = None,
+                 context: Optional[ConversationContext] = None) -> Dict:
+        """
+        Builds the prompt messages for `user_input`.
+
+        Args:
+            user_input (str): The current user message.
+            history (list, optional): Earlier {'role', 'content'} messages, oldest first.
+            memos (list, optional): Retrieved memos, as returned by `MemoStore.get_related_memos`.
+            context (ConversationContext, optional): The conversation's state. Without one the
+                summary is recomputed on every call.
+
+        Returns:
+            dict: 'messages' (system messages, chosen history in order, then the user message),
+                'tokens' (estimated prompt size), and 'dropped', 'truncated' and 'duplicates' counts.
+        """
+        history = history or []
+        context = context or ConversationContext()
+        self.update_summary(history, context)
+        stats = {'tokens': self.count_tokens(user_input), 'dropped': 0, 'truncated': 0, 'duplicates': 0}
+        chosen = [_words(user_input)]
+        messages = []
+
+        summary = context.summary
+        if summary and stats['tokens'] + self.count_tokens(SUMMARY_HEADER + summary) <= self.max_tokens:
+            messages.append({'role': 'system', 'content': f"{SUMMARY_HEADER}\n{summary}"})
+            stats['tokens'] += self.count_tokens(SUMMARY_HEADER + summary)
+
+        remaining = self.max_tokens - stats['tokens']
+        memo_budget = int(remaining * self.memo_share) - self.count_tokens(MEMO_HEADER)
+        if memos and memo_budget > 0:
+            before = stats['tokens']
+            selected = self.select_memos(memos, memo_budget, chosen, stats)
+            if selected:
+                stats['tokens'] += self.count_tokens(MEMO_HEADER)
+                messages.append({'role': 'system', 'content': MEMO_HEADER + "\n" + "\n".join(
+                    f"- {memo['text']}" for memo in selected)})
+            remaining -= stats['tokens'] - before
+
+        # Only messages the summary does not cover yet are candidates, including ones that have
+        # left the recent window but wait for the next summary update
+        query_words = chosen[0]
+        candidates = []
+        for position in range(context.summarized, len(history)):
+            message = history[position]
+            age = len(history) - 1 - position
+            recency = 0.5 ** (age / self.recency_half_life)
+            words = _words(message['content'])
+            relevance = len(words & query_words) / len(query_words) if query_words else 0.0
+            score = (1.0 - self.relevance_weight) * recency + self.relevance_weight * relevance
+            candidates.append((score, message['content'], position))
+        selected = self._fill(candidates, remaining, chosen, stats)
+        for text, position in sorted(selected, key=lambda pair: pair[1]):
+            messages.append({'role': history[position].get('role', 'user'), 'content': text})
+
+        messages.append({'role': 'user', 'content': user_input})
+        metrics.observe("axys_context_tokens", stats['tokens'], "Estimated tokens of assembled LLM prompts.",
+                        buckets=(128, 256, 512, 1024, 2048, 4096, 8192))
+        return dict(stats, messages=messages)
+
+
+def llm_summarizer(backend, instruction: str = "Update the running summary of this conversation. "
+                                               "Keep facts, names, preferences and open questions."):
+    """
+    Returns a summarizer for ContextAssembler that asks the LLM to fold new messages into the summary.
+
+    Args:
+        backend (LLMBackend): Anything with `complete(prompt)`.
+        instruction (str, optional): The summarization instruction.
+    """
+    def summarize(previous: str, messages: List[Dict], max_tokens: int) -> str:
+        transcript = "\n".join(f"{message.get('role', 'user').capitalize()}: {message['content']}"
+                               for message in messages)
+        prompt = (f"{instruction} Use at most {max_tokens} tokens.\n\n"
+                  f"Current summary:\n{previous or '(empty)'}\n\nNew messages:\n{transcript}\n\nUpdated summary:")
+        return backend.complete(prompt).strip()
+    return summarize
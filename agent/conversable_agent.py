@@ -4,10 +4,13 @@
 # Filepath: `/agent/conversable_agent.py`
 # Updated: 10-28-2023
 
-import openai
+import time
+import threading
 from autogen.agentchat import ConversableAgent
-from typing import List, Dict, Optional, Callable, Union
+from typing import List, Dict, Optional, Callable, Union, Iterator
 from db.database import MemoStore
+from .llm_backend import OpenAICompletionBackend, read_stream
+from .context_assembler import render_prompt
 from ..main import logger
 from ops.config import get_api_key_for_model, get_misc_api_key
 
@@ -21,10 +24,16 @@ class ConversableAgent(ConversableAgent):
     def __init__(self, name: str = "ConversableAgent",
                  system_message: Optional[str] = "You are a helpful AI Assistant eager to learn and have conversations.",
                  human_input_mode: Optional[str] = "TERMINATE",
-                 llm_config: Optional[Union[Dict, bool]] = None):
+                 llm_config: Optional[Union[Dict, bool]] = None,
+                 backend=None,
+                 response_cache=None):
         super().__init__(name=name, system_message=system_message,
                          human_input_mode=human_input_mode, llm_config=llm_config)
         self.chat_history: List[Dict] = []  # Added type hint
+        # Anything with `complete(prompt)` and `stream(prompt)`, e.g. llm_backend.StubBackend for offline runs
+        self.backend = backend or OpenAICompletionBackend()
+        # Optional db.response_cache.ResponseCache consulted before every LLM call
+        self.response_cache = response_cache
 
     def get_human_input(self, prompt: str) -> str:
         try:
@@ -35,20 +44,89 @@ class ConversableAgent(ConversableAgent):
                 f"CONVERSABLE-AGENT: Error in getting human input: {e}")
             return f"CONVERSABLE-AGENT: Sorry, I couldn't get your input. Error: {e}"
 
-    def generate_reply(self, messages: Optional[List[Dict]] = None) -> Union[str, Dict, None]:
-        if self.llm_config:
-            try:
-                response = openai.Completion.create(
-                    engine="gpt-4",
-                    prompt=messages[-1]['content'] if messages else '',
-                    max_tokens=150
-                )
-                logger.info("CONVERSABLE-AGENT: Successfully generated reply.")
-                return response.choices[0].text.strip()
-            except Exception as e:
-                logger.error(
-                    f"CONVERSABLE-AGENT: Error in generating reply: {e}")
-                return f"CONVERSABLE-AGENT: Sorry, I couldn't generate a response. Error: {e}"
-        else:
+    def generate_reply(self, messages: Optional[List[Dict]] = None, stream: bool = False,
+                       cancel_event: Optional[threading.Event] = None,
+                       timeout: Optional[float] = None) -> Union[str, Dict, None, Iterator[str]]:
+        """
+        Generates a reply to the last message.
+
+        Args:
+            messages (list, optional): The conversation so far, e.g. as assembled by ContextAssembler.
+                Replies are cached by the prompt sent to the LLM. Only a lone message is also
+                matched by meaning; with history, a summary or memos only the same prompt hits.
+            stream (bool, optional): Return an iterator of text chunks as they arrive instead of
+                the whole reply. Defaults to False.
+            cancel_event (threading.Event, optional): When set, a streamed reply stops at once and
+                its request is closed.
+            timeout (float, optional): Seconds a streamed reply may take; past it the stream raises
+                TimeoutError. Unlimited if None.
+        """
+        if not self.llm_config:
             logger.error("CONVERSABLE-AGENT: I'm not configured to reply.")
-            return "CONVERSABLE-AGENT: I'm not configured to reply."
+            reply = "CONVERSABLE-AGENT: I'm not configured to reply."
+            return iter([reply]) if stream else reply
+
+        prompt = messages[-1]['content'] if messages else ''
+        # A lone message is sent as is; history and summaries are rendered into one prompt
+        standalone = not messages or len(messages) == 1
+        llm_prompt = prompt if standalone else render_prompt(messages)
+        # A similar message with different history or memos can need a different reply
+        cached = self._cached_reply(llm_prompt, semantic=standalone)
+        if cached is not None:
+            return iter([cached]) if stream else cached
+        if stream:
+            return self._stream_reply(llm_prompt, cancel_event, timeout, semantic=standalone)
+        try:
+            start = time.perf_counter()
+            reply = self.backend.complete(llm_prompt)
+            logger.debug("CONVERSABLE-AGENT: Successfully generated reply.")
+            self._cache_reply(llm_prompt, reply, time.perf_counter() - start, semantic=standalone)
+            return reply
+        except Exception as e:
+            logger.error(
+                f"CONVERSABLE-AGENT: Error in generating reply: {e}")
+            return f"CONVERSABLE-AGENT: Sorry, I couldn't generate a response. Error: {e}"
+
+    def _stream_reply(self, llm_prompt: str, cancel_event: Optional[threading.Event],
+                      timeout: Optional[float] = None, semantic: bool = True) -> Iterator[str]:
+        start = time.perf_counter()
+        received = []
+        try:
+            # Closes the underlying request (e.g. the HTTP stream) on cancel or timeout
+            for chunk in read_stream(self.backend.stream(llm_prompt), cancel_event, timeout):
+                received.append(chunk)
+                yield chunk
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("CONVERSABLE-AGENT: Streamed reply cancelled.")
+                return
+            logger.debug("CONVERSABLE-AGENT: Successfully streamed reply.")
+            # Only complete replies are cached
+            self._cache_reply(llm_prompt, "".join(received), time.perf_counter() - start, semantic=semantic)
+        except TimeoutError:
+            raise
+        except Exception as e:
+            logger.error(
+                f"CONVERSABLE-AGENT: Error in streaming reply: {e}")
+            yield f"CONVERSABLE-AGENT: Sorry, I couldn't generate a response. Error: {e}"
+
+    def _cached_reply(self, prompt: str, semantic: bool = True) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        try:
+            reply = self.response_cache.get(prompt, semantic=semantic)
+        except Exception as e:
+            logger.error(
+                f"CONVERSABLE-AGENT: Error in looking up the response cache: {e}")
+            return None
+        if reply is not None:
+            logger.debug("CONVERSABLE-AGENT: Answered from the response cache.")
+        return reply
+
+    def _cache_reply(self, prompt: str, reply: str, latency: float, semantic: bool = True):
+        if self.response_cache is None:
+            return
+        try:
+            self.response_cache.put(prompt, reply, latency, semantic=semantic)
+        except Exception as e:
+            logger.error(
+                f"CONVERSABLE-AGENT: Error in storing reply in the response cache: {e}")
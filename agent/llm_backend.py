@@ -0,0 +1,406 @@
+# OpenMindAI
+# Version: AXYS
+# Module: LLM Backend
+# Filepath: `/agent/llm_backend.py`
+# Updated: 10-28-2023
+
+import time
+import queue
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, List, Optional
+from ops.config import logger
+from ops.metrics import metrics
+
+
+def retry_with_backoff(func, retry_on=(Exception,), max_retries=3, base_delay=0.5, max_delay=8.0):
+    """
+    Calls `func()` and retries transient failures with exponential backoff and full jitter.
+
+    The n-th retry sleeps a random time between 0 and min(max_delay, base_delay * 2**n), so
+    many clients that fail together do not retry together.
+
+    Args:
+        func (callable): The call to make.
+        retry_on (tuple, optional): Exception types worth retrying. Defaults to every Exception.
+        max_retries (int, optional): Retries after the first attempt. Defaults to 3.
+        base_delay (float, optional): Backoff ceiling of the first retry, in seconds. Defaults to 0.5.
+        max_delay (float, optional): Largest backoff ceiling, in seconds. Defaults to 8.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except retry_on as e:
+            if attempt == max_retries:
+                raise
+            metrics.inc("axys_llm_retries_total", help_text="LLM requests retried after a transient error.")
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.warning(
+                f"LLM-BACKEND: Attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s.")
+            time.sleep(delay)
+
+
+def read_stream(chunks, cancel_event=None, timeout=None, poll_interval=0.05):
+    """
+    Yields from a blocking chunk iterator until it ends, `cancel_event` is set or `timeout` expires.
+
+    A helper thread reads the chunks, so a cancel or timeout takes effect within
+    `poll_interval` instead of at the next chunk. Once its pending read returns, the helper
+    closes `chunks`, which ends the underlying request and frees its concurrency slot.
+
+    Args:
+        chunks (iterator): E.g. the result of `LLMBackend.stream`.
+        cancel_event (threading.Event, optional): Stops the stream quietly when set.
+        timeout (float, optional): Seconds the whole stream may take. Unlimited if None.
+        poll_interval (float, optional): Seconds between cancel checks. Defaults to 0.05.
+
+    Raises:
+        TimeoutError: If the stream ran past `timeout` seconds.
+    """
+    buffer = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                buffer.put((True, chunk))
+        except Exception as e:
+            buffer.put((False, e))
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            buffer.put(None)
+
+    threading.Thread(target=pump, name="llm-stream", daemon=True).start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while cancel_event is None or not cancel_event.is_set():
+            wait = poll_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Streamed reply exceeded its {timeout}s timeout.")
+                wait = min(wait, remaining)
+            try:
+                item = buffer.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            ok, value = item
+            if not ok:
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+
+class LLMBackend:
+    """
+    Interface the agents use to reach an LLM.
+
+    Subclasses implement `complete`; `complete_many` and `stream` fall back to it. At most
+    `max_concurrency` requests run at once per backend, however many sessions share it.
+    """
+
+    def __init__(self, max_concurrency: int = 8):
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def complete_many(self, prompts: List[str]) -> List[str]:
+        """
+        Completes several prompts. Backends that can send them in one request override this.
+        """
+        return [self.complete(prompt) for prompt in prompts]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Yields the completion chunk by chunk. Defaults to one chunk holding the whole reply.
+        """
+        yield self.complete(prompt)
+
+    def close(self):
+        pass
+
+
+class OpenAICompletionBackend(LLMBackend):
+    """
+    Sends prompts to the OpenAI completion API over one pooled HTTP session.
+
+    The session keeps connections alive between requests instead of opening a new TLS
+    connection per message. Rate limits, timeouts and server errors are retried with jittered
+    backoff. `complete_many` sends a whole batch of prompts in one request.
+    """
+
+    # openai.error classes worth retrying; looked up by name since openai is imported lazily
+    RETRYABLE_ERRORS = ("RateLimitError", "APIConnectionError", "Timeout",
+                        "ServiceUnavailableError", "TryAgain", "APIError")
+
+    def __init__(self, engine: str = "gpt-4", max_tokens: int = 150, max_concurrency: int = 8,
+                 max_retries: int = 3, request_timeout: float = 60.0):
+        """
+        Args:
+            engine (str, optional): Completion model. Defaults to "gpt-4".
+            max_tokens (int, optional): Tokens per completion. Defaults to 150.
+            max_concurrency (int, optional): Requests in flight at once, and the size of the
+                connection pool. Defaults to 8.
+            max_retries (int, optional): Retries of a failed request. Defaults to 3.
+            request_timeout (float, optional): Seconds before a request is abandoned. Defaults to 60.
+        """
+        super().__init__(max_concurrency)
+        self.engine = engine
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self._openai = None
+        self._session = None
+        self._retry_on = (Exception,)
+        self._init_lock = threading.Lock()
+
+    @property
+    def openai(self):
+        # Imported and set up on first request, keeping it off the startup path
+        if self._openai is None:
+            with self._init_lock:
+                if self._openai is None:
+                    import openai
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+                    session.mount("https://", adapter)
+                    openai.requestssession = session
+                    self._session = session
+                    self._retry_on = tuple(
+                        getattr(openai.error, name) for name in self.RETRYABLE_ERRORS
+                        if hasattr(openai.error, name)) or (Exception,)
+                    self._openai = openai
+        return self._openai
+
+    def _send(self, **kwargs):
+        return self.openai.Completion.create(
+            engine=self.engine, max_tokens=self.max_tokens,
+            request_timeout=self.request_timeout, **kwargs)
+
+    def _attempt(self, **kwargs):
+        # A slot is held per attempt, so backoff sleeps leave it to other requests
+        with self._slots:
+            return self._send(**kwargs)
+
+    def _create(self, **kwargs):
+        self.openai  # Sets up the client and `_retry_on` first
+        with metrics.span("axys_llm_request_seconds", "LLM request latency, including retries.",
+                          backend="openai"):
+            return retry_with_backoff(
+                lambda: self._attempt(**kwargs), retry_on=self._retry_on, max_retries=self.max_retries)
+
+    def _open_stream(self, **kwargs):
+        # Returns holding a slot, which the stream releases when it is closed
+        self._slots.acquire()
+        try:
+            return self._send(stream=True, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def complete(self, prompt: str) -> str:
+        return self._create(prompt=prompt).choices[0].text.strip()
+
+    def complete_many(self, prompts: List[str]) -> List[str]:
+        if not prompts:
+            return []
+        response = self._create(prompt=list(prompts))
+        replies = [""] * len(prompts)
+        for choice in response.choices:
+            replies[choice.index] = choice.text.strip()
+        return replies
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Yields the completion chunk by chunk as the API produces it.
+
+        Only opening the stream is retried; a stream that breaks part-way raises. The request
+        holds its concurrency slot until the stream ends or is closed.
+        """
+        self.openai  # Sets up the client and `_retry_on` first
+        with metrics.span("axys_llm_request_seconds", "LLM request latency, including retries.",
+                          backend="openai"):
+            response = retry_with_backoff(
+                lambda: self._open_stream(prompt=prompt), retry_on=self._retry_on,
+                max_retries=self.max_retries)
+        try:
+            for chunk in response:
+                text = chunk.choices[0].text
+                if text:
+                    yield text
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class StubBackend(LLMBackend):
+    """
+    Local stand-in for the LLM that emits tokens with configurable delays.
+
+    Useful for exercising streaming, cancellation, batching and load without network access
+    or API keys. A batch costs about as much as its longest reply, as with a real batched request.
+    """
+
+    def __init__(self, reply: Optional[str] = None, first_token_delay: float = 0.2,
+                 token_delay: float = 0.05, max_concurrency: int = 8):
+        """
+        Args:
+            reply (str, optional): Fixed reply text. Defaults to echoing the prompt.
+            first_token_delay (float, optional): Seconds before the first token. Defaults to 0.2.
+            token_delay (float, optional): Seconds between later tokens. Defaults to 0.05.
+            max_concurrency (int, optional): Requests served at once. Defaults to 8.
+        """
+        super().__init__(max_concurrency)
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.requests = 0
+        self._stats_lock = threading.Lock()
+
+    def _tokens(self, prompt: str):
+        text = self.reply if self.reply is not None else f"You said: {prompt}"
+        words = text.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def complete(self, prompt: str) -> str:
+        return self.complete_many([prompt])[0]
+
+    def complete_many(self, prompts: List[str]) -> List[str]:
+        tokens = [self._tokens(prompt) for prompt in prompts]
+        longest = max((len(reply) for reply in tokens), default=0)
+        with self._slots, metrics.span("axys_llm_request_seconds", "LLM request latency, including retries.",
+                                       backend="stub"):
+            with self._stats_lock:
+                self.requests += 1
+            time.sleep(self.first_token_delay + self.token_delay * max(longest - 1, 0))
+        return ["".join(reply) for reply in tokens]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        with self._slots:
+            with self._stats_lock:
+                self.requests += 1
+            for i, token in enumerate(self._tokens(prompt)):
+                time.sleep(self.first_token_delay if i == 0 else self.token_delay)
+                yield token
+
+
+class MicroBatcher(LLMBackend):
+    """
+    Coalesces concurrent `complete` calls into batched requests to another backend.
+
+    Each call waits in a queue; a background thread collects whatever arrives within
+    `max_wait` seconds of the first waiting prompt (up to `max_batch_size`) and sends it with
+    one `complete_many` on a fixed pool of `max_concurrency` threads. Under load from many
+    sessions this turns N requests into N / batch size requests at the cost of at most
+    `max_wait` extra latency. Streams are not batched.
+    """
+
+    def __init__(self, backend: LLMBackend, max_batch_size: int = 16, max_wait: float = 0.01):
+        """
+        Args:
+            backend (LLMBackend): Backend that serves the batches.
+            max_batch_size (int, optional): Prompts per batched request. Defaults to 16.
+            max_wait (float, optional): Seconds to wait for a batch to fill. Defaults to 0.01.
+        """
+        super().__init__(backend.max_concurrency)
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_prompts = 0
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = False
+        # Batches beyond the backend's concurrency would only wait for its slots
+        self._senders = ThreadPoolExecutor(
+            max_workers=backend.max_concurrency, thread_name_prefix="llm-micro-batch")
+        self._thread = threading.Thread(
+            target=self._run, name="llm-micro-batcher", daemon=True)
+        self._thread.start()
+
+    def complete(self, prompt: str) -> str:
+        return self.complete_many([prompt])[0]
+
+    def complete_many(self, prompts: List[str]) -> List[str]:
+        if self._closed:
+            raise RuntimeError("Micro-batcher is closed.")
+        futures = []
+        for prompt in prompts:
+            future = Future()
+            self._queue.put((prompt, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        return self.backend.stream(prompt)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            requests = [item for item in batch if item is not None]
+            if requests:
+                # Sent from the pool so a slow batch does not hold up the next one
+                self._senders.submit(self._send, requests)
+            if stop:
+                return
+
+    def _send(self, requests):
+        with self._stats_lock:
+            self.batches += 1
+            self.batched_prompts += len(requests)
+        metrics.observe("axys_llm_batch_size", len(requests), "Prompts per micro-batched LLM request.",
+                        buckets=(1, 2, 4, 8, 16, 32, 64))
+        try:
+            replies = self.backend.complete_many([prompt for prompt, _ in requests])
+        except Exception as e:
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        for (_, future), reply in zip(requests, replies):
+            future.set_result(reply)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'prompts': self.batched_prompts,
+            'mean_batch_size': self.batched_prompts / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._senders.shutdown(wait=True)
+        logger.info("LLM-BACKEND: Micro-batcher closed after %d batches (%.1f prompts per batch).",
+                    self.batches, self.stats()['mean_batch_size'])
+        self.backend.close()
@@ -6,7 +6,8 @@
 
 from autogen.agentchat.contrib import TeachableAgent as AutoGenTeachableAgent
 from typing import List, Dict, Optional, Callable, Union
-from db.database import MemoStore
+from db.sharding import memo_store_from_config
+from .context_assembler import ContextAssembler, memo_text
 from ..main import logger
 from ops.config import get_api_key_for_model, get_misc_api_key
 
@@ -22,16 +23,18 @@ class TeachableAgent(AutoGenTeachableAgent):
                  **kwargs):
         super().__init__(name=name, system_message=system_message, human_input_mode=human_input_mode, llm_config=llm_config,
                          teach_config=teach_config, **kwargs)
+        teach_config = teach_config or {}
         self.analyzer_llm_config = analyzer_llm_config
+        # Memos recalled into the chat context, bounded by a token budget
+        self.context_memos = []
+        self.context_assembler = ContextAssembler(
+            max_tokens=teach_config.get("memo_context_tokens", 512))
         self.initialize_memostore(teach_config)
 
     def initialize_memostore(self, teach_config):
+        teach_config = teach_config or {}
         try:
-            self.memo_store = MemoStore(
-                verbosity=teach_config.get("verbosity", 0),
-                reset=teach_config.get("reset_db", False),
-                path_to_db_dir=teach_config.get("path_to_db_dir", "/db/app.db")
-            )
+            self.memo_store = memo_store_from_config(teach_config)
             logger.info("TEACHABLE-AGENT: Successfully initialized MemoStore.")
         except Exception as e:
             logger.error(
@@ -52,7 +55,7 @@ class TeachableAgent(AutoGenTeachableAgent):
 
     def close_db(self):
         """
-        Cleanly closes the memo store.
+        Cleanly closes the memo store, flushing any queued memo writes first.
         """
         try:
             self.memo_store.close()
@@ -80,40 +83,75 @@ class TeachableAgent(AutoGenTeachableAgent):
         Reviews the user comments from the last chat,
         and decides what teachings to store as memos.
         """
-        for message in self.chat_history:
-            if message['role'] == 'user':
-                comment = message['content']
-                # Analyzing user comment to decide what to store
-                self.consider_memo_storage(comment)
+        # Analyzing user comments to decide what to store, then storing them in batches
+        memos = (
+            (message['content'], "Sample Output") for message in self.chat_history
+            if message['role'] == 'user' and self.is_worth_storing(message['content'])
+        )
+        self.memo_store.add_many(memos)
 
-    def consider_memo_storage(self, comment):
+    def is_worth_storing(self, comment):
         """
-        Decides whether to store something from one user comment in the DB.
+        Decides whether one user comment is worth storing as a memo.
 
         Args:
             comment (str): The user comment.
         """
         # Example logic to decide whether to store the comment
-        if len(comment.split()) > 3:
-            self.memo_store.add_input_output_pair(comment, "Sample Output")
+        return len(comment.split()) > 3
+
+    def consider_memo_storage(self, comment, user_id=None, session_id=None):
+        """
+        Decides whether to store something from one user comment in the DB.
+
+        Args:
+            comment (str): The user comment.
+            user_id (str, optional): The user who made the comment.
+            session_id (str, optional): The chat session the comment was made in.
+        """
+        # Queued for the background writer, so embedding and committing stay off the user's request path
+        if self.is_worth_storing(comment):
+            self.memo_store.queue_memo(comment, "Sample Output", source="chat",
+                                       user_id=user_id, session_id=session_id)
+
+    def recall_memos(self, comment, user_id=None):
+        """
+        Decides whether to retrieve memos from the DB for one user comment, and returns them.
 
-    def consider_memo_retrieval(self, comment):
+        Args:
+            comment (str): The user comment.
+            user_id (str, optional): Only recall memos of this user.
+
+        Returns:
+            list: The relevant memos, or [] if the comment needs none.
+        """
+        # Placeholder logic to decide whether to retrieve memos
+        if "recall" not in comment.lower():
+            return []
+        return self.retrieve_relevant_memos(comment, user_id=user_id)
+
+    def consider_memo_retrieval(self, comment, user_id=None):
         """
         Decides whether to retrieve memos from the DB, 
         and add them to the chat context.
+
+        Args:
+            comment (str): The user comment.
+            user_id (str, optional): Only recall memos of this user.
         """
-        # Placeholder logic to decide whether to retrieve memos
-        if "recall" in comment.lower():
-            relevant_memos = self.retrieve_relevant_memos(comment)
-            concatenated_memos = self.concatenate_memo_texts(relevant_memos)
-            self.chat_context += concatenated_memos
+        relevant_memos = self.recall_memos(comment, user_id=user_id)
+        if relevant_memos:
+            # The most relevant recalled memos replace the rest once the budget is full
+            self.context_memos = self.context_assembler.select_memos(self.context_memos + relevant_memos)
+            self.chat_context = self.concatenate_memo_texts(self.context_memos)
 
-    def retrieve_relevant_memos(self, input_text):
+    def retrieve_relevant_memos(self, input_text, user_id=None):
         """
         Returns semantically related memos from the DB.
 
         Args:
             input_text (str): The input text.
+            user_id (str, optional): Only return memos of this user.
 
         Returns:
             list: A list of relevant memos.
@@ -121,7 +159,8 @@ class TeachableAgent(AutoGenTeachableAgent):
         return self.memo_store.get_related_memos(
             input_text,
             n_results=self.teach_config.get("max_num_retrievals", 10),
-            threshold=self.teach_config.get("recall_threshold", 1.5)
+            threshold=self.teach_config.get("recall_threshold", 1.5),
+            user_id=user_id
         )
 
     def concatenate_memo_texts(self, memo_list):
@@ -131,7 +170,7 @@ class TeachableAgent(AutoGenTeachableAgent):
         Args:
             memo_list (list): A list of memos.
         """
-        return ' '.join([memo['input_text'] for memo in memo_list])
+        return '\n'.join([memo.get('text') or memo_text(memo) for memo in memo_list])
 
     def start_chat(self):
         """
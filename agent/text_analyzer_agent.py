@@ -6,6 +6,7 @@
 
 from autogen.agentchat.contrib import TextAnalyzerAgent
 from typing import List, Dict, Optional, Callable, Union
+from .llm_backend import OpenAICompletionBackend
 from ..main import logger
 from ops.config import get_api_key_for_model, get_misc_api_key
 
@@ -17,9 +18,12 @@ class TextAnalyzerAgent(TextAnalyzerAgent):
                  human_input_mode: Optional[str] = "NEVER",
                  llm_config: Optional[Union[Dict, bool]] = None,
                  teach_config: Optional[Dict] = None,
+                 backend=None,
                  **kwargs):
         super().__init__(name=name, system_message=system_message, human_input_mode=human_input_mode, llm_config=llm_config,
                          teach_config=teach_config, **kwargs)
+        # Shared with the ConversableAgent by AgentManager, so both use one pool and batcher
+        self.backend = backend or OpenAICompletionBackend()
 
     def analyze(self, text_to_analyze, analysis_instructions):
         """
@@ -29,7 +33,11 @@ class TextAnalyzerAgent(TextAnalyzerAgent):
             text_to_analyze (str): The text to be analyzed.
             analysis_instructions (str): Instructions for analysis.
         """
-        # TextAnalyzerAgent must be initialized elsewhere
-        analysis_result = TextAnalyzerAgent.analyze(
-            text_to_analyze, analysis_instructions)
-        return analysis_result
+        prompt = f"{analysis_instructions}\n\nTEXT:\n{text_to_analyze}"
+        try:
+            analysis_result = self.backend.complete(prompt)
+            logger.debug("TEXT-ANALYZER-AGENT: Successfully analyzed text.")
+            return analysis_result
+        except Exception as e:
+            logger.error(f"TEXT-ANALYZER-AGENT: Error in analyzing text: {e}")
+            raise
@@ -0,0 +1,57 @@
+# OpenMindAI
+# Version: AXYS
+# Module: LLM Backend Throughput Benchmark
+# Filepath: `/bench/llm_throughput.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from agent.llm_backend import StubBackend, MicroBatcher  # noqa: E402
+
+
+def run(backend, n_requests, n_clients):
+    """
+    Sends `n_requests` prompts from `n_clients` concurrent callers. Returns requests per second.
+    """
+    prompts = [f"question {i}" for i in range(n_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        list(executor.map(backend.complete, prompts))
+    return n_requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare LLM throughput with and without micro-batching, against the stub backend.")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Requests the backend serves at once.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Seconds the stub takes to answer a request.")
+    parser.add_argument("--max-wait", type=float, default=0.01,
+                        help="Micro-batch window in seconds.")
+    args = parser.parse_args()
+
+    def stub():
+        return StubBackend(first_token_delay=args.latency, token_delay=0.0,
+                           max_concurrency=args.concurrency)
+
+    print(f"{args.requests} requests, {args.latency * 1000:.0f} ms per LLM request (requests/s)")
+    print(f"{'clients':>8} {'direct':>10} {'micro-batched':>15} {'mean batch':>12}")
+    for n_clients in args.clients:
+        direct = run(stub(), args.requests, n_clients)
+        batcher = MicroBatcher(stub(), max_wait=args.max_wait)
+        batched = run(batcher, args.requests, n_clients)
+        mean_batch = batcher.stats()['mean_batch_size']
+        batcher.close()
+        print(f"{n_clients:>8} {direct:>10.1f} {batched:>15.1f} {mean_batch:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
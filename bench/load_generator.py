@@ -0,0 +1,371 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Chat Load Generator
+# Filepath: `/bench/load_generator.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from agent.llm_backend import LLMBackend  # noqa: E402
+from agent.context_assembler import ConversationContext  # noqa: E402
+from bench.memo_store import FakeEmbeddingModel, make_texts, summarize_latencies  # noqa: E402
+from db.database import MemoStore  # noqa: E402
+from db.embedding_model import register_model  # noqa: E402
+from ops.chat_manager import ChatManager  # noqa: E402
+
+STUB_MODEL_NAME = "load-test-embedding"
+
+
+class LatencyDistribution:
+    """
+    Samples simulated latencies in seconds.
+
+    Specs: "0" (no delay), "fixed:S", "uniform:A,B" or "lognormal:MEDIAN,SIGMA".
+    """
+
+    def __init__(self, spec, seed=None):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",")] if params else []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        if kind not in ("0", "fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.params)
+            if self.kind == "lognormal":
+                median, sigma = self.params
+                return self._rng.lognormvariate(np.log(median), sigma)
+            return 0.0
+
+    def sleep(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SimulatedLLM(LLMBackend):
+    """
+    LLM backend whose every request takes a latency drawn from a distribution.
+    """
+
+    def __init__(self, latency, max_concurrency=64):
+        super().__init__(max_concurrency)
+        self.latency = latency
+
+    def complete(self, prompt):
+        with self._slots:
+            self.latency.sleep()
+        return f"Simulated reply to: {prompt[:40]}"
+
+
+class SimulatedEmbeddingModel(FakeEmbeddingModel):
+    """
+    Deterministic fake embedding model that also takes a simulated latency per encode call.
+    """
+
+    def __init__(self, latency, dim=384):
+        super().__init__(dim)
+        self.latency = latency
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        self.latency.sleep()
+        return super().encode(sentences, batch_size=batch_size, **kwargs)
+
+
+class StageTimes:
+    """
+    Thread-safe collection of per-stage latencies.
+    """
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return wrapper
+
+    def drain(self):
+        with self._lock:
+            samples, self._samples = self._samples, defaultdict(list)
+        return samples
+
+
+# Stand-ins for the three agents. They call the same backend and MemoStore methods as
+# ConversableAgent, TeachableAgent and TextAnalyzerAgent, without autogen or API keys.
+class _Conversable:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_reply(self, messages=None, **kwargs):
+        return self.backend.complete(messages[-1]['content'] if messages else '')
+
+
+class _Analyzer:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def analyze(self, text_to_analyze, analysis_instructions):
+        return self.backend.complete(f"{analysis_instructions}\n\nTEXT:\n{text_to_analyze}")
+
+
+class _Teachable:
+    def __init__(self, memo_store):
+        self.memo_store = memo_store
+
+    def consider_memo_storage(self, comment, user_id=None, session_id=None):
+        # TeachableAgent.consider_memo_storage, which only queues the memo for the background writer
+        if len(comment.split()) > 3:
+            self.memo_store.queue_memo(comment, "Sample Output", source="chat",
+                                       user_id=user_id, session_id=session_id)
+
+    def recall_memos(self, comment, user_id=None):
+        # TeachableAgent.recall_memos, run by ChatManager before the reply
+        if "recall" not in comment.lower():
+            return []
+        return self.memo_store.get_related_memos(comment, n_results=10, threshold=1.5, user_id=user_id)
+
+
+class LoadTestAgentManager:
+    """
+    AgentManager-compatible owner of the stand-in agents, timing every stage call.
+    """
+
+    def __init__(self, memo_store, llm, stage_times):
+        self.memo_store = memo_store
+        self.conversable = _Conversable(llm)
+        self.analyzer = _Analyzer(llm)
+        self.teachable = _Teachable(memo_store)
+        self.conversable.generate_reply = stage_times.timed("reply", self.conversable.generate_reply)
+        self.analyzer.analyze = stage_times.timed("analyze", self.analyzer.analyze)
+        self.teachable.consider_memo_storage = stage_times.timed(
+            "store", self.teachable.consider_memo_storage)
+        self.teachable.recall_memos = stage_times.timed("recall", self.teachable.recall_memos)
+
+    def warm_up(self, background=True):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def get_conversable_agent(self):
+        return self.conversable
+
+    def get_teachable_agent(self):
+        return self.teachable
+
+    def get_text_analyzer_agent(self):
+        return self.analyzer
+
+
+def load_transcripts(path):
+    """
+    Loads conversations to replay and returns them as lists of user messages.
+
+    Accepts a JSON file holding a list of conversations, or a JSONL file with one conversation
+    per line. A conversation is a list of strings or of {"role": ..., "content": ...} messages;
+    only user messages are replayed.
+    """
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            conversations = [json.loads(line) for line in f if line.strip()]
+        else:
+            conversations = json.load(f)
+    transcripts = []
+    for conversation in conversations:
+        messages = [message if isinstance(message, str) else message['content']
+                    for message in conversation
+                    if isinstance(message, str) or message.get('role', 'user') == 'user']
+        if messages:
+            transcripts.append(messages)
+    return transcripts
+
+
+def synthetic_transcripts(n, seed, recall_ratio=0.2, chit_chat_ratio=0.2, turns=8):
+    """
+    Returns `n` synthetic conversations mixing teachings, recall questions and short chit-chat.
+    """
+    rng = random.Random(seed)
+    teachings = make_texts(n * turns, seed)
+    chit_chat = ["hi", "thanks!", "ok cool", "sounds good", "what?"]
+    transcripts = []
+    for i in range(n):
+        messages = []
+        for text in teachings[i * turns:(i + 1) * turns]:
+            roll = rng.random()
+            if roll < recall_ratio:
+                messages.append(f"recall {text}")
+            elif roll < recall_ratio + chit_chat_ratio:
+                messages.append(rng.choice(chit_chat))
+            else:
+                messages.append(text)
+        transcripts.append(messages)
+    return transcripts
+
+
+def run_phase(chat_manager, transcripts, n_users, duration, think_time):
+    """
+    Runs `n_users` simulated users for `duration` seconds, each replaying transcripts in turn
+    with its own chat history. Returns per-message latencies and the number of errors.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def user(number):
+        history, context = [], ConversationContext()
+        conversation = number
+        user_id = f"user{number}"
+        while not stop.is_set():
+            for message in transcripts[conversation % len(transcripts)]:
+                if stop.is_set():
+                    return
+                start = time.perf_counter()
+                try:
+                    chat_manager.handle_user_input(message, chat_history=history, context=context,
+                                                   user_id=user_id, session_id=f"{user_id}-{conversation}")
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                think_time.sleep()
+            conversation += n_users
+            history = []
+
+    threads = [threading.Thread(target=user, args=(number,), daemon=True) for number in range(n_users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def grow_store(memo_store, target, seed, batch_size=1000):
+    """
+    Bulk-inserts synthetic memos until the store holds `target` memos.
+    """
+    current = len(memo_store.index)
+    missing = target - current
+    if missing > 0:
+        inputs = make_texts(missing, seed + current)
+        memo_store.add_many(((text, "Sample Output") for text in inputs), batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive ChatManager with concurrent simulated users against stub LLM and embedding backends.")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0,
+                        help="Seconds of load per memo-count phase.")
+    parser.add_argument("--memo-counts", type=int, nargs="+", default=[0, 10000, 100000],
+                        help="Memo counts to grow the store to before each phase.")
+    parser.add_argument("--transcripts", default=None,
+                        help="JSON/JSONL conversations to replay. Defaults to a synthetic mix.")
+    parser.add_argument("--recall-ratio", type=float, default=0.2,
+                        help="Share of synthetic messages that trigger a memo lookup.")
+    parser.add_argument("--llm-latency", default="lognormal:0.4,0.5",
+                        help="Per-request LLM latency: 0, fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA.")
+    parser.add_argument("--embed-latency", default="fixed:0.005",
+                        help="Per-encode-call embedding latency, same format.")
+    parser.add_argument("--think-time", default="0",
+                        help="Pause between a user's messages, same format.")
+    parser.add_argument("--pipeline-workers", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", default=None,
+                        help="Directory for the temporary database. Defaults to the system temp dir.")
+    parser.add_argument("--output", default=None,
+                        help="Write JSON results here.")
+    args = parser.parse_args()
+
+    register_model(STUB_MODEL_NAME, SimulatedEmbeddingModel(
+        LatencyDistribution(args.embed_latency, args.seed)))
+    llm = SimulatedLLM(LatencyDistribution(args.llm_latency, args.seed + 1))
+    think_time = LatencyDistribution(args.think_time, args.seed + 2)
+    transcripts = (load_transcripts(args.transcripts) if args.transcripts else
+                   synthetic_transcripts(max(args.users * 4, 64), args.seed, args.recall_ratio))
+
+    phases = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as temp_dir:
+        memo_store = MemoStore(reset=True, db_filename=os.path.join(temp_dir, "load.db"),
+                               model_name=STUB_MODEL_NAME)
+        stage_times = StageTimes()
+        chat_manager = ChatManager(LoadTestAgentManager(memo_store, llm, stage_times),
+                                   max_workers=args.pipeline_workers)
+        print(f"{args.users} users, {args.duration:.0f}s per phase, LLM {args.llm_latency}, "
+              f"embedding {args.embed_latency}", file=sys.stderr)
+        print(f"{'memos':>9} {'msg/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'analyze':>9} {'store':>9} {'recall':>9} {'reply':>9}  (stage p50 ms)", file=sys.stderr)
+        for memo_count in args.memo_counts:
+            grow_store(memo_store, memo_count, args.seed + 100)
+            memo_store.flush()
+            stage_times.drain()
+            latencies, errors, elapsed = run_phase(
+                chat_manager, transcripts, args.users, args.duration, think_time)
+            memo_store.flush()
+            stages = {stage: summarize_latencies(samples)
+                      for stage, samples in stage_times.drain().items()}
+            phase = {
+                'memo_count': memo_count,
+                'messages': len(latencies),
+                'errors': errors,
+                'throughput_msg_per_s': len(latencies) / elapsed,
+                'latency': summarize_latencies(latencies) if latencies else {},
+                'stages': stages,
+            }
+            phases.append(phase)
+            stage_p50 = [stages.get(stage, {}).get('p50_ms', float('nan'))
+                         for stage in ("analyze", "store", "recall", "reply")]
+            print(f"{memo_count:>9} {phase['throughput_msg_per_s']:>8.1f} "
+                  f"{phase['latency'].get('p50_ms', 0):>8.1f} {phase['latency'].get('p95_ms', 0):>8.1f} "
+                  f"{phase['latency'].get('p99_ms', 0):>8.1f} "
+                  + " ".join(f"{value:>9.1f}" for value in stage_p50), file=sys.stderr)
+        chat_manager.close()
+        memo_store.close()
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+        'phases': phases,
+    }
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# OpenMindAI
+# Version: AXYS
+# Module: MemoStore Benchmark
+# Filepath: `/bench/memo_store.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db.database import MemoStore  # noqa: E402
+from db.embedding_model import register_model  # noqa: E402
+
+FAKE_MODEL_NAME = "bench-fake-embedding"
+RESULTS_VERSION = 1
+
+
+class FakeEmbeddingModel:
+    """
+    Deterministic offline stand-in for SentenceTransformer.
+
+    Every word maps to a fixed random vector seeded by its CRC32, and a text embeds to the
+    sum of its word vectors. Texts sharing words are therefore close, so searches return
+    meaningful neighbours, and the same text embeds identically in every run and process.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._vectors = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _word_vector(self, word):
+        vector = self._vectors.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            self._vectors[word] = vector
+        return vector
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[row] += self._word_vector(word)
+        return embeddings[0] if single else embeddings
+
+
+def make_texts(n, seed, vocabulary_size=5000, words=(6, 16)):
+    """
+    Returns `n` deterministic pseudo-sentences drawn from a Zipf-like vocabulary.
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(vocabulary_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocabulary_size)]
+    return [" ".join(rng.choices(vocabulary, weights, k=rng.randint(*words))) for _ in range(n)]
+
+
+def summarize_latencies(samples):
+    """
+    Summarizes latencies in seconds as percentiles in milliseconds and throughput.
+    """
+    samples = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+        'ops_per_s': float(len(samples) / (samples.sum() / 1000.0)) if samples.sum() else 0.0,
+    }
+
+
+def _timed(func, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize_latencies(samples)
+
+
+def _db_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal", "-shm", ".ivf.npz")
+               if os.path.exists(path + suffix))
+
+
+def run_size(n_memos, index_mode="exact", n_ops=200, dim=384, seed=0, directory=None):
+    """
+    Benchmarks one MemoStore of `n_memos` memos. Meant to run in a fresh process, so that
+    peak RSS belongs to this size alone.
+    """
+    register_model(FAKE_MODEL_NAME, FakeEmbeddingModel(dim))
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        store = MemoStore(reset=True, db_filename=path, model_name=FAKE_MODEL_NAME,
+                          index_mode=index_mode)
+        inputs = make_texts(n_memos, seed)
+        outputs = make_texts(n_memos, seed + 1)
+
+        start = time.perf_counter()
+        store.add_many(zip(inputs, outputs))
+        bulk_seconds = time.perf_counter() - start
+        # The maintenance job trains the IVF index in the background; queries below measure it trained
+        store.train_index()
+
+        # Fresh texts each time, so the embedding cache does not hide the encode cost
+        single = list(zip(make_texts(n_ops, seed + 2), make_texts(n_ops, seed + 3)))
+        queries = [(query,) for query in make_texts(n_ops, seed + 4)]
+        add_pair = _timed(store.add_input_output_pair, single)
+        related = _timed(store.get_related_memos, queries)
+        queries = [(query,) for query in make_texts(n_ops, seed + 5)]
+        nearest = _timed(store.get_nearest_memo, queries)
+
+        store.close()
+        result = {
+            'n_memos': n_memos,
+            'index_mode': index_mode,
+            'bulk_insert': {
+                'seconds': bulk_seconds,
+                'memos_per_s': n_memos / bulk_seconds if bulk_seconds else 0.0,
+            },
+            'add_input_output_pair': add_pair,
+            'get_related_memos': related,
+            'get_nearest_memo': nearest,
+            'db_size_bytes': _db_size(path),
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+            (1 if sys.platform == "darwin" else 1024),
+        }
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base, head):
+    """
+    Prints how every latency and throughput figure changed between two result files.
+    """
+    base_runs = {(run['n_memos'], run['index_mode']): run for run in base['results']}
+    print(f"{'memos':>9} {'index':>6} {'metric':<32} {'base':>12} {'head':>12} {'change':>8}")
+    for run in head['results']:
+        previous = base_runs.get((run['n_memos'], run['index_mode']))
+        if previous is None:
+            continue
+        for metric, value in _flatten(run):
+            old = dict(_flatten(previous)).get(metric)
+            if old is None:
+                continue
+            change = f"{(value - old) / old:+.1%}" if old else "n/a"
+            print(f"{run['n_memos']:>9} {run['index_mode']:>6} {metric:<32} "
+                  f"{old:>12.4g} {value:>12.4g} {change:>8}")
+
+
+def _flatten(run):
+    for name, value in run.items():
+        if isinstance(value, dict):
+            for key, number in value.items():
+                yield f"{name}.{key}", number
+        elif name not in ('n_memos', 'index_mode'):
+            yield name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MemoStore inserts and lookups with a deterministic fake embedding model.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--index-modes", nargs="+", choices=["exact", "ivf"], default=["exact"])
+    parser.add_argument("--ops", type=int, default=200,
+                        help="Timed single inserts and queries per size.")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", default=None,
+                        help="Directory for the temporary databases. Defaults to the system temp dir.")
+    parser.add_argument("--output", default=None,
+                        help="Write JSON results here instead of stdout.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                        help="Print the changes between two result files and exit.")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_base, open(args.compare[1]) as f_head:
+            compare(json.load(f_base), json.load(f_head))
+        return
+
+    results = []
+    for index_mode in args.index_modes:
+        for n_memos in args.sizes:
+            # One process per size, so peak RSS is not inherited from the previous size
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_size, n_memos, index_mode, args.ops, args.dim,
+                                         args.seed, args.dir).result()
+            results.append(result)
+            print(f"{index_mode:>6} {n_memos:>9} memos: bulk {result['bulk_insert']['memos_per_s']:.0f}/s, "
+                  f"related p50 {result['get_related_memos']['p50_ms']:.2f} ms, "
+                  f"rss {result['peak_rss_bytes'] / 2**20:.0f} MiB", file=sys.stderr)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'settings': {'ops': args.ops, 'dim': args.dim, 'seed': args.seed},
+        'results': results,
+    }
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
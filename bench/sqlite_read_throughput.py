@@ -0,0 +1,125 @@
+# OpenMindAI
+# Version: AXYS
+# Module: SQLite Read Throughput Benchmark
+# Filepath: `/bench/sqlite_read_throughput.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db.connection import ConnectionManager  # noqa: E402
+
+
+def create_database(path, n_rows, dim=384):
+    """
+    Creates a memos table with `n_rows` rows of realistic size.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE memos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            input_text TEXT NOT NULL,
+            output_text TEXT NOT NULL,
+            input_embedding BLOB NOT NULL,
+            output_embedding BLOB NOT NULL,
+            embedding_dim INTEGER
+        )
+    """)
+    blob = os.urandom(dim * 4)
+    with conn:
+        conn.executemany(
+            "INSERT INTO memos (input_text, output_text, input_embedding, output_embedding, embedding_dim) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((f"input text for memo {i}", f"output text for memo {i}", blob, blob, dim)
+             for i in range(n_rows)))
+    conn.close()
+
+
+def _fetch(conn, n_rows, rng):
+    # The same shape as MemoStore._fetch_memos: look up the texts of ten scored ids
+    ids = [rng.randint(1, n_rows) for _ in range(10)]
+    conn.execute(
+        f"SELECT id, input_text, output_text FROM memos WHERE id IN ({','.join('?' * len(ids))})",
+        ids).fetchall()
+
+
+def run_shared_connection(path, n_rows, n_threads, duration):
+    """
+    Baseline: one connection with the default journal, shared by every thread behind a lock.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    lock = threading.Lock()
+
+    def read(conn_getter, rng):
+        with lock:
+            _fetch(conn_getter(), n_rows, rng)
+
+    queries = _run_threads(lambda: conn, read, n_threads, duration)
+    conn.close()
+    return queries
+
+
+def run_connection_manager(path, n_rows, n_threads, duration):
+    """
+    ConnectionManager: WAL, tuned pragmas and one read connection per thread.
+    """
+    manager = ConnectionManager(path)
+
+    def read(conn_getter, rng):
+        _fetch(conn_getter(), n_rows, rng)
+
+    queries = _run_threads(manager.reader, read, n_threads, duration)
+    manager.close()
+    return queries
+
+
+def _run_threads(conn_getter, read, n_threads, duration):
+    counts = [0] * n_threads
+    stop = threading.Event()
+
+    def worker(number):
+        rng = random.Random(number)
+        while not stop.is_set():
+            read(conn_getter, rng)
+            counts[number] += 1
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare concurrent read throughput of a shared connection and the ConnectionManager.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=3.0,
+                        help="Seconds per measurement.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.db")
+        create_database(path, args.rows)
+        print(f"{args.rows} memos, {args.duration:.0f}s per run (queries/s)")
+        print(f"{'threads':>8} {'shared conn':>14} {'WAL per-thread':>16}")
+        for n_threads in args.threads:
+            shared = run_shared_connection(path, args.rows, n_threads, args.duration)
+            managed = run_connection_manager(path, args.rows, n_threads, args.duration)
+            print(f"{n_threads:>8} {shared:>14.0f} {managed:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Database Connections
+# Filepath: `/db/connection.py`
+# Updated: 10-28-2023
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Pragmas applied to every connection. WAL lets readers run alongside the single writer,
+# and synchronous=NORMAL is durable across application crashes in WAL mode.
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative = KiB, so 64 MiB per connection
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+class ConnectionManager:
+    """
+    Concurrent-safe access to one SQLite database file.
+
+    The database runs in WAL mode. Every thread gets its own read connection, so readers
+    never queue behind each other or behind the writer. All writes in this process go
+    through one dedicated writer connection guarded by a lock, and each write transaction
+    starts with BEGIN IMMEDIATE so writers in other processes wait on `busy_timeout`
+    instead of failing mid-transaction.
+    """
+
+    def __init__(self, path_to_db_file, pragmas=None):
+        """
+        Args:
+            path_to_db_file (str): Path to the SQLite database.
+            pragmas (dict, optional): Overrides for DEFAULT_PRAGMAS.
+        """
+        self.path_to_db_file = path_to_db_file
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._closed = False
+
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self, query_only=False):
+        try:
+            # isolation_level=None: transactions are explicit (see `write`), reads autocommit
+            conn = sqlite3.connect(self.path_to_db_file, isolation_level=None,
+                                   check_same_thread=False)
+        except sqlite3.OperationalError as oe:
+            raise RuntimeError(
+                f"Unable to open database file: {self.path_to_db_file}") from oe
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        if query_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    def reader(self):
+        """
+        Returns this thread's read-only connection, opening it on first use.
+        """
+        if self._closed:
+            raise RuntimeError("Connection manager is closed.")
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(query_only=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def write(self):
+        """
+        Runs a block as one write transaction on the dedicated writer connection.
+
+        Usage:
+            with manager.write() as conn:
+                conn.execute("INSERT ...")
+        """
+        if self._closed:
+            raise RuntimeError("Connection manager is closed.")
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            else:
+                self._writer.execute("COMMIT")
+
+    def execute_write(self, sql, parameters=()):
+        """
+        Runs a statement that cannot run inside a transaction (e.g. VACUUM) on the writer.
+        """
+        with self._write_lock:
+            return self._writer.execute(sql, parameters)
+
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Copies the write-ahead log back into the main database file.
+        """
+        with self._write_lock:
+            return self._writer.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def close(self):
+        """
+        Closes every reader and the writer.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._write_lock:
+            self._writer.close()
@@ -5,10 +5,31 @@
 # Updated: 10-28-2023
 
 import os
+import time
 import sqlite3
-import pickle
-from sentence_transformers import SentenceTransformer, util
-from ..main import logger
+import itertools
+import threading
+import numpy as np
+from ops.config import logger
+from ops.metrics import metrics
+from .memo_index import MemoIndex, to_numpy, normalize_rows
+from .ivf_index import IVFIndex
+from .embedding_cache import EmbeddingCache
+from .memo_writer import MemoWriter
+from .connection import ConnectionManager
+from .embedding_format import (serialize_embedding, deserialize_embedding, get_format_version,
+                               set_format_version)
+from .schema import MEMOS_TABLE, SCHEMA_VERSION, upgrade_schema, metadata_filter
+from .quantization import EMBEDDING_DTYPES
+from .dedup import DEFAULT_DEDUP_THRESHOLD, DEDUP_CANDIDATES, duplicate_groups
+from .maintenance import EVICTION_POLICIES, LAST_USED, AccessTracker, MaintenanceJob
+from .hybrid import (RETRIEVAL_MODES, LEXICAL_SCAN_FACTOR, CAPPED_DOCUMENT_COUNT, query_terms,
+                     select_terms, match_expression, reciprocal_rank_fusion)
+
+# Evicting down to 95% of capacity means one eviction per many inserts, not one per insert
+EVICTION_HEADROOM = 0.05
+# Buffered retrieval statistics that wake the maintenance job to write them early
+ACCESS_FLUSH_THRESHOLD = 1024
 
 
 class MemoStore:
@@ -17,7 +38,13 @@ class MemoStore:
     """
 
     def __init__(self, verbosity=0, reset=False, db_filename="app.db",
-                 model_name='distilbert-base-nli-stsb-mean-tokens'):
+                 model_name='distilbert-base-nli-stsb-mean-tokens',
+                 index_mode="exact", nprobe=8, n_lists=None, ivf_train_threshold=10000,
+                 embedding_cache_size=10000, persistent_embedding_cache=False,
+                 write_queue_size=1024, sqlite_pragmas=None, dedup_threshold=None,
+                 max_memos=None, eviction_policy="lru", memo_ttl=None, maintenance_interval=None,
+                 retrieval_mode="vector", lexical_candidates=200, hybrid_vector_weight=0.7,
+                 embedding_dtype="float32", index_dtype="float32"):
         """
         Initialize the MemoStore with optional verbosity and database filename.
 
@@ -26,51 +53,334 @@ class MemoStore:
             reset (bool, optional): Whether to reset the DB. Defaults to False.
             db_filename (str, optional): Filename of the database. Defaults to "app.db".
             model_name (str, optional): Model name for generating embeddings. Defaults to 'distilbert-base-nli-stsb-mean-tokens'.
+            index_mode (str, optional): "exact" for a full vectorized scan, or "ivf" for the approximate
+                inverted-file index persisted next to the database. Defaults to "exact".
+            nprobe (int, optional): IVF partitions scored per query; higher is more accurate and slower. Defaults to 8.
+            n_lists (int, optional): Number of IVF partitions. Defaults to 4 * sqrt(N) when the index is trained.
+            ivf_train_threshold (int, optional): Memo count at which the IVF index is first trained, by the
+                background maintenance job; searches stay exact until then. Defaults to 10000.
+            embedding_cache_size (int, optional): Entries in the in-process embedding LRU. Defaults to 10000.
+            persistent_embedding_cache (bool, optional): Also cache embeddings in an SQLite file next to
+                the database. Defaults to False.
+            write_queue_size (int, optional): Memos `queue_memo` buffers before blocking the caller. Defaults to 1024.
+            sqlite_pragmas (dict, optional): Overrides for the SQLite pragmas in `db.connection.DEFAULT_PRAGMAS`.
+            dedup_threshold (float, optional): Cosine distance below which a new memo is merged into an
+                existing memo of the same user instead of inserted. Disabled if None, the default, so
+                bulk imports skip the extra search.
+            max_memos (int, optional): Capacity. When an insert goes over it, the maintenance job evicts
+                memos down to 95% of it, so evictions happen in batches and off the write path.
+                Unlimited if None, the default.
+            eviction_policy (str, optional): "lru" (least recently retrieved), "oldest" or "lfu" (fewest
+                retrievals). Defaults to "lru".
+            memo_ttl (float, optional): Seconds after its last retrieval (or creation) when a memo expires.
+                The maintenance job deletes expired memos within `memo_ttl` (at most 30) seconds of
+                their expiry, as do `evict` and `compact`. Never expire if None, the default.
+            maintenance_interval (float, optional): Run `compact` from a background thread this often,
+                in seconds. Disabled if None, the default.
+            retrieval_mode (str, optional): Default mode of `get_related_memos`: "vector" scores every memo
+                (or every filtered memo), "hybrid" re-ranks only the full-text matches. Defaults to "vector".
+            lexical_candidates (int, optional): Full-text matches re-ranked per hybrid query. Defaults to 200.
+            hybrid_vector_weight (float, optional): Share of the hybrid fusion score given to embedding
+                similarity rather than lexical relevance. Defaults to 0.7.
+            embedding_dtype (str, optional): Storage type of new embeddings in SQLite: "float32", "float16"
+                (half the size) or "int8" (about a quarter). Existing rows keep their type. Defaults to "float32".
+            index_dtype (str, optional): Row type of the in-memory index, with the same choices. float16
+                saves memory but scores slower than float32 on CPUs; int8 saves the most. Defaults to "float32".
         """
         self.verbosity = verbosity
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
 
         # Update to consider the db file is in the same directory as this file
         self.path_to_db_file = os.path.join(
             os.path.dirname(__file__), db_filename)
+        self.path_to_index_file = self.path_to_db_file + ".ivf.npz"
+
+        # The embedding model itself is loaded on first use (or by warm_up)
+        self.embedding_cache = EmbeddingCache(
+            model_name, max_entries=embedding_cache_size,
+            path_to_cache_file=self.path_to_db_file + ".embeddings.db" if persistent_embedding_cache else None)
+
+        if index_mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index_mode: {index_mode}")
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction_policy: {eviction_policy}")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval_mode: {retrieval_mode}")
+        for name, dtype in (("embedding_dtype", embedding_dtype), ("index_dtype", index_dtype)):
+            if dtype not in EMBEDDING_DTYPES:
+                raise ValueError(f"Unknown {name}: {dtype}")
+        self.index_mode = index_mode
+        self.embedding_dtype = embedding_dtype
+        self.index_dtype = index_dtype
+        self._ivf_settings = dict(n_lists=n_lists, nprobe=nprobe, train_threshold=ivf_train_threshold,
+                                  dtype=index_dtype)
+        self.index = self._new_index()
 
         logger.debug(
             f"Attempting to connect to database at: {self.path_to_db_file}")
 
+        # SQLite access goes through per-thread WAL readers and one dedicated writer. The lock
+        # only guards the in-memory index, so embedding and SQL reads run fully in parallel.
+        self._lock = threading.RLock()
+        # Highest memo id loaded into the index; rows above it are picked up by _sync_index
+        self._synced_id = 0
+        self.write_queue_size = write_queue_size
+        self._writer = None
+        self.dedup_threshold = dedup_threshold
+        self.duplicates_merged = 0
+        self.max_memos = max_memos
+        self.eviction_policy = eviction_policy
+        self.memo_ttl = memo_ttl
+        self.evicted = 0
+        self.access_tracker = AccessTracker()
+        self.retrieval_mode = retrieval_mode
+        self.lexical_candidates = lexical_candidates
+        self.hybrid_vector_weight = hybrid_vector_weight
+        self.hybrid_fallbacks = 0
+        # Eviction and compaction both rewrite the index, so they never overlap
+        self._maintenance_lock = threading.Lock()
+        self._maintenance = None
         try:
-            self.conn = sqlite3.connect(self.path_to_db_file)
-        except sqlite3.OperationalError as oe:
+            self.connections = ConnectionManager(
+                self.path_to_db_file, pragmas=sqlite_pragmas)
+        except RuntimeError:
             logger.error(
                 f"Unable to open database file: {self.path_to_db_file}")
-            raise RuntimeError(
-                f"Unable to open database file: {self.path_to_db_file}") from oe
+            raise
 
         if reset:
             self.reset_db()
 
         self._initialize_db()
+        if maintenance_interval:
+            self._maintenance = MaintenanceJob(self, interval=maintenance_interval)
+        self._load_index()
+        if self._maintenance is None and memo_ttl is not None:
+            # Nothing else may start the job in a store without capacity limits
+            self._maintenance = MaintenanceJob(self, interval=None)
+        self._register_metrics()
         logger.debug("Database initialized successfully.")
 
+    @property
+    def model(self):
+        return self.embedding_cache.model
+
+    def _register_metrics(self):
+        metrics.gauge("axys_memo_count", "Memos in the in-memory index.", self._memo_count)
+        metrics.gauge("axys_memo_write_queue_depth", "Memos queued for write-behind storage.",
+                      self._write_queue_depth)
+        metrics.gauge("axys_embedding_cache_hits_total", "Embedding cache hits (both tiers).",
+                      self._embedding_cache_hits, kind="counter")
+        metrics.gauge("axys_embedding_cache_misses_total", "Embeddings computed by the model.",
+                      self._embedding_cache_misses, kind="counter")
+        metrics.gauge("axys_memo_duplicates_merged_total",
+                      "New memos merged into an existing near-duplicate instead of inserted.",
+                      self._duplicates_merged, kind="counter")
+        metrics.gauge("axys_memos_evicted_total", "Memos deleted by expiry or capacity eviction.",
+                      self._evicted, kind="counter")
+
+    def _memo_count(self):
+        return len(self.index)
+
+    def _write_queue_depth(self):
+        return self._writer.pending if self._writer is not None else 0
+
+    def _embedding_cache_hits(self):
+        return self.embedding_cache.hits + self.embedding_cache.persistent_hits
+
+    def _embedding_cache_misses(self):
+        return self.embedding_cache.misses
+
+    def _duplicates_merged(self):
+        return self.duplicates_merged
+
+    def _evicted(self):
+        return self.evicted
+
+    def _new_index(self):
+        if self.index_mode == "ivf":
+            return IVFIndex(**self._ivf_settings)
+        return MemoIndex(dtype=self.index_dtype)
+
+    def warm_up(self):
+        """
+        Loads the embedding model now instead of on the first encode.
+        """
+        try:
+            self.embedding_cache.model
+        except Exception as e:
+            logger.error(f"Failed to load embedding model {self.model_name}: {e}")
+            raise
+
     def _initialize_db(self):
         try:
-            with self.conn:
-                self.conn.execute("""
-                    CREATE TABLE IF NOT EXISTS memos (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        input_text TEXT NOT NULL,
-                        output_text TEXT NOT NULL,
-                        input_embedding BLOB NOT NULL,
-                        output_embedding BLOB NOT NULL
-                    );
-                """)
+            # Only takes effect on a new database; lets `compact` free pages in small steps
+            self.connections.execute_write("PRAGMA auto_vacuum = INCREMENTAL")
+            with self.connections.write() as conn:
+                conn.execute(MEMOS_TABLE)
+                self._check_format_version(conn)
+                # Idempotent; also recreates the tags table and indexes after `reset_db`
+                upgrade_schema(conn)
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
             raise
 
+    def _check_format_version(self, conn):
+        """
+        Stamps new databases and those from version 1 on with the current schema version, and
+        refuses legacy pickled ones. `upgrade_schema` then adds any missing columns.
+        """
+        version = get_format_version(conn)
+        if version == SCHEMA_VERSION:
+            return
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(memos)")]
+        is_empty = conn.execute("SELECT 1 FROM memos LIMIT 1").fetchone() is None
+        if version == 0 and "embedding_dim" in columns and is_empty:
+            set_format_version(conn, SCHEMA_VERSION)
+            return
+        if 1 <= version < SCHEMA_VERSION:
+            # Adding columns with constant defaults is cheap, so older databases are upgraded in place
+            set_format_version(conn, SCHEMA_VERSION)
+            logger.info("Upgraded %s to schema version %s.", self.path_to_db_file, SCHEMA_VERSION)
+            return
+        raise RuntimeError(
+            f"Database {self.path_to_db_file} uses format version {version}, "
+            f"expected {SCHEMA_VERSION}. Run `python -m db.migrate` to convert it.")
+
+    def _load_index(self):
+        """
+        Loads stored input embeddings into the in-memory index.
+
+        In IVF mode a persisted index is reused and only rows added since it was saved are loaded.
+        """
+        with self._lock:
+            self.index.clear()
+            self._synced_id = 0
+            if self.index_mode == "ivf" and os.path.exists(self.path_to_index_file):
+                self._synced_id = self._load_persisted_index()
+            self._sync_index()
+        logger.debug("Loaded %s memo embeddings into index.", len(self.index))
+
+    def _sync_index(self, batch_size=10000):
+        """
+        Streams every row above the last synced id into the index.
+
+        Ids are allocated inside write transactions, which SQLite serializes, so rows committed
+        by this or any other thread or process always appear above `_synced_id`.
+        """
+        with self._lock, metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.",
+                                      query="sync_index"):
+            try:
+                cursor = self.connections.reader().execute(
+                    "SELECT id, input_embedding, embedding_dim, embedding_dtype FROM memos "
+                    "WHERE id > ? ORDER BY id",
+                    (self._synced_id,))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    self.index.add_batch(
+                        [row[0] for row in rows],
+                        [deserialize_embedding(row[1], row[2], row[3]) for row in rows])
+                    self._synced_id = rows[-1][0]
+            except Exception as e:
+                logger.error(f"Failed to load memo index: {e}")
+                raise
+            if self.index_mode == "ivf" and self.index.needs_training:
+                self._request_maintenance()
+
+    def _request_maintenance(self):
+        # Started on first need even without `maintenance_interval`, so requests never run
+        # k-means, evictions or statistics writes themselves
+        if self._maintenance is None:
+            with self._lock:
+                if self._maintenance is None:
+                    self._maintenance = MaintenanceJob(self, interval=None)
+        self._maintenance.trigger()
+
+    def _refresh_index(self):
+        # One primary-key lookup per query keeps the index current with other writers
+        max_id = self.connections.reader().execute(
+            "SELECT MAX(id) FROM memos").fetchone()[0] or 0
+        if max_id > self._synced_id:
+            self._sync_index()
+
+    def _load_persisted_index(self):
+        """
+        Loads the saved IVF index if it is consistent with the database.
+
+        Returns:
+            int: The last memo id covered by the loaded index, or 0 if it had to be discarded.
+        """
+        try:
+            persisted = IVFIndex.load(self.path_to_index_file)
+        except Exception as e:
+            logger.error(f"Failed to load persisted index, rebuilding: {e}")
+            return 0
+        max_id = self.connections.reader().execute(
+            "SELECT MAX(id) FROM memos").fetchone()[0] or 0
+        if persisted.last_id > max_id:
+            logger.debug("Persisted index is ahead of the database, rebuilding.")
+            return 0
+        if persisted.dtype != self.index_dtype:
+            logger.debug("Persisted index holds %s rows, rebuilding as %s.", persisted.dtype, self.index_dtype)
+            return 0
+        persisted.nprobe = self.index.nprobe
+        persisted.train_threshold = self.index.train_threshold
+        self.index = persisted
+        logger.debug("Loaded persisted index with %s embeddings.", len(self.index))
+        return persisted.last_id
+
+    def save_index(self):
+        """
+        Persists the IVF index next to the database so restarts don't rebuild it.
+        """
+        if self.index_mode != "ivf":
+            return
+        try:
+            self.index.save(self.path_to_index_file)
+        except Exception as e:
+            logger.error(f"Failed to save memo index: {e}")
+            raise
+
+    def _fetch_memos(self, scored_ids, scores=None, include_ids=False):
+        """
+        Looks up the texts for (memo_id, distance) pairs, preserving their order.
+
+        With `scores` (memo id -> fusion score), each memo also gets a 'score' key, and with
+        `include_ids` an 'id' key.
+        """
+        if not scored_ids:
+            return []
+        ids = [memo_id for memo_id, _ in scored_ids]
+        placeholders = ",".join("?" * len(ids))
+        with metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.", query="fetch_memos"):
+            rows = {
+                row[0]: row for row in self.connections.reader().execute(
+                    f"SELECT id, input_text, output_text FROM memos WHERE id IN ({placeholders})", ids)
+            }
+        memos = []
+        for memo_id, distance in scored_ids:
+            if memo_id not in rows:
+                continue
+            memo = {'input_text': rows[memo_id][1], 'output_text': rows[memo_id][2], 'distance': distance}
+            if scores is not None:
+                memo['score'] = scores[memo_id]
+            if include_ids:
+                memo['id'] = memo_id
+            memos.append(memo)
+        return memos
+
     def reset_db(self):
         try:
-            with self.conn:
-                self.conn.execute("DROP TABLE IF EXISTS memos")
+            with self._lock, self.connections.write() as conn:
+                conn.execute("DROP TABLE IF EXISTS memos")
+                conn.execute("DROP TABLE IF EXISTS memo_tags")
+                conn.execute("DROP TABLE IF EXISTS memos_fts")
+                self.index.clear()
+                self._synced_id = 0
+                if os.path.exists(self.path_to_index_file):
+                    os.remove(self.path_to_index_file)
             self._initialize_db()
         except Exception as e:
             logger.error(f"Failed to reset database: {e}")
@@ -78,121 +388,762 @@ class MemoStore:
 
     def close(self):
         """
-        Cleanly closes the database connection.
+        Cleanly closes the database connection, saving the IVF index first.
         """
         try:
-            self.conn.close()
+            # The writer's last batches may still request maintenance, so it is closed first
+            if self._writer is not None:
+                self._writer.close()
+            if self._maintenance is not None:
+                self._maintenance.close()
+            self.flush_access_stats()
+            with self._lock:
+                self.save_index()
+                logger.debug("Embedding cache stats: %s", self.embedding_cache.stats())
+                self.embedding_cache.close()
+                self.connections.close()
         except Exception as e:
             logger.error(f"Failed to close database connection: {e}")
             raise
 
     # Corrected the indentation for add_input_output_pair method
-    def add_input_output_pair(self, input_text, output_text):
+    def add_input_output_pair(self, input_text, output_text, **metadata):
         """
         Adds an input-output pair to the vector database.
 
         Args:
             input_text (str): The input text.
             output_text (str): The output text.
+            **metadata: Optional user_id, session_id, source, tags (list of str) and created_at
+                (Unix time, defaults to now).
         """
-        try:
-            # Generate embeddings
-            input_embedding = self.model.encode(
-                input_text, convert_to_tensor=True)
-            output_embedding = self.model.encode(
-                output_text, convert_to_tensor=True)
-        except Exception as e:
-            logger.error(f"Failed to generate embeddings: {e}")
-            raise
+        self.add_many([(input_text, output_text, metadata)])
+
+    def queue_memo(self, input_text, output_text, timeout=None, **metadata):
+        """
+        Queues an input-output pair for write-behind storage and returns immediately.
+
+        Queued memos are embedded and committed in batches by a background writer. If the
+        queue is full the call blocks until there is room (or `timeout` expires).
+
+        Args:
+            input_text (str): The input text.
+            output_text (str): The output text.
+            timeout (float, optional): Seconds to wait for room in a full queue. Waits indefinitely if None.
+            **metadata: As for `add_input_output_pair`. created_at defaults to the time of queueing.
+        """
+        with self._lock:
+            if self._writer is None:
+                self._writer = MemoWriter(self, max_queue_size=self.write_queue_size)
+        metadata.setdefault("created_at", time.time())
+        self._writer.submit(input_text, output_text, timeout=timeout, metadata=metadata)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every memo queued before the call has been written.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most. Waits indefinitely if None.
 
-        # Serialize the tensor for storage
-        input_embedding_serialized = pickle.dumps(input_embedding)
-        output_embedding_serialized = pickle.dumps(output_embedding)
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        if self._writer is not None:
+            return self._writer.flush(timeout=timeout)
+        return True
+
+    def _read_your_writes(self):
+        # Only pay for a flush when this store actually has writes in flight
+        if self._writer is not None and self._writer.pending:
+            self._writer.flush()
+
+    def add_many(self, pairs, batch_size=256, embeddings=None):
+        """
+        Adds many input-output pairs, encoding and inserting them in batches.
+
+        Each batch is embedded with one batched encode call and inserted with `executemany`
+        in a single transaction. `pairs` may be a generator, so large imports are streamed
+        and only one batch is held in memory at a time.
+
+        Args:
+            pairs (iterable): (input_text, output_text) or (input_text, output_text, metadata) tuples,
+                where metadata is a dict as accepted by `add_input_output_pair`.
+            batch_size (int, optional): Pairs encoded and committed together. Defaults to 256.
+            embeddings (iterable, optional): (input_embedding, output_embedding) per pair, computed
+                elsewhere (e.g. by `ShardedMemoStore`). The pairs are not encoded again if given.
+
+        Returns:
+            int: The number of memos inserted. Pairs merged into a near-duplicate (see
+                `dedup_threshold`) are not counted.
+        """
+        pairs = iter(pairs)
+        embeddings = iter(embeddings) if embeddings is not None else None
+        added = 0
+        while True:
+            batch = list(itertools.islice(pairs, batch_size))
+            if not batch:
+                break
+            batch_embeddings = None
+            if embeddings is not None:
+                batch_embeddings = list(itertools.islice(embeddings, len(batch)))
+                if len(batch_embeddings) != len(batch):
+                    raise ValueError("Expected one (input, output) embedding pair per memo.")
+            added += self._insert_batch(batch, batch_embeddings)
+            if self.verbosity >= 1:
+                logger.debug("Added %d memos.", added)
+        return added
+
+    def _insert_batch(self, batch, precomputed=None):
+        input_texts = [pair[0] for pair in batch]
+        output_texts = [pair[1] for pair in batch]
+        now = time.time()
+        metadata = [dict(pair[2] or {}) if len(pair) > 2 else {} for pair in batch]
+        for meta in metadata:
+            # Rows exported from databases upgraded from older schemas carry a NULL created_at
+            if meta.get("created_at") is None:
+                meta["created_at"] = now
+        if precomputed is not None:
+            embeddings = [pair[0] for pair in precomputed] + [pair[1] for pair in precomputed]
+        else:
+            try:
+                # Generate embeddings for inputs and outputs in one call
+                embeddings = self.embedding_cache.encode_many(input_texts + output_texts)
+            except Exception as e:
+                logger.error(f"Failed to generate embeddings: {e}")
+                raise
+
+        # Serialize the embeddings as raw bytes of the storage type; float32 rows record a NULL type
+        input_embeddings = [to_numpy(embedding) for embedding in embeddings[:len(batch)]]
+        output_embeddings = [to_numpy(embedding) for embedding in embeddings[len(batch):]]
+        keep, merges = list(range(len(batch))), {}
+        if self.dedup_threshold is not None:
+            keep, merges = self._merge_duplicates(input_embeddings, output_embeddings, metadata)
+        dtype = self.embedding_dtype
+        rows = [
+            (input_texts[i], output_texts[i], serialize_embedding(input_embeddings[i], dtype),
+             serialize_embedding(output_embeddings[i], dtype), input_embeddings[i].size,
+             metadata[i].get("user_id"), metadata[i].get("session_id"), metadata[i].get("source"),
+             metadata[i]["created_at"], metadata[i].get("times_seen", 1), metadata[i].get("last_seen_at"),
+             metadata[i].get("access_count", 0), metadata[i].get("last_accessed_at"),
+             None if dtype == "float32" else dtype)
+            for i in keep
+        ]
         try:
-            with self.conn:
-                self.conn.execute(
-                    "INSERT INTO memos (input_text, output_text, input_embedding, output_embedding) VALUES (?, ?, ?, ?)",
-                    (input_text, output_text, input_embedding_serialized,
-                     output_embedding_serialized)
-                )
+            with metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.",
+                              query="insert_memos"), self.connections.write() as conn:
+                if rows:
+                    conn.executemany(
+                        "INSERT INTO memos (input_text, output_text, input_embedding, output_embedding, "
+                        "embedding_dim, user_id, session_id, source, created_at, times_seen, last_seen_at, "
+                        "access_count, last_accessed_at, embedding_dtype) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows)
+                if any(metadata[i].get("tags") for i in keep):
+                    # The write transaction is exclusive, so the batch received consecutive ids
+                    first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(rows) + 1
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO memo_tags (tag, memo_id) VALUES (?, ?)",
+                        [(tag, first_id + offset) for offset, i in enumerate(keep)
+                         for tag in metadata[i].get("tags") or ()])
+                if merges:
+                    conn.executemany(
+                        "UPDATE memos SET times_seen = times_seen + ?, "
+                        "last_seen_at = MAX(COALESCE(last_seen_at, created_at, 0), ?) WHERE id = ?",
+                        [(merge["times_seen"], merge["last_seen_at"], memo_id)
+                         for memo_id, merge in merges.items()])
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO memo_tags (tag, memo_id) VALUES (?, ?)",
+                        [(tag, memo_id) for memo_id, merge in merges.items() for tag in merge["tags"]])
+            # Picks up the new rows (and any committed by other writers) from the database
+            self._sync_index()
         except Exception as e:
             logger.error(f"Failed to insert into memos: {e}")
             raise
+        if len(rows) < len(batch):
+            self.duplicates_merged += len(batch) - len(rows)
+            logger.debug("Merged %d near-duplicate memos.", len(batch) - len(rows))
+        if self.over_capacity():
+            self._request_maintenance()
+        return len(rows)
+
+    def _merge_duplicates(self, input_embeddings, output_embeddings, metadata):
+        """
+        Splits a batch into memos to insert and near-duplicates of memos already stored.
+
+        A memo duplicates another of the same user when both its input and output are within
+        `dedup_threshold` cosine distance. The index supplies the few nearest stored inputs among
+        the user's memos, whose outputs are then checked. Duplicates within the batch merge into their
+        first occurrence, whose entry in `metadata` is updated in place.
+
+        Returns:
+            tuple: (positions of the memos to insert, {stored memo id: merged times_seen, last_seen_at and tags}).
+        """
+        threshold = self.dedup_threshold
+        inputs = normalize_rows(input_embeddings)
+        outputs = normalize_rows(output_embeddings)
+        self._refresh_index()
+        # Searching only the user's memos keeps other users' copies of a common phrase from
+        # filling the candidate slots
+        user_memo_ids = {user_id: self._candidate_ids({"user_id": user_id})
+                         for user_id in {meta.get("user_id") for meta in metadata}}
+        with self._lock:
+            hits = [self.index.search(query, k=DEDUP_CANDIDATES, max_distance=threshold,
+                                      candidate_ids=user_memo_ids[meta.get("user_id")])
+                    if user_memo_ids[meta.get("user_id")] != [] else []
+                    for query, meta in zip(inputs, metadata)]
+        candidate_ids = sorted({memo_id for found in hits for memo_id, _ in found})
+        stored = {}
+        if candidate_ids:
+            placeholders = ",".join("?" * len(candidate_ids))
+            for memo_id, user_id, blob, dim, dtype in self.connections.reader().execute(
+                    f"SELECT id, user_id, output_embedding, embedding_dim, embedding_dtype FROM memos "
+                    f"WHERE id IN ({placeholders})",
+                    candidate_ids):
+                stored[memo_id] = (user_id, normalize_rows(deserialize_embedding(blob, dim, dtype))[0])
+
+        keep, merges = [], {}
+        for position, meta in enumerate(metadata):
+            user_id = meta.get("user_id")
+            target = next(
+                (memo_id for memo_id, _ in hits[position]
+                 if memo_id in stored and stored[memo_id][0] == user_id
+                 and 1.0 - stored[memo_id][1] @ outputs[position] < threshold), None)
+            if target is not None:
+                merge = merges.setdefault(target, {"times_seen": 0, "last_seen_at": 0.0, "tags": set()})
+            else:
+                target = next(
+                    (earlier for earlier in keep
+                     if metadata[earlier].get("user_id") == user_id
+                     and 1.0 - inputs[earlier] @ inputs[position] < threshold
+                     and 1.0 - outputs[earlier] @ outputs[position] < threshold), None)
+                if target is None:
+                    keep.append(position)
+                    continue
+                merge = metadata[target]
+                merge.setdefault("times_seen", 1)
+                merge["tags"] = set(merge.get("tags") or ())
+            merge["times_seen"] += 1 if "times_seen" not in meta else meta["times_seen"]
+            merge["last_seen_at"] = max(merge.get("last_seen_at") or 0.0, meta["created_at"] or 0.0)
+            merge["tags"].update(meta.get("tags") or ())
+        return keep, merges
 
-    def get_nearest_memo(self, query_text):
+    def _candidate_ids(self, filters):
+        """
+        Returns the ids of the memos matching the metadata filters, or None if there are none.
+
+        The metadata indexes answer this in SQL, so the vector search only scores the matches.
+        """
+        condition = metadata_filter(**filters)
+        if condition is None:
+            return None
+        where, parameters = condition
+        with metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.", query="filter_memos"):
+            rows = self.connections.reader().execute(
+                f"SELECT id FROM memos WHERE {where} ORDER BY id", parameters).fetchall()
+        return [row[0] for row in rows]
+
+    def get_nearest_memo(self, query_text, read_your_writes=True, user_id=None, session_id=None,
+                         source=None, tags=None, since=None, until=None):
         """
         Retrieves the nearest memo to the given query text.
 
         Args:
             query_text (str): The query text.
+            read_your_writes (bool, optional): Wait for queued memos to be written first. Defaults to True.
+            user_id (str, optional): Only search memos of this user.
+            session_id (str, optional): Only search memos from this session.
+            source (str, optional): Only search memos from this source.
+            tags (list, optional): Only search memos carrying at least one of these tags.
+            since (float, optional): Only search memos created at or after this Unix time.
+            until (float, optional): Only search memos created before this Unix time.
 
         Returns:
             dict: The nearest memo as a dictionary with keys 'input_text' and 'output_text'.
         """
         try:
-            query_embedding = self.model.encode(
-                query_text, convert_to_tensor=True)
-
-            nearest_memo = None
-            min_distance = float("inf")
-
-            for row in self.conn.execute("SELECT * FROM memos"):
-                db_input_embedding = pickle.loads(row[3])
-                distance = util.pytorch_cos_sim(
-                    query_embedding, db_input_embedding).item()
-
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_memo = {
-                        'input_text': row[1],
-                        'output_text': row[2]
-                    }
+            query_embedding = self.embedding_cache.encode(query_text)
+            if read_your_writes:
+                self._read_your_writes()
+            self._refresh_index()
+            candidate_ids = self._candidate_ids(dict(
+                user_id=user_id, session_id=session_id, source=source, tags=tags,
+                since=since, until=until))
+            if candidate_ids is not None and not candidate_ids:
+                return None
+            with self._lock, metrics.span("axys_index_search_seconds", "Vector index search latency."):
+                scored_ids = self.index.search(query_embedding, k=1, candidate_ids=candidate_ids)
+            memos = self._fetch_memos(scored_ids)
+            self._record_access(scored_ids)
         except Exception as e:
             logger.error(f"Failed to retrieve nearest memo: {e}")
             raise
 
-        return nearest_memo
+        if not memos:
+            return None
+        return {'input_text': memos[0]['input_text'], 'output_text': memos[0]['output_text']}
 
-    def get_related_memos(self, query_text, n_results=10, threshold=1.5):
+    def get_related_memos(self, query_text, n_results=10, threshold=1.5, read_your_writes=True,
+                          user_id=None, session_id=None, source=None, tags=None, since=None,
+                          until=None, mode=None, query_embedding=None):
         """
         Retrieves memos that are related to the given query text within the specified distance threshold.
 
+        Distance is cosine distance (1 - cosine similarity), so 0 is identical and 2 is opposite.
+        Metadata filters are applied in SQL first, so only the matching memos are scored.
+
+        In "hybrid" mode the full-text index supplies up to `lexical_candidates` memos sharing
+        words with the query; only those are scored by embedding, and the results are ordered
+        by a fusion of both rankings. When lexical recall is poor (fewer matches, or fewer
+        matches within `threshold`, than `n_results`) the query falls back to the vector scan.
+
         Args:
             query_text (str): The query text.
             n_results (int, optional): The number of results to retrieve. Defaults to 10.
             threshold (float, optional): The distance threshold. Defaults to 1.5.
+            read_your_writes (bool, optional): Wait for queued memos to be written first. Defaults to True.
+            user_id (str, optional): Only search memos of this user.
+            session_id (str, optional): Only search memos from this session.
+            source (str, optional): Only search memos from this source.
+            tags (list, optional): Only search memos carrying at least one of these tags.
+            since (float, optional): Only search memos created at or after this Unix time.
+            until (float, optional): Only search memos created before this Unix time.
+            mode (str, optional): "vector" or "hybrid". Defaults to `retrieval_mode`.
+            query_embedding (array-like, optional): Embedding of `query_text`, if already computed.
 
         Returns:
-            list: A list of related memos as dictionaries with keys 'input_text' and 'output_text'.
+            list: A list of related memos as dictionaries with keys 'input_text', 'output_text' and 'distance',
+                plus 'score' (the fusion score) for hybrid results.
         """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        filters = dict(user_id=user_id, session_id=session_id, source=source, tags=tags,
+                       since=since, until=until)
 
         try:
-            query_embedding = self.model.encode(
-                query_text, convert_to_tensor=True)
+            if query_embedding is None:
+                query_embedding = self.embedding_cache.encode(query_text)
+            if read_your_writes:
+                self._read_your_writes()
+
+            self._refresh_index()
+            if mode == "hybrid":
+                hybrid = self._hybrid_search(query_text, query_embedding, n_results, threshold, filters)
+                metrics.inc("axys_retrieval_queries_total", help_text="get_related_memos calls by search path.",
+                            path="hybrid" if hybrid is not None else "hybrid_fallback")
+                if hybrid is not None:
+                    scored_ids, scores = hybrid
+                    memos = self._fetch_memos(scored_ids, scores)
+                    self._record_access(scored_ids)
+                    return memos
+                self.hybrid_fallbacks += 1
+            else:
+                metrics.inc("axys_retrieval_queries_total", help_text="get_related_memos calls by search path.",
+                            path="vector")
+
+            candidate_ids = self._candidate_ids(filters)
+            if candidate_ids is not None and not candidate_ids:
+                return []
+
+            # One matrix product over the whole index (or the filtered rows), then partial top-k selection
+            with self._lock, metrics.span("axys_index_search_seconds", "Vector index search latency."):
+                scored_ids = self.index.search(
+                    query_embedding, k=n_results, max_distance=threshold,
+                    candidate_ids=candidate_ids)
+            memos = self._fetch_memos(scored_ids)
+            self._record_access(scored_ids)
+            return memos
+        except Exception as e:
+            logger.error(f"Failed to retrieve related memos: {e}")
+            raise
+
+    def hybrid_candidates(self, query_text, query_embedding=None, threshold=1.5, read_your_writes=True,
+                          **filters):
+        """
+        Returns the full-text matches of the query with their embedding distances, unfused.
 
-            related_memos = []
+        `ShardedMemoStore` fuses the candidates of every shard at once, so the fusion ranks
+        are global rather than per shard. Takes the filters of `get_related_memos`.
 
-            for row in self.conn.execute("SELECT * FROM memos"):
-                db_input_embedding = pickle.loads(row[3])
-                distance = util.pytorch_cos_sim(
-                    query_embedding, db_input_embedding).item()
+        Returns:
+            dict: 'matches', (memo_id, BM25 rank) pairs of every full-text match by relevance (lower
+                ranks are more relevant), and 'memos', the matches within `threshold` as in
+                `get_related_memos` plus an 'id' key, by ascending distance. None if the query has
+                no usable terms or SQLite lacks FTS5.
+        """
+        if query_embedding is None:
+            query_embedding = self.embedding_cache.encode(query_text)
+        if read_your_writes:
+            self._read_your_writes()
+        self._refresh_index()
+        candidates = self._lexical_candidates(query_text, query_embedding, threshold,
+                                              dict(filters))
+        if candidates is None:
+            return None
+        scored_ids, matches = candidates
+        return {'matches': matches, 'memos': self._fetch_memos(scored_ids, include_ids=True)}
 
-                if distance < threshold:
-                    related_memos.append({
-                        'input_text': row[1],
-                        'output_text': row[2],
-                        'distance': distance
-                    })
+    def _hybrid_search(self, query_text, query_embedding, n_results, threshold, filters):
+        """
+        Re-ranks the full-text matches of the query by embedding similarity.
 
-            # Sort by distance and take the top n_results
-            related_memos = sorted(related_memos, key=lambda x: x['distance'])[
-                :n_results]
+        Returns:
+            tuple: ((memo_id, distance) pairs by descending fusion score, {memo_id: score}), or None
+                if lexical recall is too poor and the caller should run the vector search instead.
+        """
+        candidates = self._lexical_candidates(query_text, query_embedding, threshold, filters,
+                                              min_matches=n_results)
+        if candidates is None:
+            return None
+        scored_ids, matches = candidates
+        if len(scored_ids) < n_results:
+            return None
+
+        distances = dict(scored_ids)
+        fused = [(memo_id, score) for memo_id, score in reciprocal_rank_fusion(
+            [memo_id for memo_id, _ in scored_ids], [memo_id for memo_id, _ in matches],
+            self.hybrid_vector_weight)
+            if memo_id in distances][:n_results]
+        return [(memo_id, distances[memo_id]) for memo_id, _ in fused], dict(fused)
+
+    def _lexical_candidates(self, query_text, query_embedding, threshold, filters, min_matches=0):
+        """
+        Scores the full-text matches of the query by embedding.
 
-            return related_memos
+        Returns:
+            tuple: ((memo_id, distance) pairs within `threshold` by ascending distance, (memo_id,
+                BM25 rank) pairs of every match by relevance), or None if the query has no usable
+                terms, fewer than `min_matches` matches, or SQLite lacks FTS5.
+        """
+        terms = query_terms(query_text)
+        if not terms:
+            return None
+        reader = self.connections.reader()
+        try:
+            with metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.", query="fts_match"):
+                budget = LEXICAL_SCAN_FACTOR * self.lexical_candidates
+                document_counts = {
+                    term: reader.execute(CAPPED_DOCUMENT_COUNT, (match_expression([term]), budget + 1)).fetchone()[0]
+                    for term in terms
+                }
+                expression = match_expression(select_terms(terms, document_counts, budget))
+                if expression is None:
+                    return None
+                sql = "SELECT rowid, rank FROM memos_fts WHERE memos_fts MATCH ?"
+                parameters = [expression]
+                condition = metadata_filter(**filters)
+                if condition is not None:
+                    sql += f" AND rowid IN (SELECT id FROM memos WHERE {condition[0]})"
+                    parameters.extend(condition[1])
+                sql += " ORDER BY rank LIMIT ?"
+                parameters.append(self.lexical_candidates)
+                matches = [(row[0], row[1]) for row in reader.execute(sql, parameters)]
+        except sqlite3.OperationalError as e:
+            # No full-text index (SQLite built without FTS5)
+            logger.debug("Hybrid retrieval unavailable, using vector search: %s", e)
+            return None
+        if len(matches) < min_matches:
+            return None
+        if not matches:
+            return [], matches
+
+        with self._lock, metrics.span("axys_index_search_seconds", "Vector index search latency."):
+            scored_ids = self.index.search(
+                query_embedding, k=len(matches), max_distance=threshold,
+                candidate_ids=sorted(memo_id for memo_id, _ in matches))
+        return scored_ids, matches
+
+    def _record_access(self, scored_ids):
+        if not scored_ids:
+            return
+        self.access_tracker.record(memo_id for memo_id, _ in scored_ids)
+        if len(self.access_tracker) >= ACCESS_FLUSH_THRESHOLD:
+            self._request_maintenance()
+
+    def flush_access_stats(self):
+        """
+        Writes the buffered retrieval statistics (`access_count`, `last_accessed_at`) in one transaction.
+        """
+        updates = self.access_tracker.drain()
+        if not updates:
+            return
+        try:
+            with metrics.span("axys_sqlite_query_seconds", "SQLite statement latency.",
+                              query="update_access"), self.connections.write() as conn:
+                conn.executemany(
+                    "UPDATE memos SET access_count = access_count + ?, "
+                    "last_accessed_at = MAX(COALESCE(last_accessed_at, 0), ?) WHERE id = ?",
+                    updates)
         except Exception as e:
-            logger.error(f"Failed to retrieve related memos: {e}")
+            logger.error(f"Failed to write memo access statistics: {e}")
             raise
 
+    def delete_memos(self, memo_ids):
+        """
+        Deletes memos and their tags, and drops them from the in-memory index.
+
+        Args:
+            memo_ids (list): Ids of the memos to delete.
+
+        Returns:
+            int: The number of memos deleted.
+        """
+        memo_ids = [int(memo_id) for memo_id in memo_ids]
+        if not memo_ids:
+            return 0
+        rows = [(memo_id,) for memo_id in memo_ids]
+        try:
+            with self.connections.write() as conn:
+                conn.executemany("DELETE FROM memo_tags WHERE memo_id = ?", rows)
+                deleted = conn.executemany("DELETE FROM memos WHERE id = ?", rows).rowcount
+            with self._lock:
+                self.index.remove(memo_ids)
+        except Exception as e:
+            logger.error(f"Failed to delete memos: {e}")
+            raise
+        return deleted
+
+    def over_capacity(self):
+        """
+        Whether the store holds more than `max_memos` memos.
+        """
+        return self.max_memos is not None and len(self.index) > self.max_memos
+
+    def expire(self):
+        """
+        Deletes the memos that have not been retrieved (or created) within `memo_ttl` seconds.
+
+        Returns:
+            int: The number of memos deleted.
+        """
+        if self.memo_ttl is None:
+            return 0
+        with self._maintenance_lock:
+            # Pending retrievals would otherwise leave recently used memos looking expired
+            self.flush_access_stats()
+            victims = [row[0] for row in self.connections.reader().execute(
+                f"SELECT id FROM memos WHERE {LAST_USED} < ?", (time.time() - self.memo_ttl,))]
+            expired = self.delete_memos(victims)
+        if expired:
+            self.evicted += expired
+            logger.info("Expired %s memos; %s remain.", expired, len(self.index))
+        return expired
+
+    def evict(self, max_memos=None, policy=None):
+        """
+        Deletes expired memos (see `memo_ttl`), then evicts by policy until the store is within capacity.
+
+        Retrieval statistics are flushed first, so the policy sees every lookup so far.
+
+        Args:
+            max_memos (int, optional): Capacity to evict down to. Defaults to 95% of `max_memos`,
+                or no capacity eviction if that is unset.
+            policy (str, optional): Overrides `eviction_policy`.
+
+        Returns:
+            int: The number of memos evicted.
+        """
+        policy = policy or self.eviction_policy
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction_policy: {policy}")
+        if max_memos is None and self.max_memos is not None:
+            max_memos = int(self.max_memos * (1 - EVICTION_HEADROOM))
+        with self._maintenance_lock:
+            self.flush_access_stats()
+            reader = self.connections.reader()
+            victims = []
+            if self.memo_ttl is not None:
+                victims = [row[0] for row in reader.execute(
+                    f"SELECT id FROM memos WHERE {LAST_USED} < ?", (time.time() - self.memo_ttl,))]
+            if max_memos is not None:
+                excess = reader.execute("SELECT COUNT(*) FROM memos").fetchone()[0] - len(victims) - max_memos
+                if excess > 0:
+                    expired = set(victims)
+                    rows = reader.execute(
+                        f"SELECT id FROM memos ORDER BY {EVICTION_POLICIES[policy]} LIMIT ?",
+                        (excess + len(expired),))
+                    victims.extend(memo_id for (memo_id,) in rows if memo_id not in expired)
+                    victims = victims[:len(expired) + excess]
+            evicted = self.delete_memos(victims)
+        if evicted:
+            self.evicted += evicted
+            logger.info("Evicted %s memos (%s); %s remain.", evicted, policy, len(self.index))
+        return evicted
+
+    def compact(self, vacuum_step_pages=1024):
+        """
+        Evicts, reclaims free SQLite pages and rebuilds the in-memory index, without blocking readers.
+
+        Free pages are released with `incremental_vacuum` in steps of `vacuum_step_pages`, each
+        its own short write, so other writers interleave and WAL readers keep their snapshot.
+        A database created before incremental vacuuming was enabled is converted by one full
+        VACUUM the first time. The new index is built from a read snapshot off the lock and
+        swapped in, then caught up with the rows written meanwhile.
+
+        Returns:
+            dict: 'evicted', 'pages_freed', 'memos' and 'seconds'.
+        """
+        start = time.perf_counter()
+        with metrics.span("axys_memo_compaction_seconds", "MemoStore compaction duration."):
+            evicted = self.evict()
+            with self._maintenance_lock:
+                try:
+                    pages_freed = self._reclaim_pages(vacuum_step_pages)
+                    self.connections.execute_write("PRAGMA optimize")
+                    self.connections.checkpoint()
+                    self._rebuild_index()
+                except Exception as e:
+                    logger.error(f"Failed to compact memo store: {e}")
+                    raise
+        stats = {
+            'evicted': evicted,
+            'pages_freed': pages_freed,
+            'memos': len(self.index),
+            'seconds': time.perf_counter() - start,
+        }
+        logger.info("Compacted memo store: %s", stats)
+        return stats
+
+    def _reclaim_pages(self, step_pages):
+        reader = self.connections.reader()
+        free_pages = reader.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free_pages:
+            return 0
+        if reader.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Switching to incremental mode requires one full rewrite of the file
+            self.connections.execute_write("PRAGMA auto_vacuum = INCREMENTAL")
+            self.connections.execute_write("VACUUM")
+            logger.info("Enabled incremental vacuum on %s.", self.path_to_db_file)
+            return free_pages
+        freed = 0
+        while True:
+            remaining = reader.execute("PRAGMA freelist_count").fetchone()[0]
+            if not remaining:
+                break
+            self.connections.execute_write(f"PRAGMA incremental_vacuum({int(step_pages)})")
+            step = remaining - reader.execute("PRAGMA freelist_count").fetchone()[0]
+            if step <= 0:
+                break
+            freed += step
+        return freed
+
+    def _rebuild_index(self, batch_size=10000):
+        index, synced_id = self._new_index(), 0
+        cursor = self.connections.reader().execute(
+            "SELECT id, input_embedding, embedding_dim, embedding_dtype FROM memos ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            index.add_batch([row[0] for row in rows],
+                            [deserialize_embedding(row[1], row[2], row[3]) for row in rows])
+            synced_id = rows[-1][0]
+        if self.index_mode == "ivf" and (index.is_trained or index.needs_training):
+            # Rebalances the partitions after evictions and growth
+            index.train()
+        with self._lock:
+            self.index, self._synced_id = index, synced_id
+            self._sync_index()
+
+    def train_index(self):
+        """
+        Trains the IVF index once it holds `ivf_train_threshold` memos.
+
+        The maintenance job calls this after an insert crosses the threshold. As in `compact`,
+        the trained index is built from a read snapshot off the lock and swapped in, so
+        searches keep scanning exactly until it is ready.
+
+        Returns:
+            bool: Whether the index was trained.
+        """
+        if self.index_mode != "ivf":
+            return False
+        with self._maintenance_lock:
+            if not self.index.needs_training:
+                return False
+            start = time.perf_counter()
+            try:
+                self._rebuild_index()
+            except Exception as e:
+                logger.error(f"Failed to train memo index: {e}")
+                raise
+        logger.info("Trained IVF index on %d memos in %.1fs.", len(self.index), time.perf_counter() - start)
+        return True
+
+    def deduplicate(self, threshold=None, dry_run=False):
+        """
+        Merges near-duplicate memos that are already stored, e.g. from before `dedup_threshold` was set.
+
+        Duplicates are grouped as in `db.dedup.duplicate_groups`. The oldest memo of each group
+        is kept; it absorbs the others' `times_seen` counts and tags, and the others are deleted
+        in one transaction. Every embedding is loaded for the pass, so run it offline (see
+        `python -m db.dedup`) rather than on a serving process.
+
+        Args:
+            threshold (float, optional): Cosine distance threshold. Defaults to `dedup_threshold`,
+                or DEFAULT_DEDUP_THRESHOLD if that is unset.
+            dry_run (bool, optional): Only report what would be removed. Defaults to False.
+
+        Returns:
+            dict: 'scanned', 'groups' and 'removed' counts, 'dry_run' and 'seconds'.
+        """
+        if threshold is None:
+            threshold = self.dedup_threshold if self.dedup_threshold is not None else DEFAULT_DEDUP_THRESHOLD
+        start = time.perf_counter()
+        self.flush()
+        try:
+            rows = self.connections.reader().execute(
+                "SELECT id, input_embedding, output_embedding, embedding_dim, user_id, embedding_dtype "
+                "FROM memos ORDER BY id"
+            ).fetchall()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            inputs = normalize_rows(
+                [deserialize_embedding(row[1], row[3], row[5]) for row in rows]) if rows else None
+            outputs = normalize_rows(
+                [deserialize_embedding(row[2], row[3], row[5]) for row in rows]) if rows else None
+            owner_codes = {}
+            owners = np.array([owner_codes.setdefault(row[4], len(owner_codes)) for row in rows],
+                              dtype=np.int64)
+            del rows
+            groups = duplicate_groups(ids, inputs, outputs, owners, threshold) if len(ids) else {}
+            removed = sum(len(duplicates) for duplicates in groups.values())
+
+            if groups and not dry_run:
+                with self._lock, self.connections.write() as conn:
+                    for memo_id, duplicates in groups.items():
+                        placeholders = ",".join("?" * len(duplicates))
+                        conn.execute(
+                            "UPDATE memos SET "
+                            f"times_seen = times_seen + (SELECT SUM(times_seen) FROM memos WHERE id IN ({placeholders})), "
+                            "last_seen_at = MAX(COALESCE(last_seen_at, created_at, 0), "
+                            f"(SELECT MAX(COALESCE(last_seen_at, created_at, 0)) FROM memos WHERE id IN ({placeholders}))) "
+                            "WHERE id = ?",
+                            duplicates + duplicates + [memo_id])
+                        conn.execute(
+                            "INSERT OR IGNORE INTO memo_tags (tag, memo_id) "
+                            f"SELECT tag, ? FROM memo_tags WHERE memo_id IN ({placeholders})",
+                            [memo_id] + duplicates)
+                    deleted = [(memo_id,) for duplicates in groups.values() for memo_id in duplicates]
+                    conn.executemany("DELETE FROM memo_tags WHERE memo_id = ?", deleted)
+                    conn.executemany("DELETE FROM memos WHERE id = ?", deleted)
+                    # The persisted IVF index still holds the deleted rows, so both indexes are rebuilt
+                    if os.path.exists(self.path_to_index_file):
+                        os.remove(self.path_to_index_file)
+                self._load_index()
+        except Exception as e:
+            logger.error(f"Failed to deduplicate memos: {e}")
+            raise
+
+        stats = {
+            'scanned': int(len(ids)),
+            'groups': len(groups),
+            'removed': removed,
+            'dry_run': dry_run,
+            'seconds': time.perf_counter() - start,
+        }
+        logger.info("Deduplicated memos: %s", stats)
+        return stats
+
     def prepopulate(self):
         """
         Adds a few arbitrary examples to the vector database, just to make retrieval less trivial.
@@ -205,15 +1156,16 @@ class MemoStore:
             ("How are you?", "I'm just a computer program, so I don't have feelings, but thanks for asking!")
         ]
 
-        for input_text, output_text in examples:
-            self.add_input_output_pair(input_text, output_text)
+        self.add_many((input_text, output_text, {"source": "prepopulate"})
+                      for input_text, output_text in examples)
 
     def list_memos(self):
         """
         Prints the contents of MemoStore.
         """
         try:
-            for row in self.conn.execute("SELECT * FROM memos"):
+            rows = self.connections.reader().execute("SELECT * FROM memos").fetchall()
+            for row in rows:
                 print(
                     f"ID: {row[0]}, Input Text: {row[1]}, Output Text: {row[2]}")
         except Exception as e:
@@ -0,0 +1,94 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Deduplication
+# Filepath: `/db/dedup.py`
+# Updated: 10-28-2023
+
+import os
+import json
+import sqlite3
+import argparse
+import numpy as np
+
+# Cosine distance below which two memos count as the same, for both their inputs and outputs
+DEFAULT_DEDUP_THRESHOLD = 0.05
+# Nearest stored inputs checked against each new memo
+DEDUP_CANDIDATES = 4
+
+
+def duplicate_groups(ids, inputs, outputs, owners, threshold=DEFAULT_DEDUP_THRESHOLD,
+                     chunk_elements=2**24):
+    """
+    Groups near-duplicate memos, keeping the oldest memo of each group.
+
+    Two memos are duplicates when they belong to the same owner and both their input and
+    output embeddings are within `threshold` cosine distance. Memos are visited in id order
+    and each one absorbs the later duplicates not already absorbed, so a memo is never both
+    kept and removed. Similarities are computed in row chunks of at most `chunk_elements`
+    floats, which bounds memory regardless of the store size.
+
+    Args:
+        ids (np.ndarray): Memo ids.
+        inputs (np.ndarray): L2-normalized input embeddings, one row per id.
+        outputs (np.ndarray): L2-normalized output embeddings, one row per id.
+        owners (np.ndarray): Integer owner code per id; memos of different owners never merge.
+        threshold (float, optional): Cosine distance threshold. Defaults to DEFAULT_DEDUP_THRESHOLD.
+        chunk_elements (int, optional): Similarity matrix size per chunk. Defaults to 2**24.
+
+    Returns:
+        dict: Kept memo id -> list of the duplicate ids it absorbs.
+    """
+    n = len(ids)
+    groups = {}
+    if n < 2:
+        return groups
+    order = np.argsort(ids, kind="stable")
+    removed = np.zeros(n, dtype=bool)
+    chunk = max(1, chunk_elements // n)
+    for start in range(0, n, chunk):
+        rows = order[start:start + chunk]
+        distances = 1.0 - inputs[rows] @ inputs.T
+        for offset, row in enumerate(rows):
+            if removed[row]:
+                continue
+            near = np.flatnonzero(distances[offset] < threshold)
+            near = near[(ids[near] > ids[row]) & ~removed[near] & (owners[near] == owners[row])]
+            if near.size:
+                near = near[1.0 - outputs[near] @ outputs[row] < threshold]
+            if near.size:
+                removed[near] = True
+                groups[int(ids[row])] = [int(memo_id) for memo_id in ids[near]]
+    return groups
+
+
+def main():
+    from .database import MemoStore
+
+    parser = argparse.ArgumentParser(
+        description="Merge near-duplicate memos that have already accumulated in a database.")
+    parser.add_argument("db_file", nargs="?",
+                        default=os.path.join(os.path.dirname(__file__), "app.db"))
+    parser.add_argument("--threshold", type=float, default=DEFAULT_DEDUP_THRESHOLD,
+                        help="Cosine distance below which inputs and outputs count as the same.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report what would be removed.")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM the database afterwards to reclaim space.")
+    args = parser.parse_args()
+
+    store = MemoStore(db_filename=os.path.abspath(args.db_file), index_mode="exact")
+    try:
+        stats = store.deduplicate(threshold=args.threshold, dry_run=args.dry_run)
+    finally:
+        store.close()
+    if args.vacuum and stats['removed'] and not args.dry_run:
+        conn = sqlite3.connect(args.db_file)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
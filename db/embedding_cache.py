@@ -0,0 +1,181 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Embedding Cache
+# Filepath: `/db/embedding_cache.py`
+# Updated: 10-28-2023
+
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from ops.config import logger
+from ops.metrics import metrics
+from .memo_index import to_numpy
+from .embedding_format import serialize_embedding, deserialize_embedding
+from .embedding_service import get_service
+
+
+class EmbeddingCache:
+    """
+    Caches sentence embeddings keyed by (model name, text hash).
+
+    The first tier is a bounded in-process LRU. An optional second tier persists embeddings
+    in a separate SQLite file so they survive restarts. Misses go to the process-wide
+    EmbeddingService of the model, which batches them with other threads' misses.
+    """
+
+    def __init__(self, model_name, model=None, max_entries=10000, path_to_cache_file=None):
+        """
+        Args:
+            model_name (str): Name of the model, part of every cache key.
+            model (optional): Object with a SentenceTransformer-compatible `encode`, called directly.
+                Defaults to the shared EmbeddingService for `model_name`, whose model is loaded
+                on the first cache miss.
+            max_entries (int, optional): Size of the in-process LRU. Defaults to 10000.
+            path_to_cache_file (str, optional): SQLite file for the persistent tier. Disabled if None.
+        """
+        self._model = model
+        self._service = get_service(model_name) if model is None else None
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.conn = None
+        if path_to_cache_file:
+            try:
+                self.conn = sqlite3.connect(path_to_cache_file, check_same_thread=False)
+                with self.conn:
+                    self.conn.execute("""
+                        CREATE TABLE IF NOT EXISTS embeddings (
+                            key TEXT PRIMARY KEY,
+                            embedding BLOB NOT NULL
+                        );
+                    """)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open embedding cache {path_to_cache_file}: {e}")
+                raise
+
+    @property
+    def model(self):
+        if self._model is not None:
+            return self._model
+        return self._service.model
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, embedding):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, keys):
+        """
+        Returns {key: embedding} for every key found in either tier, counting hits.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.hits += 1
+
+        missing = [key for key in keys if key not in found]
+        if self.conn is not None and missing:
+            placeholders = ",".join("?" * len(missing))
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})",
+                    missing).fetchall()
+                for key, blob in rows:
+                    found[key] = deserialize_embedding(blob)
+                    self._remember(key, found[key])
+                    self.persistent_hits += 1
+        return found
+
+    def _store(self, items):
+        """
+        Adds freshly computed (key, embedding) pairs to both tiers.
+        """
+        with self._lock:
+            for key, embedding in items:
+                self._remember(key, embedding)
+            if self.conn is not None and items:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                        [(key, serialize_embedding(embedding)) for key, embedding in items])
+
+    def encode(self, text):
+        """
+        Returns the embedding of one text, computing it only on a cache miss.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            np.ndarray: A read-only float32 embedding.
+        """
+        return self.encode_many([text])[0]
+
+    def encode_many(self, texts, batch_size=32):
+        """
+        Returns embeddings for several texts, encoding all misses in one batched model call.
+
+        Args:
+            texts (list): The texts to embed.
+            batch_size (int, optional): Batch size passed to the model. Defaults to 32.
+
+        Returns:
+            list: One read-only float32 embedding per text.
+        """
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Encode each distinct missing text once, even if it repeats within the call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            with self._lock:
+                self.misses += len(missing)
+            with metrics.span("axys_embedding_encode_seconds", "Embedding model encode call latency."):
+                encoder = self._service if self._service is not None else self._model
+                embeddings = encoder.encode(list(missing.values()), batch_size=batch_size)
+            computed = []
+            for key, embedding in zip(missing, embeddings):
+                embedding = to_numpy(embedding)
+                embedding.flags.writeable = False
+                found[key] = embedding
+                computed.append((key, embedding))
+            self._store(computed)
+        return [found[key] for key in keys]
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and current LRU size.
+        """
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+            }
+
+    def close(self):
+        """
+        Closes the persistent tier, if any.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,85 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Embedding Storage Format
+# Filepath: `/db/embedding_format.py`
+# Updated: 10-28-2023
+
+import numpy as np
+from .memo_index import to_numpy
+from .quantization import quantize_rows
+
+# Version 0: pickled torch tensors (legacy)
+# Version 1: raw little-endian float32 bytes, dimension stored in `memos.embedding_dim`
+# Version 2: same embeddings; memo metadata columns and tags added (db/schema.py)
+# Version 3: same embeddings; duplicate counters added (db/schema.py)
+# Version 4: same embeddings; retrieval statistics added (db/schema.py)
+# Version 5: same embeddings; full-text index added (db/schema.py)
+# Version 6: embeddings may also be stored as float16, or as int8 prefixed with a float32
+#            scale, as recorded per row in `memos.embedding_dtype` (NULL means float32)
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_DTYPE = np.dtype('<f4')
+STORAGE_DTYPES = {"float32": EMBEDDING_DTYPE, "float16": np.dtype('<f2'), "int8": np.dtype('i1')}
+
+
+def serialize_embedding(embedding, dtype="float32"):
+    """
+    Serializes an embedding into raw little-endian bytes.
+
+    Args:
+        embedding (array-like): The embedding (numpy array, list or torch tensor).
+        dtype (str, optional): "float32", "float16" or "int8". Defaults to "float32".
+
+    Returns:
+        bytes: The raw vector bytes: 4 or 2 bytes per dimension, or for int8 a 4-byte
+            float32 scale followed by 1 byte per dimension.
+    """
+    vector = to_numpy(embedding).astype(EMBEDDING_DTYPE, copy=False).reshape(1, -1)
+    rows, scales = quantize_rows(vector, dtype)
+    data = rows.astype(STORAGE_DTYPES[dtype], copy=False).tobytes()
+    if scales is not None:
+        data = scales.astype(EMBEDDING_DTYPE).tobytes() + data
+    return data
+
+
+def deserialize_embedding(blob, dim=None, dtype=None):
+    """
+    Reads an embedding back from raw bytes.
+
+    float32 embeddings are returned as a read-only view over the blob without copying;
+    float16 and int8 embeddings are converted to a new float32 array.
+
+    Args:
+        blob (bytes): The stored bytes.
+        dim (int, optional): Expected dimension. Validated against the blob size when given.
+        dtype (str, optional): Storage type from `memos.embedding_dtype`. None means float32.
+
+    Returns:
+        np.ndarray: A float32 vector.
+    """
+    if dtype is None or dtype == "float32":
+        vector = np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+    elif dtype == "float16":
+        vector = np.frombuffer(blob, dtype=STORAGE_DTYPES[dtype]).astype(np.float32)
+    elif dtype == "int8":
+        scale = np.frombuffer(blob, dtype=EMBEDDING_DTYPE, count=1)[0]
+        vector = np.frombuffer(blob, dtype=STORAGE_DTYPES[dtype], offset=4).astype(np.float32) * scale
+    else:
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+    if dim is not None and vector.size != dim:
+        raise ValueError(
+            f"Stored embedding has {vector.size} dimensions, expected {dim}")
+    return vector
+
+
+def get_format_version(conn):
+    """
+    Returns the embedding format version recorded in the database header.
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_format_version(conn, version=EMBEDDING_FORMAT_VERSION):
+    """
+    Records the embedding format version in the database header.
+    """
+    conn.execute(f"PRAGMA user_version = {int(version)}")
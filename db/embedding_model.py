@@ -0,0 +1,46 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Embedding Model Loader
+# Filepath: `/db/embedding_model.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+from ops.config import logger
+
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(model_name):
+    """
+    Returns the process-wide SentenceTransformer for `model_name`, loading it on first use.
+
+    `sentence_transformers` (and torch with it) is only imported here, so importing the
+    database modules stays cheap until an embedding is actually needed.
+
+    Args:
+        model_name (str): Model name or path understood by SentenceTransformer.
+    """
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            start = time.perf_counter()
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+            _models[model_name] = model
+            logger.info(
+                f"EMBEDDING-MODEL: Loaded {model_name} in {time.perf_counter() - start:.2f}s.")
+        return model
+
+
+def register_model(model_name, model):
+    """
+    Registers an already constructed model (or a stand-in with a compatible `encode`) under a name.
+    """
+    with _lock:
+        _models[model_name] = model
+
+
+def is_loaded(model_name):
+    return model_name in _models
@@ -0,0 +1,222 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Embedding Service
+# Filepath: `/db/embedding_service.py`
+# Updated: 10-28-2023
+
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+from ops.config import logger
+from ops.metrics import metrics
+from .embedding_model import get_model
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class EmbeddingService:
+    """
+    Shares one embedding model between every caller in the process and batches their requests.
+
+    `encode` calls from storage, retrieval and caching threads go into one queue. A worker
+    thread takes the first request, then keeps adding queued requests until the batch holds
+    `max_batch_size` texts or `max_wait` seconds have passed, and encodes the batch with one
+    model call. Under concurrent load this turns many single-text calls into a few large
+    ones, which CPU inference runs far more efficiently; a lone request waits at most
+    `max_wait`. Identical texts within a batch are encoded once.
+
+    Requests larger than `max_batch_size` are queued one chunk at a time, at most one per
+    worker, so a query arriving during a bulk insert waits for the chunks being encoded
+    rather than the whole insert. The worker threads start on the first `encode`, so a
+    process that never embeds (such as a shard process) runs none.
+
+    `encode` has the signature of SentenceTransformer.encode, so the service can stand in
+    for the model wherever one is expected.
+    """
+
+    def __init__(self, model_name, model=None, max_batch_size=64, max_wait=0.002, workers=1):
+        """
+        Args:
+            model_name (str): Model name, loaded through `get_model` on the first batch.
+            model (optional): Object with a SentenceTransformer-compatible `encode`. Defaults to the
+                shared model for `model_name`.
+            max_batch_size (int, optional): Texts per model call. Larger requests are split into
+                chunks of this size. Defaults to 64.
+            max_wait (float, optional): Seconds to wait for a batch to fill. Defaults to 0.002.
+            workers (int, optional): Batches encoded concurrently; torch releases the GIL while
+                it computes. Defaults to 1.
+        """
+        self.model_name = model_name
+        self._model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self.encoded_texts = 0
+        self.largest_batch = 0
+        self._stats_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f"embedding-batcher-{number}", daemon=True)
+            for number in range(max(int(workers), 1))]
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._closed:
+                raise RuntimeError("Embedding service is closed.")
+            if not self._started:
+                for thread in self._threads:
+                    thread.start()
+                self._started = True
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_model(self.model_name)
+        return self._model
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """
+        Embeds one text or a list of texts, batched with the requests of other threads.
+
+        Args:
+            sentences (str or list): The text(s) to embed.
+            batch_size (int, optional): Accepted for SentenceTransformer compatibility; batches
+                are sized by `max_batch_size`.
+
+        Returns:
+            np.ndarray: One embedding for a single text, or one row per text.
+        """
+        if not self._started:
+            self._start()
+        if self._closed:
+            raise RuntimeError("Embedding service is closed.")
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        results, in_flight = [], deque()
+        for start in range(0, len(texts), self.max_batch_size):
+            if len(in_flight) >= len(self._threads):
+                results.append(in_flight.popleft().result())
+            future = Future()
+            self._queue.put((texts[start:start + self.max_batch_size], future))
+            in_flight.append(future)
+        results.extend(future.result() for future in in_flight)
+        embeddings = results[0] if len(results) == 1 else np.concatenate(results)
+        return embeddings[0] if single else embeddings
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return batch
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = (self._queue.get(timeout=remaining) if remaining > 0
+                           else self._queue.get_nowait())
+            except queue.Empty:
+                break
+            batch.append(request)
+            if request is None:
+                break
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            requests = [request for request in batch if request is not None]
+            if requests:
+                self._encode_batch(requests)
+            if stop:
+                return
+
+    def _encode_batch(self, requests):
+        distinct = list(dict.fromkeys(text for texts, _ in requests for text in texts))
+        with self._stats_lock:
+            self.requests += len(requests)
+            self.batches += 1
+            self.encoded_texts += len(distinct)
+            self.largest_batch = max(self.largest_batch, len(distinct))
+        metrics.observe("axys_embedding_batch_size", len(distinct), "Texts per batched embedding model call.",
+                        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+        try:
+            with metrics.span("axys_embedding_batch_seconds", "Batched embedding model call latency."):
+                embeddings = np.asarray(self.model.encode(distinct, batch_size=self.max_batch_size),
+                                        dtype=np.float32)
+        except Exception as e:
+            logger.error(f"EMBEDDING-SERVICE: Batch of {len(distinct)} texts failed: {e}")
+            for _, future in requests:
+                future.set_exception(e)
+            return
+        rows = {text: row for row, text in enumerate(distinct)}
+        for texts, future in requests:
+            future.set_result(embeddings[[rows[text] for text in texts]])
+
+    def stats(self):
+        """
+        Returns the queue depth and batching counters.
+        """
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'requests': self.requests,
+                'batches': self.batches,
+                'encoded_texts': self.encoded_texts,
+                'mean_batch_size': self.encoded_texts / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch,
+            }
+
+    def close(self):
+        """
+        Encodes the requests still queued, then stops the worker threads.
+        """
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._started:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+        logger.debug("EMBEDDING-SERVICE: Closed %s: %s", self.model_name, self.stats())
+
+
+def _total_queue_depth():
+    with _services_lock:
+        return sum(service.queue_depth for service in _services.values())
+
+
+def get_service(model_name, **settings):
+    """
+    Returns the process-wide EmbeddingService for `model_name`, starting it on first use.
+
+    Args:
+        model_name (str): Model name or path understood by SentenceTransformer.
+        **settings: EmbeddingService settings, used only when the service is created.
+    """
+    with _services_lock:
+        service = _services.get(model_name)
+        if service is None:
+            service = EmbeddingService(model_name, **settings)
+            _services[model_name] = service
+            if len(_services) == 1:
+                metrics.gauge("axys_embedding_queue_depth", "Embedding requests waiting for a batch.",
+                              _total_queue_depth)
+        return service
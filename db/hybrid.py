@@ -0,0 +1,107 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Hybrid Retrieval
+# Filepath: `/db/hybrid.py`
+# Updated: 10-28-2023
+
+import re
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+# Words too common to narrow the lexical candidate set
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from had has have how i if in is it its me my
+    no not of on or so that the their them then there these they this to was we were what when
+    where which who why will with you your
+""".split())
+
+# BM25 scores every memo a term matches, so the query keeps its rarest terms until they match
+# this many times the wanted candidates. Common terms add work but barely change the top ranks.
+LEXICAL_SCAN_FACTOR = 4
+
+# Counts how many memos contain a term, stopping once it is known to exceed the budget. A full
+# count (or fts5vocab) walks the term's whole posting list, which is costly for common terms.
+CAPPED_DOCUMENT_COUNT = "SELECT COUNT(*) FROM (SELECT 1 FROM memos_fts WHERE memos_fts MATCH ? LIMIT ?)"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(text, max_terms=32):
+    """
+    Returns the distinct significant words of `text`, lowercased, in order of appearance.
+
+    Args:
+        text (str): The query text.
+        max_terms (int, optional): Longest query kept, in distinct words. Defaults to 32.
+    """
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word not in STOPWORDS and word not in terms:
+            terms.append(word)
+            if len(terms) == max_terms:
+                break
+    return terms
+
+
+def select_terms(terms, document_counts, budget):
+    """
+    Keeps the rarest matching terms whose combined document counts fit in `budget`.
+
+    Args:
+        terms (list): Query terms.
+        document_counts (dict): Term -> number of memos containing it, possibly capped just above `budget`.
+        budget (int): Maximum total postings to score.
+
+    Returns:
+        list: The kept terms, rarest first. Empty if every matching term alone exceeds the budget.
+    """
+    kept, spent = [], 0
+    for term in sorted(terms, key=lambda term: document_counts.get(term, 0)):
+        count = document_counts.get(term, 0)
+        if not count:
+            continue
+        if spent + count > budget:
+            break
+        kept.append(term)
+        spent += count
+    return kept
+
+
+def match_expression(terms):
+    """
+    Builds an FTS5 MATCH expression that finds memos containing any of `terms`.
+
+    Every term is quoted, so punctuation and FTS5 operators in user text are matched literally.
+
+    Returns:
+        str: The expression, or None if there are no terms.
+    """
+    if not terms:
+        return None
+    return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def reciprocal_rank_fusion(vector_ranking, lexical_ranking, vector_weight=0.7, k=60):
+    """
+    Fuses two rankings of memo ids into one score per id.
+
+    score = vector_weight / (k + vector rank) + (1 - vector_weight) / (k + lexical rank)
+
+    Ranks start at 1, and an id missing from a ranking contributes nothing for it. Rank
+    fusion needs no calibration between BM25 and cosine scales, and `k` damps the influence
+    of the top few ranks.
+
+    Args:
+        vector_ranking (list): Memo ids by ascending embedding distance.
+        lexical_ranking (list): Memo ids by descending BM25 relevance.
+        vector_weight (float, optional): Share of the score given to the embedding ranking. Defaults to 0.7.
+        k (int, optional): Rank damping constant. Defaults to 60.
+
+    Returns:
+        list: (memo_id, score) tuples by descending score.
+    """
+    scores = {}
+    for weight, ranking in ((vector_weight, vector_ranking), (1.0 - vector_weight, lexical_ranking)):
+        for rank, memo_id in enumerate(ranking, start=1):
+            scores[memo_id] = scores.get(memo_id, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
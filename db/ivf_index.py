@@ -0,0 +1,346 @@
+# OpenMindAI
+# Version: AXYS
+# Module: IVF Memo Index
+# Filepath: `/db/ivf_index.py`
+# Updated: 10-28-2023
+
+import os
+import time
+import sqlite3
+import argparse
+import numpy as np
+from .memo_index import MemoIndex, normalize_rows, to_numpy
+from .embedding_format import deserialize_embedding
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    """
+    Returns the index of the most similar centroid for every (normalized) vector.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(
+            chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=None, seed=0):
+    """
+    Clusters normalized vectors by cosine similarity.
+
+    Args:
+        vectors (np.ndarray): Normalized float32 vectors, one per row.
+        n_clusters (int): Number of centroids.
+        n_iter (int, optional): Lloyd iterations. Defaults to 10.
+        sample_size (int, optional): Train on a random sample of this many rows. Defaults to 256 per cluster.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: A (n_clusters, dim) array of normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or 256 * n_clusters
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Re-seed empty clusters with random points so every list stays useful
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Approximate inverted-file (IVF) index over memo input embeddings.
+
+    Vectors are partitioned by their nearest k-means centroid. A query scores only the
+    `nprobe` closest partitions, trading recall for latency. Until it is trained the index
+    holds a single partition and searches exactly. Adding vectors never trains it: once
+    `needs_training` is set, the owner calls `train` (MemoStore does so from its background
+    maintenance job), so inserts never wait for k-means.
+    """
+
+    def __init__(self, n_lists=None, nprobe=8, train_threshold=10000, seed=0, dtype="float32"):
+        """
+        Args:
+            n_lists (int, optional): Number of partitions. Defaults to 4 * sqrt(N) at training time.
+            nprobe (int, optional): Partitions scored per query. Defaults to 8.
+            train_threshold (int, optional): Vector count at which `needs_training` is set. Defaults to 10000.
+            seed (int, optional): Random seed for k-means. Defaults to 0.
+            dtype (str, optional): Row type of the partitions, see MemoIndex. Defaults to "float32".
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.seed = seed
+        self.dtype = dtype
+        self.centroids = None
+        self.last_id = 0
+        self._lists = [MemoIndex(dtype=dtype)]
+
+    def __len__(self):
+        return sum(len(inverted_list) for inverted_list in self._lists)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def needs_training(self):
+        return not self.is_trained and len(self) >= self.train_threshold
+
+    def add(self, memo_id, embedding):
+        """
+        Adds one memo embedding to the index.
+        """
+        self.add_batch([memo_id], [to_numpy(embedding)])
+
+    def add_batch(self, memo_ids, embeddings):
+        """
+        Adds memo embeddings to the partitions of their nearest centroids.
+
+        Args:
+            memo_ids (list): Row ids of the memos.
+            embeddings (array-like): One embedding per id.
+        """
+        if len(memo_ids) == 0:
+            return
+        memo_ids = np.asarray(memo_ids, dtype=np.int64)
+        rows = normalize_rows(embeddings)
+        self.last_id = max(self.last_id, int(memo_ids.max()))
+
+        if not self.is_trained:
+            self._lists[0].add_batch(memo_ids, rows)
+            return
+
+        assignments = _assign(rows, self.centroids)
+        for list_number in np.unique(assignments):
+            mask = assignments == list_number
+            self._lists[list_number].add_batch(memo_ids[mask], rows[mask])
+
+    def _all(self):
+        ids = np.concatenate([inverted_list.ids for inverted_list in self._lists])
+        vectors = np.concatenate(
+            [inverted_list.vectors for inverted_list in self._lists if len(inverted_list)])
+        return ids, vectors
+
+    def train(self, n_lists=None, n_iter=10):
+        """
+        (Re)clusters every stored vector and rebuilds the partitions.
+
+        Call again after the store has grown a lot so the partitions stay balanced.
+
+        Args:
+            n_lists (int, optional): Number of partitions. Defaults to the configured value or 4 * sqrt(N).
+            n_iter (int, optional): k-means iterations. Defaults to 10.
+        """
+        if len(self) == 0:
+            return
+        ids, vectors = self._all()
+        n_lists = n_lists or self.n_lists or max(1, int(4 * np.sqrt(len(ids))))
+        self.centroids = spherical_kmeans(
+            vectors, n_lists, n_iter=n_iter, seed=self.seed)
+        self.n_lists = len(self.centroids)
+
+        self._lists = [MemoIndex(dim=vectors.shape[1], dtype=self.dtype) for _ in range(self.n_lists)]
+        assignments = _assign(vectors, self.centroids)
+        for list_number in range(self.n_lists):
+            mask = assignments == list_number
+            self._lists[list_number].add_batch(ids[mask], vectors[mask])
+
+    def remove(self, memo_ids):
+        """
+        Removes memos from every partition. Centroids are kept; `train` rebalances them.
+
+        Returns:
+            int: The number of vectors removed.
+        """
+        memo_ids = np.asarray(memo_ids, dtype=np.int64)
+        return sum(inverted_list.remove(memo_ids) for inverted_list in self._lists)
+
+    def clear(self):
+        """
+        Removes every vector and the trained centroids.
+        """
+        self.centroids = None
+        self.last_id = 0
+        self._lists = [MemoIndex(dtype=self.dtype)]
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the partitions and centroids.
+        """
+        centroids = self.centroids.nbytes if self.is_trained else 0
+        return centroids + sum(inverted_list.nbytes for inverted_list in self._lists)
+
+    def search(self, query_embedding, k=10, max_distance=None, nprobe=None, candidate_ids=None):
+        """
+        Finds approximately the k closest memos by cosine distance.
+
+        Args:
+            query_embedding (array-like): The query embedding.
+            k (int, optional): Maximum number of results. Defaults to 10.
+            max_distance (float, optional): Drop results whose distance is not below this value.
+            nprobe (int, optional): Overrides the configured number of partitions to score.
+            candidate_ids (array-like, optional): Only score these memo ids. A filtered candidate
+                set is usually small and may sit outside the probed partitions, so it is scored
+                exactly in every partition and `nprobe` is ignored.
+
+        Returns:
+            list: (memo_id, distance) tuples sorted by ascending distance.
+        """
+        if not self.is_trained:
+            return self._lists[0].search(query_embedding, k=k, max_distance=max_distance,
+                                         candidate_ids=candidate_ids)
+
+        query = normalize_rows(to_numpy(query_embedding))[0]
+        if candidate_ids is not None:
+            candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+            results = []
+            for inverted_list in self._lists:
+                results.extend(inverted_list.search(
+                    query, k=k, max_distance=max_distance, candidate_ids=candidate_ids))
+            results.sort(key=lambda result: result[1])
+            return results[:k]
+
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        similarities = self.centroids @ query
+        if nprobe < self.n_lists:
+            probes = np.argpartition(-similarities, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.n_lists)
+
+        results = []
+        for list_number in probes:
+            results.extend(self._lists[list_number].search(
+                query, k=k, max_distance=max_distance))
+        results.sort(key=lambda result: result[1])
+        return results[:k]
+
+    def save(self, path):
+        """
+        Persists the index atomically to `path` (an .npz file).
+        """
+        ids, vectors = self._all() if len(self) else (
+            np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32))
+        sizes = np.array([len(inverted_list) for inverted_list in self._lists], dtype=np.int64)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, ids=ids, vectors=vectors, sizes=sizes,
+                     centroids=self.centroids if self.is_trained else np.zeros((0, 0), dtype=np.float32),
+                     settings=np.array([self.nprobe, self.train_threshold, self.last_id, self.seed],
+                                       dtype=np.int64),
+                     dtype=np.array(self.dtype))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with `save`.
+        """
+        with np.load(path) as data:
+            nprobe, train_threshold, last_id, seed = (int(value) for value in data["settings"])
+            # Indexes saved before quantization was supported hold float32 rows
+            dtype = str(data["dtype"]) if "dtype" in data.files else "float32"
+            index = cls(nprobe=nprobe, train_threshold=train_threshold, seed=seed, dtype=dtype)
+            index.last_id = last_id
+            if data["centroids"].size:
+                index.centroids = data["centroids"]
+                index.n_lists = len(index.centroids)
+            ids, vectors, sizes = data["ids"], data["vectors"], data["sizes"]
+
+        index._lists = []
+        offset = 0
+        for size in sizes:
+            inverted_list = MemoIndex(dtype=index.dtype)
+            inverted_list.add_batch(ids[offset:offset + size], vectors[offset:offset + size])
+            index._lists.append(inverted_list)
+            offset += size
+        return index
+
+
+def recall_report(ids, vectors, k=10, n_queries=200, nprobe_values=(1, 2, 4, 8, 16, 32),
+                  n_lists=None, noise=0.05, seed=0):
+    """
+    Measures recall@k and query latency of an IVF index against the exact scan.
+
+    Queries are stored vectors perturbed with Gaussian noise, so they resemble real lookups
+    without matching a memo exactly.
+
+    Args:
+        ids (np.ndarray): Memo ids.
+        vectors (np.ndarray): Embeddings aligned with `ids`.
+        k (int, optional): Number of neighbours compared. Defaults to 10.
+        n_queries (int, optional): Number of sampled queries. Defaults to 200.
+        nprobe_values (tuple, optional): nprobe settings to evaluate.
+        n_lists (int, optional): Number of partitions. Defaults to 4 * sqrt(N).
+        noise (float, optional): Standard deviation of the query perturbation. Defaults to 0.05.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: One dict per nprobe with keys 'nprobe', 'recall_at_k', 'ann_ms' and 'exact_ms'.
+    """
+    rng = np.random.default_rng(seed)
+    exact = MemoIndex()
+    exact.add_batch(ids, vectors)
+    ann = IVFIndex(n_lists=n_lists, train_threshold=len(ids) + 1, seed=seed)
+    ann.add_batch(ids, vectors)
+    ann.train()
+
+    sample = normalize_rows(vectors)[rng.choice(len(ids), min(n_queries, len(ids)), replace=False)]
+    queries = sample + rng.normal(scale=noise, size=sample.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    truth = [set(memo_id for memo_id, _ in exact.search(query, k=k)) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobe_values:
+        start = time.perf_counter()
+        found = [set(memo_id for memo_id, _ in ann.search(query, k=k, nprobe=nprobe)) for query in queries]
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(t & f) / max(len(t), 1) for t, f in zip(truth, found)])
+        report.append({'nprobe': nprobe, 'recall_at_k': float(recall),
+                       'ann_ms': ann_ms, 'exact_ms': exact_ms})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report IVF recall@k and latency against the exact scan for a memo database.")
+    parser.add_argument("db_file", nargs="?",
+                        default=os.path.join(os.path.dirname(__file__), "app.db"))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-lists", type=int, default=None)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    rows = conn.execute(
+        "SELECT id, input_embedding, embedding_dim, embedding_dtype FROM memos").fetchall()
+    conn.close()
+    if not rows:
+        print(f"No memos in {args.db_file}")
+        return
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    vectors = np.stack([deserialize_embedding(row[1], row[2], row[3]) for row in rows])
+
+    print(f"{len(ids)} memos, k={args.k}")
+    print(f"{'nprobe':>8} {'recall@k':>10} {'ann ms':>10} {'exact ms':>10}")
+    for row in recall_report(ids, vectors, k=args.k, n_queries=args.queries, n_lists=args.n_lists):
+        print(f"{row['nprobe']:>8} {row['recall_at_k']:>10.3f} {row['ann_ms']:>10.3f} {row['exact_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
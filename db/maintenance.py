@@ -0,0 +1,133 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Maintenance
+# Filepath: `/db/maintenance.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+from ops.config import logger
+
+# ORDER BY clauses for the eviction policies; the first rows are evicted first.
+# Memos never retrieved count from their creation, so new memos are not evicted at once.
+EVICTION_POLICIES = {
+    # Least recently retrieved
+    "lru": "COALESCE(last_accessed_at, created_at, 0), id",
+    # Oldest first
+    "oldest": "COALESCE(created_at, 0), id",
+    # Fewest retrievals, least recently retrieved among equals
+    "lfu": "access_count, COALESCE(last_accessed_at, created_at, 0), id",
+}
+
+# SQL expression a memo's TTL is measured from
+LAST_USED = "COALESCE(last_accessed_at, created_at, 0)"
+
+
+class AccessTracker:
+    """
+    Buffers retrieval statistics in memory, so lookups never write to SQLite.
+
+    `drain` hands the pending counts to one batched UPDATE, run by the maintenance job,
+    before eviction, and on close.
+    """
+
+    def __init__(self):
+        self._pending = {}  # memo id -> [hits, last access time]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, memo_ids, now=None):
+        """
+        Counts one retrieval of each memo id.
+        """
+        now = now or time.time()
+        with self._lock:
+            for memo_id in memo_ids:
+                entry = self._pending.get(memo_id)
+                if entry is None:
+                    self._pending[memo_id] = [1, now]
+                else:
+                    entry[0] += 1
+                    entry[1] = now
+
+    def drain(self):
+        """
+        Returns and forgets the pending statistics as (hits, last access time, memo id) rows.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [(hits, accessed_at, memo_id) for memo_id, (hits, accessed_at) in pending.items()]
+
+
+class MaintenanceJob:
+    """
+    Background thread that keeps a MemoStore within its limits.
+
+    Every `access_flush_interval` seconds, or as soon as `trigger` is called, it writes the
+    buffered retrieval statistics, evicts when the store is over capacity (or else deletes
+    memos older than `memo_ttl`), and trains an IVF index that has reached its training
+    threshold. Every `interval` seconds it runs `MemoStore.compact`, which evicts, reclaims
+    free pages and rebuilds the in-memory index.
+    """
+
+    def __init__(self, memo_store, interval=3600.0, access_flush_interval=30.0):
+        """
+        Args:
+            memo_store (MemoStore): The store to maintain.
+            interval (float, optional): Seconds between compactions, or None to only run the
+                periodic and triggered work. Defaults to 3600.
+            access_flush_interval (float, optional): Seconds between access statistics writes, shortened
+                to the store's `memo_ttl` or `interval` if either is shorter. Defaults to 30.
+        """
+        self.memo_store = memo_store
+        self.interval = interval
+        self.access_flush_interval = min(
+            [access_flush_interval] + [value for value in (interval, memo_store.memo_ttl) if value])
+        self.runs = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="memo-maintenance", daemon=True)
+        self._thread.start()
+
+    def trigger(self):
+        """
+        Wakes the thread to run the pending work now, e.g. after an insert crossed a limit.
+        """
+        self._wake.set()
+
+    def _run(self):
+        next_compaction = None if self.interval is None else time.monotonic() + self.interval
+        while True:
+            self._wake.wait(self.access_flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                if next_compaction is not None and time.monotonic() >= next_compaction:
+                    self.memo_store.compact()
+                    self.runs += 1
+                    next_compaction = time.monotonic() + self.interval
+                else:
+                    self.memo_store.flush_access_stats()
+                    if self.memo_store.over_capacity():
+                        self.memo_store.evict()
+                    else:
+                        self.memo_store.expire()
+                    self.memo_store.train_index()
+            except Exception as e:
+                self.failures += 1
+                if next_compaction is not None:
+                    next_compaction = time.monotonic() + self.interval
+                logger.error(f"Memo maintenance failed: {e}")
+
+    def close(self):
+        """
+        Stops the background thread, waiting for a running compaction to finish.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
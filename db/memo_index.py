@@ -0,0 +1,243 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Index
+# Filepath: `/db/memo_index.py`
+# Updated: 10-28-2023
+
+import numpy as np
+from .quantization import EMBEDDING_DTYPES, quantize_rows, dequantize_rows, scaled_dot
+
+
+def normalize_rows(embeddings):
+    """
+    Returns a float32 copy of the given embeddings with every row scaled to unit length.
+
+    Args:
+        embeddings (array-like): A single vector or a 2-D array of vectors.
+
+    Returns:
+        np.ndarray: A 2-D float32 array of L2-normalized rows.
+    """
+    matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def to_numpy(embedding):
+    """
+    Converts an embedding (numpy array, list or torch tensor) into a flat float32 numpy array.
+    """
+    if hasattr(embedding, "detach"):
+        embedding = embedding.detach().cpu().numpy()
+    return np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+
+class MemoIndex:
+    """
+    Exact in-memory cosine index over memo input embeddings.
+
+    Embeddings are kept L2-normalized in one contiguous matrix, so a query is a single
+    matrix-vector product followed by a partial top-k selection. The matrix is float32 by
+    default; float16 halves and per-vector-scaled int8 quarters its memory (see db/quantization.py).
+    """
+
+    def __init__(self, dim=None, initial_capacity=1024, dtype="float32"):
+        """
+        Args:
+            dim (int, optional): Embedding dimension. Inferred from the first vector if None.
+            initial_capacity (int, optional): Number of rows to preallocate. Defaults to 1024.
+            dtype (str, optional): "float32", "float16" or "int8" rows. Defaults to "float32".
+        """
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown index dtype: {dtype}")
+        self.dim = dim
+        self.dtype = dtype
+        self._capacity = max(int(initial_capacity), 1)
+        self._size = 0
+        self._ids = np.zeros(self._capacity, dtype=np.int64)
+        # True while ids are strictly ascending, which lets `positions` binary search
+        self._sorted = True
+        self._matrix = None if dim is None else np.zeros(
+            (self._capacity, dim), dtype=dtype)
+        self._scales = np.ones(self._capacity, dtype=np.float32) if dtype == "int8" else None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self):
+        """
+        Memo ids in insertion order (a view, valid until the next insert).
+        """
+        return self._ids[:self._size]
+
+    @property
+    def vectors(self):
+        """
+        Normalized float32 embeddings aligned with `ids` (a view valid until the next insert,
+        or a dequantized copy for float16 and int8 indexes).
+        """
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self.dtype == "float32":
+            return self._matrix[:self._size]
+        return dequantize_rows(self._matrix[:self._size],
+                               None if self._scales is None else self._scales[:self._size])
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the vectors, scales and ids of the stored rows.
+        """
+        if self._matrix is None:
+            return 0
+        size = self._size
+        return (self._matrix[:size].nbytes + self._ids[:size].nbytes +
+                (self._scales[:size].nbytes if self._scales is not None else 0))
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dim), dtype=self.dtype)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        if self._scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+        self._matrix, self._ids, self._capacity = matrix, ids, capacity
+
+    def add(self, memo_id, embedding):
+        """
+        Adds one memo embedding to the index.
+
+        Args:
+            memo_id (int): Row id of the memo in the `memos` table.
+            embedding (array-like): The memo's input embedding.
+        """
+        self.add_batch([memo_id], [to_numpy(embedding)])
+
+    def add_batch(self, memo_ids, embeddings):
+        """
+        Adds several memo embeddings to the index in one copy.
+
+        Args:
+            memo_ids (list): Row ids of the memos.
+            embeddings (array-like): One embedding per id.
+        """
+        if len(memo_ids) == 0:
+            return
+        rows = normalize_rows(embeddings)
+        if self.dim is None:
+            self.dim = rows.shape[1]
+            self._matrix = np.zeros((self._capacity, self.dim), dtype=self.dtype)
+        if rows.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {rows.shape[1]} does not match index dimension {self.dim}")
+        self._reserve(len(rows))
+        memo_ids = np.asarray(memo_ids, dtype=np.int64)
+        if self._sorted and (np.any(memo_ids[1:] <= memo_ids[:-1]) or
+                             (self._size and memo_ids[0] <= self._ids[self._size - 1])):
+            self._sorted = False
+        rows, scales = quantize_rows(rows, self.dtype)
+        self._matrix[self._size:self._size + len(rows)] = rows
+        if scales is not None:
+            self._scales[self._size:self._size + len(rows)] = scales
+        self._ids[self._size:self._size + len(rows)] = memo_ids
+        self._size += len(rows)
+
+    def positions(self, memo_ids):
+        """
+        Returns the rows holding the given memo ids; ids not in the index are skipped.
+
+        Ids arrive in ascending order from the database, so this is a binary search per id,
+        with a hash-based fallback if the index was filled out of order.
+        """
+        ids = self._ids[:self._size]
+        memo_ids = np.asarray(memo_ids, dtype=np.int64)
+        if self._size == 0 or memo_ids.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        if not self._sorted:
+            return np.flatnonzero(np.isin(ids, memo_ids))
+        positions = np.minimum(np.searchsorted(ids, memo_ids), self._size - 1)
+        return positions[ids[positions] == memo_ids]
+
+    def remove(self, memo_ids):
+        """
+        Removes memos from the index, compacting the remaining rows in place.
+
+        Args:
+            memo_ids (array-like): Ids to remove; ids not in the index are ignored.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        rows = self.positions(memo_ids)
+        if rows.size == 0:
+            return 0
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        size = int(keep.sum())
+        # Removal keeps the relative order, so an ascending index stays ascending
+        self._matrix[:size] = self._matrix[:self._size][keep]
+        self._ids[:size] = self._ids[:self._size][keep]
+        if self._scales is not None:
+            self._scales[:size] = self._scales[:self._size][keep]
+        removed, self._size = self._size - size, size
+        return removed
+
+    def clear(self):
+        """
+        Removes every embedding from the index, keeping the allocated buffers.
+        """
+        self._size = 0
+        self._sorted = True
+
+    def search(self, query_embedding, k=10, max_distance=None, candidate_ids=None):
+        """
+        Finds the k memos closest to the query by cosine distance (1 - cosine similarity).
+
+        Args:
+            query_embedding (array-like): The query embedding.
+            k (int, optional): Maximum number of results. Defaults to 10.
+            max_distance (float, optional): Drop results whose distance is not below this value.
+            candidate_ids (array-like, optional): Only score these memo ids, e.g. the result of
+                a metadata filter. Scores every memo if None.
+
+        Returns:
+            list: (memo_id, distance) tuples sorted by ascending distance.
+        """
+        if self._size == 0 or k <= 0:
+            return []
+        query = normalize_rows(to_numpy(query_embedding))[0]
+        if candidate_ids is None:
+            rows = None
+            distances = 1.0 - scaled_dot(self._matrix[:self._size], query,
+                                         None if self._scales is None else self._scales[:self._size])
+        else:
+            rows = self.positions(candidate_ids)
+            distances = 1.0 - scaled_dot(self._matrix[rows], query,
+                                         None if self._scales is None else self._scales[rows])
+        n = len(distances)
+        if n == 0:
+            return []
+        k = min(k, n)
+        if k < n:
+            candidates = np.argpartition(distances, k - 1)[:k]
+        else:
+            candidates = np.arange(n)
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")]
+        ids = self._ids[:self._size] if rows is None else self._ids[rows]
+        results = []
+        for position in candidates:
+            distance = float(distances[position])
+            if max_distance is not None and distance >= max_distance:
+                break
+            results.append((int(ids[position]), distance))
+        return results
@@ -0,0 +1,192 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Writer
+# Filepath: `/db/memo_writer.py`
+# Updated: 10-28-2023
+
+import time
+import queue
+import threading
+from ops.config import logger
+from ops.metrics import metrics
+
+
+class MemoWriter:
+    """
+    Write-behind queue that stores memos off the caller's thread.
+
+    Writes go into a bounded queue. A background thread drains it in batches and hands each
+    batch to `MemoStore.add_many`, so embeddings are computed in one batched call and the
+    rows are committed in one transaction. When the queue is full, `submit` blocks
+    (backpressure) instead of letting memory grow.
+
+    A batch that fails is retried with exponential backoff. If it still fails, its memos are
+    written one at a time, so one bad memo does not take the rest of the batch with it. Memos
+    that fail on their own as well are dropped and counted in `failed` and in the
+    `axys_memo_writes_dropped_total` metric.
+    """
+
+    def __init__(self, memo_store, max_queue_size=1024, batch_size=64, max_wait=0.05,
+                 max_retries=3, retry_delay=0.1):
+        """
+        Args:
+            memo_store (MemoStore): The store that batches are written to.
+            max_queue_size (int, optional): Pending memos allowed before `submit` blocks. Defaults to 1024.
+            batch_size (int, optional): Maximum memos written per batch. Defaults to 64.
+            max_wait (float, optional): Seconds to wait for a batch to fill after its first memo. Defaults to 0.05.
+            max_retries (int, optional): Retries of a failed batch before its memos are written one by one.
+                Defaults to 3.
+            retry_delay (float, optional): Seconds before the first retry, doubled for each further one.
+                Defaults to 0.1.
+        """
+        self.memo_store = memo_store
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        # Memos accepted and memos finished (written or dropped); the single writer thread
+        # finishes them in queue order, so a flush only waits for the memos queued before it
+        self._submitted = 0
+        self._completed = 0
+        self._progress = threading.Condition()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="memo-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_text, output_text, timeout=None, metadata=None):
+        """
+        Queues one memo for storage.
+
+        Args:
+            input_text (str): The input text.
+            output_text (str): The output text.
+            timeout (float, optional): Seconds to wait for room in a full queue. Waits indefinitely if None.
+            metadata (dict, optional): Memo metadata, as accepted by `MemoStore.add_input_output_pair`.
+
+        Raises:
+            RuntimeError: If the writer is closed or the queue stayed full for `timeout` seconds.
+        """
+        # Queued and counted under the lock flush reads, so every counted memo is queued in order.
+        # close() queues its sentinel under the same lock, so no memo can be queued after it.
+        with self._progress:
+            if not self._progress.wait_for(lambda: self._closed or not self._queue.full(), timeout=timeout):
+                logger.error("Memo write queue is full; dropping backpressured write.")
+                raise RuntimeError("Memo write queue is full.")
+            if self._closed:
+                raise RuntimeError("Memo writer is closed.")
+            self._queue.put_nowait((input_text, output_text, metadata))
+            self._submitted += 1
+
+    @property
+    def pending(self):
+        """
+        Number of memos queued or being written.
+        """
+        return self._queue.unfinished_tasks
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._progress:
+            # Wakes submitters waiting for room
+            self._progress.notify_all()
+        return batch
+
+    def _write(self, memos):
+        """
+        Writes memos as one batch, retrying with backoff. Returns the last error, or None.
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                metrics.inc("axys_memo_write_retries_total", help_text="Memo write batches retried.")
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                self.memo_store.add_many(memos, batch_size=self.batch_size)
+                return None
+            except Exception as e:
+                error = e
+                logger.warning("Failed to write %d queued memos (attempt %d): %s", len(memos), attempt + 1, e)
+        return error
+
+    def _write_batch(self, memos):
+        error = self._write(memos)
+        if error is None:
+            self.written += len(memos)
+            return
+        dropped = len(memos)
+        if len(memos) > 1:
+            # Isolates the memos that cannot be written
+            dropped = 0
+            for memo in memos:
+                try:
+                    self.memo_store.add_many([memo], batch_size=1)
+                    self.written += 1
+                except Exception as e:
+                    dropped += 1
+                    error = e
+        if dropped:
+            self.failed += dropped
+            metrics.inc("axys_memo_writes_dropped_total", dropped,
+                        help_text="Queued memos dropped after every write attempt failed.")
+            logger.error(f"Dropped {dropped} queued memos after {self.max_retries} retries: {error}")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            memos = [memo for memo in batch if memo is not None]
+            try:
+                if memos:
+                    self._write_batch(memos)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                with self._progress:
+                    self._completed += len(memos)
+                    self._progress.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every memo queued before the call has been written (or dropped).
+
+        Memos submitted meanwhile are not waited for, so a flush ends even under a steady
+        stream of writes.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most. Waits indefinitely if None.
+
+        Returns:
+            bool: True if those memos were all written, False if the timeout expired first.
+        """
+        with self._progress:
+            target = self._submitted
+            return self._progress.wait_for(lambda: self._completed >= target, timeout=timeout)
+
+    def close(self):
+        """
+        Writes everything still queued, then stops the background thread.
+        """
+        with self._progress:
+            if self._closed:
+                return
+            self._closed = True
+            self._progress.wait_for(lambda: not self._queue.full())
+            self._queue.put_nowait(None)
+        self._thread.join()
+        logger.debug("Memo writer closed: %s written, %s failed.", self.written, self.failed)
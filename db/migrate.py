@@ -0,0 +1,147 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Database Migration
+# Filepath: `/db/migrate.py`
+# Updated: 10-28-2023
+
+import os
+import sqlite3
+import pickle
+import argparse
+from ops.config import logger
+from .memo_index import to_numpy
+from .embedding_format import (EMBEDDING_FORMAT_VERSION, serialize_embedding,
+                               get_format_version, set_format_version)
+from .schema import SCHEMA_VERSION, upgrade_schema
+
+
+def migrate_embeddings(path_to_db_file, batch_size=1000, vacuum=False):
+    """
+    Converts pickled tensor embeddings in an existing database to the raw float32 format.
+
+    Rows are converted in id order, one transaction per batch, so memory use stays flat
+    and an interrupted run can simply be started again.
+
+    Args:
+        path_to_db_file (str): Path to the SQLite database.
+        batch_size (int, optional): Rows converted per transaction. Defaults to 1000.
+        vacuum (bool, optional): Whether to VACUUM afterwards to reclaim space. Defaults to False.
+
+    Returns:
+        int: The number of rows converted.
+    """
+    conn = sqlite3.connect(path_to_db_file)
+    try:
+        if get_format_version(conn) >= EMBEDDING_FORMAT_VERSION:
+            logger.info(
+                f"MIGRATE: {path_to_db_file} is already at format version {EMBEDDING_FORMAT_VERSION}.")
+            return 0
+
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(memos)")]
+        if not columns:
+            logger.info("MIGRATE: No memos table in %s.", path_to_db_file)
+            return 0
+        if "embedding_dim" not in columns:
+            with conn:
+                conn.execute(
+                    "ALTER TABLE memos ADD COLUMN embedding_dim INTEGER")
+
+        converted = 0
+        last_id = 0
+        while True:
+            # Rows that already have a dimension were converted by an earlier, interrupted run
+            rows = conn.execute(
+                "SELECT id, input_embedding, output_embedding FROM memos "
+                "WHERE id > ? AND embedding_dim IS NULL ORDER BY id LIMIT ?",
+                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for memo_id, input_blob, output_blob in rows:
+                input_embedding = to_numpy(pickle.loads(input_blob))
+                output_embedding = to_numpy(pickle.loads(output_blob))
+                updates.append((serialize_embedding(input_embedding),
+                                serialize_embedding(output_embedding),
+                                input_embedding.size, memo_id))
+            with conn:
+                conn.executemany(
+                    "UPDATE memos SET input_embedding = ?, output_embedding = ?, embedding_dim = ? WHERE id = ?",
+                    updates)
+
+            last_id = rows[-1][0]
+            converted += len(rows)
+            logger.debug("MIGRATE: Converted %s rows.", converted)
+
+        with conn:
+            set_format_version(conn)
+        if vacuum:
+            conn.execute("VACUUM")
+        logger.info(
+            f"MIGRATE: Converted {converted} rows in {path_to_db_file} to format version {EMBEDDING_FORMAT_VERSION}.")
+        return converted
+    except Exception as e:
+        logger.error(f"MIGRATE: Failed to migrate {path_to_db_file}: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+def migrate_schema(path_to_db_file):
+    """
+    Adds the memo metadata, dedup and access columns, the memo_tags table, the full-text
+    index and the other indexes to a database whose embeddings are already in the raw
+    float32 format.
+
+    Existing memos keep NULL metadata, so they only match unfiltered queries.
+
+    Args:
+        path_to_db_file (str): Path to the SQLite database.
+
+    Returns:
+        bool: True if the database was upgraded, False if there was nothing to do.
+    """
+    conn = sqlite3.connect(path_to_db_file)
+    try:
+        version = get_format_version(conn)
+        if version >= SCHEMA_VERSION:
+            logger.info("MIGRATE: %s is already at schema version %s.", path_to_db_file, SCHEMA_VERSION)
+            return False
+        if conn.execute("PRAGMA table_info(memos)").fetchone() is None:
+            logger.info("MIGRATE: No memos table in %s.", path_to_db_file)
+            return False
+        if version < EMBEDDING_FORMAT_VERSION:
+            raise RuntimeError(
+                f"{path_to_db_file} still stores pickled embeddings; run migrate_embeddings first.")
+        with conn:
+            upgrade_schema(conn)
+            set_format_version(conn, SCHEMA_VERSION)
+        logger.info("MIGRATE: Upgraded %s to schema version %s.", path_to_db_file, SCHEMA_VERSION)
+        return True
+    except Exception as e:
+        logger.error(f"MIGRATE: Failed to migrate {path_to_db_file}: {e}")
+        raise
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert pickled memo embeddings to the raw float32 storage format "
+                    "and upgrade the memo schema.")
+    parser.add_argument("db_file", nargs="?",
+                        default=os.path.join(os.path.dirname(__file__), "app.db"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM the database afterwards to reclaim space.")
+    args = parser.parse_args()
+
+    converted = migrate_embeddings(
+        args.db_file, batch_size=args.batch_size, vacuum=args.vacuum)
+    print(f"Converted {converted} memos in {args.db_file}")
+    if migrate_schema(args.db_file):
+        print(f"Upgraded {args.db_file} to schema version {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Embedding Quantization
+# Filepath: `/db/quantization.py`
+# Updated: 10-28-2023
+
+import os
+import time
+import sqlite3
+import argparse
+import numpy as np
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+# Rows widened to float32 at a time when scoring a quantized matrix; small enough to stay in cache
+SCORE_BLOCK_ROWS = 4096
+
+
+def quantize_rows(rows, dtype):
+    """
+    Converts float32 rows to the given storage type.
+
+    int8 rows are scaled per vector, so that each row's largest component maps to 127.
+
+    Args:
+        rows (np.ndarray): A 2-D float32 array.
+        dtype (str): "float32", "float16" or "int8".
+
+    Returns:
+        tuple: (quantized rows, float32 per-row scales for int8 or None).
+    """
+    rows = np.asarray(rows, dtype=np.float32)
+    if dtype == "float32":
+        return rows, None
+    if dtype == "float16":
+        return rows.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.rint(rows / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown embedding dtype: {dtype}")
+
+
+def dequantize_rows(rows, scales=None):
+    """
+    Converts quantized rows back to float32.
+    """
+    rows = rows.astype(np.float32)
+    if scales is not None:
+        rows *= scales[:, None]
+    return rows
+
+
+def scaled_dot(rows, query, scales=None, block_rows=SCORE_BLOCK_ROWS):
+    """
+    Returns the dot product of every row with `query`, without dequantizing the matrix.
+
+    float32 rows are one matrix-vector product. Quantized rows are widened to float32 one
+    cache-sized block at a time into a reused buffer, and int8 scales are applied to the
+    products rather than to the rows, since (scale * q) . x == scale * (q . x).
+
+    Args:
+        rows (np.ndarray): float32, float16 or int8 rows.
+        query (np.ndarray): A float32 vector.
+        scales (np.ndarray, optional): Per-row scales of int8 rows.
+        block_rows (int, optional): Rows widened at a time. Defaults to SCORE_BLOCK_ROWS.
+
+    Returns:
+        np.ndarray: float32 dot products, one per row.
+    """
+    if rows.dtype == np.float32:
+        products = rows @ query
+    else:
+        products = np.empty(len(rows), dtype=np.float32)
+        buffer = np.empty((min(block_rows, len(rows)), rows.shape[1]), dtype=np.float32)
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            widened = buffer[:len(block)]
+            np.copyto(widened, block, casting="unsafe")
+            np.matmul(widened, query, out=products[start:start + len(block)])
+    if scales is not None:
+        products *= scales
+    return products
+
+
+def bytes_per_vector(dim, dtype):
+    """
+    Returns the storage size of one embedding, including the int8 scale.
+    """
+    return {"float32": 4 * dim, "float16": 2 * dim, "int8": dim + 4}[dtype]
+
+
+def agreement_report(ids, vectors, k=10, n_queries=200, dtypes=EMBEDDING_DTYPES, noise=0.05, seed=0):
+    """
+    Measures how closely quantized storage and scoring reproduce the full-precision ranking.
+
+    Every (storage dtype, index dtype) pair is compared with a float32 index over the same
+    vectors, as `get_related_memos` would rank them. Queries are stored vectors perturbed
+    with Gaussian noise, as in `db.ivf_index.recall_report`.
+
+    Args:
+        ids (np.ndarray): Memo ids.
+        vectors (np.ndarray): Full-precision embeddings aligned with `ids`.
+        k (int, optional): Number of neighbours compared. Defaults to 10.
+        n_queries (int, optional): Number of sampled queries. Defaults to 200.
+        dtypes (tuple, optional): Types to evaluate for both storage and the index.
+        noise (float, optional): Standard deviation of the query perturbation. Defaults to 0.05.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: One dict per pair with keys 'storage', 'index', 'recall_at_k' (overlap with the
+            exact top k), 'top1_agreement', 'max_distance_error', 'ms_per_query',
+            'index_bytes' and 'stored_bytes_per_vector'.
+    """
+    from .memo_index import MemoIndex, normalize_rows
+
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    sample = normalize_rows(vectors)[rng.choice(len(ids), min(n_queries, len(ids)), replace=False)]
+    queries = sample + rng.normal(scale=noise, size=sample.shape).astype(np.float32)
+
+    exact = MemoIndex()
+    exact.add_batch(ids, vectors)
+    truth = [exact.search(query, k=k) for query in queries]
+
+    report = []
+    for storage in dtypes:
+        stored = dequantize_rows(*quantize_rows(vectors, storage))
+        for index_dtype in dtypes:
+            index = MemoIndex(dtype=index_dtype)
+            index.add_batch(ids, stored)
+            start = time.perf_counter()
+            found = [index.search(query, k=k) for query in queries]
+            elapsed = time.perf_counter() - start
+
+            overlap, top1, error = [], [], 0.0
+            for expected, actual in zip(truth, found):
+                expected_ids = [memo_id for memo_id, _ in expected]
+                overlap.append(len(set(expected_ids) & {memo_id for memo_id, _ in actual}) / max(len(expected), 1))
+                top1.append(bool(actual) and actual[0][0] == expected_ids[0])
+                exact_distances = dict(expected)
+                error = max([error] + [abs(distance - exact_distances[memo_id])
+                                       for memo_id, distance in actual if memo_id in exact_distances])
+            report.append({
+                'storage': storage,
+                'index': index_dtype,
+                'recall_at_k': float(np.mean(overlap)),
+                'top1_agreement': float(np.mean(top1)),
+                'max_distance_error': float(error),
+                'ms_per_query': elapsed * 1000 / len(queries),
+                'index_bytes': index.nbytes,
+                'stored_bytes_per_vector': bytes_per_vector(vectors.shape[1], storage),
+            })
+    return report
+
+
+def main():
+    from .embedding_format import deserialize_embedding
+
+    parser = argparse.ArgumentParser(
+        description="Report how float16 and int8 embeddings change memo rankings against float32.")
+    parser.add_argument("db_file", nargs="?",
+                        default=os.path.join(os.path.dirname(__file__), "app.db"))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dtypes", nargs="+", choices=EMBEDDING_DTYPES, default=list(EMBEDDING_DTYPES))
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_file)
+    rows = conn.execute(
+        "SELECT id, input_embedding, embedding_dim, embedding_dtype FROM memos").fetchall()
+    conn.close()
+    if not rows:
+        print(f"No memos in {args.db_file}")
+        return
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    vectors = np.stack([deserialize_embedding(row[1], row[2], row[3]) for row in rows])
+    quantized = sum(1 for row in rows if row[3] not in (None, "float32"))
+    if quantized:
+        print(f"Note: {quantized} memos are already stored quantized, so the baseline is not full precision.")
+
+    print(f"{len(ids)} memos, k={args.k}")
+    print(f"{'storage':>8} {'index':>8} {'recall@k':>9} {'top1':>6} {'max err':>9} {'ms':>8} "
+          f"{'index MiB':>10} {'bytes/vec':>10}")
+    for row in agreement_report(ids, vectors, k=args.k, n_queries=args.queries, dtypes=args.dtypes):
+        print(f"{row['storage']:>8} {row['index']:>8} {row['recall_at_k']:>9.3f} {row['top1_agreement']:>6.3f} "
+              f"{row['max_distance_error']:>9.5f} {row['ms_per_query']:>8.3f} "
+              f"{row['index_bytes'] / 2**20:>10.1f} {row['stored_bytes_per_vector']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Response Cache
+# Filepath: `/db/response_cache.py`
+# Updated: 10-28-2023
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from ops.config import logger
+from ops.metrics import metrics
+from .memo_index import normalize_rows
+from .embedding_cache import EmbeddingCache
+
+
+class _CachedResponse:
+    __slots__ = ("prompt", "reply", "slot", "created", "latency", "hits")
+
+    def __init__(self, prompt, reply, slot, latency):
+        self.prompt = prompt
+        self.reply = reply
+        self.slot = slot
+        self.created = time.monotonic()
+        self.latency = latency
+        self.hits = 0
+
+
+class ResponseCache:
+    """
+    Semantic cache of LLM replies keyed by prompt.
+
+    A prompt identical to a cached one (ignoring case and whitespace) is answered from a dict
+    without embedding it. Otherwise the prompt is embedded with the same model MemoStore uses
+    and compared against every cached prompt in one matrix-vector product; the closest one is
+    a hit if its cosine similarity reaches `threshold`. Prompts stored with `semantic=False`,
+    e.g. ones rendered with chat history, only match the same prompt and are never embedded.
+    Entries expire after `ttl` seconds and the least recently used entry is evicted when the
+    cache is full.
+    """
+
+    def __init__(self, model_name='distilbert-base-nli-stsb-mean-tokens', embedding_cache=None,
+                 threshold=0.92, ttl=3600.0, max_entries=1000):
+        """
+        Args:
+            model_name (str, optional): Embedding model, shared with MemoStore through its EmbeddingService.
+                Defaults to 'distilbert-base-nli-stsb-mean-tokens'.
+            embedding_cache (EmbeddingCache, optional): Cache to embed prompts with. Defaults to a
+                new in-process cache for `model_name`.
+            threshold (float, optional): Minimum cosine similarity for a semantic hit. Defaults to 0.92.
+            ttl (float, optional): Seconds an entry stays valid. Never expires if None. Defaults to 3600.
+            max_entries (int, optional): Entries kept before the least recently used is evicted. Defaults to 1000.
+        """
+        self.embedding_cache = embedding_cache or EmbeddingCache(model_name)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(int(max_entries), 1)
+        self._entries = OrderedDict()  # exact key -> _CachedResponse, least recently used first
+        self._lock = threading.Lock()
+        # One row per slot; a slot is free when its key is None
+        self._matrix = None
+        self._slot_keys = [None] * self.max_entries
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_seconds = 0.0
+
+        metrics.gauge("axys_response_cache_hits_total", "LLM replies served from the response cache.",
+                      self._hits, kind="counter")
+        metrics.gauge("axys_response_cache_misses_total", "Response cache lookups that went to the LLM.",
+                      self._misses, kind="counter")
+        metrics.gauge("axys_response_cache_saved_seconds_total", "LLM time saved by response cache hits.",
+                      self._saved_seconds, kind="counter")
+
+    def _hits(self):
+        return self.exact_hits + self.semantic_hits
+
+    def _misses(self):
+        return self.misses
+
+    def _saved_seconds(self):
+        return self.saved_seconds
+
+    @staticmethod
+    def _key(prompt, semantic=True):
+        key = " ".join(prompt.lower().split())
+        if semantic:
+            return key
+        # Rendered prompts are long, so only a digest is kept; bytes never equal a str key
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry.created > self.ttl
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry.slot is not None:
+            self._slot_keys[entry.slot] = None
+            self._free_slots.append(entry.slot)
+
+    def _hit(self, key, entry):
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.saved_seconds += entry.latency
+        return entry.reply
+
+    def get(self, prompt, semantic=True):
+        """
+        Returns the cached reply for `prompt` or a semantically equivalent prompt, or None.
+
+        Args:
+            prompt (str): The prompt about to be sent to the LLM.
+            semantic (bool, optional): Also match semantically equivalent prompts. If False only
+                the same prompt, stored with `semantic=False`, matches. Defaults to True.
+        """
+        key = self._key(prompt, semantic)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self.exact_hits += 1
+                    return self._hit(key, entry)
+                self._remove(key)
+                self.expirations += 1
+            if not semantic or not self._entries:
+                self.misses += 1
+                return None
+
+        query = normalize_rows(self.embedding_cache.encode(prompt))[0]
+        with self._lock:
+            if self._matrix is not None and self._entries:
+                similarities = self._matrix @ query
+                for slot in np.argsort(-similarities):
+                    if similarities[slot] < self.threshold:
+                        break
+                    match = self._slot_keys[slot]
+                    if match is None:
+                        continue
+                    entry = self._entries[match]
+                    if self._expired(entry, now):
+                        self._remove(match)
+                        self.expirations += 1
+                        continue
+                    self.semantic_hits += 1
+                    return self._hit(match, entry)
+            self.misses += 1
+            return None
+
+    def put(self, prompt, reply, latency=0.0, semantic=True):
+        """
+        Caches the LLM's reply to `prompt`.
+
+        Args:
+            prompt (str): The prompt sent to the LLM.
+            reply (str): The LLM's reply.
+            latency (float, optional): Seconds the LLM took, counted as saved on every later hit.
+            semantic (bool, optional): Whether semantically equivalent prompts may be answered
+                with this reply. Defaults to True.
+        """
+        key = self._key(prompt, semantic)
+        embedding = normalize_rows(self.embedding_cache.encode(prompt))[0] if semantic else None
+        with self._lock:
+            if embedding is not None and self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+            if key in self._entries:
+                self._remove(key)
+            if len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            slot = None
+            if embedding is not None:
+                # Fewer than max_entries entries remain, so a slot is free
+                slot = self._free_slots.pop()
+                self._matrix[slot] = embedding
+                self._slot_keys[slot] = key
+            self._entries[key] = _CachedResponse(prompt, reply, slot, latency)
+
+    def purge_expired(self):
+        """
+        Drops every expired entry. Returns how many were removed.
+        """
+        if self.ttl is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def top_entries(self, n=10):
+        """
+        Returns (prompt, hits) for the `n` most frequently hit entries.
+        """
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry.hits, reverse=True)
+            return [(entry.prompt, entry.hits) for entry in entries[:n]]
+
+    def stats(self):
+        """
+        Returns hit/miss counters, hit rate and the LLM time saved by hits.
+        """
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'saved_seconds': self.saved_seconds,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Response cache: {stats['exact_hits']} exact and {stats['semantic_hits']} semantic hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['saved_seconds']:.1f}s of LLM time saved.")
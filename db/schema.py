@@ -0,0 +1,189 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Database Schema
+# Filepath: `/db/schema.py`
+# Updated: 10-28-2023
+
+import sqlite3
+
+# Recorded in PRAGMA user_version alongside the embedding format; see db/embedding_format.py
+SCHEMA_VERSION = 6
+
+MEMOS_TABLE = """
+    CREATE TABLE IF NOT EXISTS memos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        input_text TEXT NOT NULL,
+        output_text TEXT NOT NULL,
+        input_embedding BLOB NOT NULL,
+        output_embedding BLOB NOT NULL,
+        embedding_dim INTEGER,
+        user_id TEXT,
+        session_id TEXT,
+        source TEXT,
+        created_at REAL,
+        times_seen INTEGER NOT NULL DEFAULT 1,
+        last_seen_at REAL,
+        access_count INTEGER NOT NULL DEFAULT 0,
+        last_accessed_at REAL,
+        embedding_dtype TEXT
+    );
+"""
+
+# Added to older tables by `upgrade_schema`; existing rows keep NULLs
+METADATA_COLUMNS = (
+    ("user_id", "TEXT"),
+    ("session_id", "TEXT"),
+    ("source", "TEXT"),
+    ("created_at", "REAL"),  # Unix time
+)
+
+# Version 3: near-duplicates are merged into one row that counts how often it was seen
+DEDUP_COLUMNS = (
+    ("times_seen", "INTEGER NOT NULL DEFAULT 1"),
+    ("last_seen_at", "REAL"),  # Unix time of the latest merged duplicate
+)
+
+# Version 4: retrieval statistics that drive the eviction policies in db/maintenance.py
+ACCESS_COLUMNS = (
+    ("access_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("last_accessed_at", "REAL"),  # Unix time of the latest retrieval
+)
+
+# Version 6: storage type of both embeddings of a row, see db/embedding_format.py
+QUANTIZATION_COLUMNS = (
+    ("embedding_dtype", "TEXT"),  # NULL for float32
+)
+
+MEMO_TAGS_TABLE = """
+    CREATE TABLE IF NOT EXISTS memo_tags (
+        tag TEXT NOT NULL,
+        memo_id INTEGER NOT NULL,
+        PRIMARY KEY (tag, memo_id)
+    ) WITHOUT ROWID;
+"""
+
+# Leading columns match the filters `get_related_memos` accepts, so each filter is an index range scan
+METADATA_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_memos_user_created ON memos (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_memos_session ON memos (session_id)",
+    "CREATE INDEX IF NOT EXISTS idx_memos_source_created ON memos (source, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_memos_created ON memos (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_memo_tags_memo ON memo_tags (memo_id)",
+)
+
+# Version 5: full-text index over the memo texts for hybrid retrieval (db/hybrid.py). It is an
+# external-content table, so the text is stored once, in `memos`, and the triggers keep it in sync.
+# Only text changes touch the index; counter updates do not.
+MEMOS_FTS_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS memos_fts USING fts5(
+        input_text, output_text, content='memos', content_rowid='id', tokenize='porter unicode61'
+    );
+"""
+
+MEMOS_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS memos_fts_insert AFTER INSERT ON memos BEGIN
+        INSERT INTO memos_fts (rowid, input_text, output_text)
+        VALUES (new.id, new.input_text, new.output_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memos_fts_delete AFTER DELETE ON memos BEGIN
+        INSERT INTO memos_fts (memos_fts, rowid, input_text, output_text)
+        VALUES ('delete', old.id, old.input_text, old.output_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS memos_fts_update AFTER UPDATE OF input_text, output_text ON memos BEGIN
+        INSERT INTO memos_fts (memos_fts, rowid, input_text, output_text)
+        VALUES ('delete', old.id, old.input_text, old.output_text);
+        INSERT INTO memos_fts (rowid, input_text, output_text)
+        VALUES (new.id, new.input_text, new.output_text);
+    END""",
+)
+
+
+def upgrade_schema(conn):
+    """
+    Adds the metadata, dedup, access and quantization columns, the memo_tags table, the full-text index
+    and the other indexes where missing.
+
+    Safe to run repeatedly. Adding a column does not rewrite the table, so only building
+    the indexes takes time proportional to the number of memos.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(memos)")}
+    for name, column_type in METADATA_COLUMNS + DEDUP_COLUMNS + ACCESS_COLUMNS + QUANTIZATION_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE memos ADD COLUMN {name} {column_type}")
+    conn.execute(MEMO_TAGS_TABLE)
+    for statement in METADATA_INDEXES:
+        conn.execute(statement)
+    upgrade_fts(conn)
+
+
+def fts_available(conn):
+    """
+    Returns whether this SQLite build includes the FTS5 extension.
+    """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(text)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def upgrade_fts(conn):
+    """
+    Creates the full-text index and its triggers where missing, indexing existing memos once.
+
+    Returns:
+        bool: Whether the full-text index exists. False if SQLite lacks FTS5, in which case
+            hybrid retrieval falls back to vector search.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memos_fts'").fetchone()
+    if not exists:
+        if not fts_available(conn):
+            return False
+        conn.execute(MEMOS_FTS_TABLE)
+        conn.execute("INSERT INTO memos_fts (memos_fts) VALUES ('rebuild')")
+    for statement in MEMOS_FTS_TRIGGERS:
+        conn.execute(statement)
+    return True
+
+
+def metadata_filter(user_id=None, session_id=None, source=None, tags=None, since=None, until=None):
+    """
+    Builds the SQL condition selecting memos that match the given metadata.
+
+    Args:
+        user_id (str, optional): Only memos of this user.
+        session_id (str, optional): Only memos from this session.
+        source (str, optional): Only memos from this source, e.g. "chat".
+        tags (list, optional): Only memos carrying at least one of these tags.
+        since (float, optional): Only memos created at or after this Unix time.
+        until (float, optional): Only memos created before this Unix time.
+
+    Returns:
+        tuple: (condition, parameters), or None if no filter was given.
+    """
+    conditions, parameters = [], []
+    for column, value in (("user_id", user_id), ("session_id", session_id), ("source", source)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    if since is not None:
+        conditions.append("created_at >= ?")
+        parameters.append(since)
+    if until is not None:
+        conditions.append("created_at < ?")
+        parameters.append(until)
+    if tags:
+        tags = list(tags)
+        conditions.append(
+            f"id IN (SELECT memo_id FROM memo_tags WHERE tag IN ({','.join('?' * len(tags))}))")
+        parameters.extend(tags)
+    if not conditions:
+        return None
+    return " AND ".join(conditions), parameters
+
+
+__all__ = ['SCHEMA_VERSION', 'MEMOS_TABLE', 'METADATA_COLUMNS', 'DEDUP_COLUMNS', 'ACCESS_COLUMNS',
+           'QUANTIZATION_COLUMNS', 'MEMO_TAGS_TABLE', 'METADATA_INDEXES', 'MEMOS_FTS_TABLE',
+           'MEMOS_FTS_TRIGGERS', 'upgrade_schema', 'fts_available', 'upgrade_fts', 'metadata_filter']
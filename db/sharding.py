@@ -0,0 +1,605 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Sharded Memo Storage
+# Filepath: `/db/sharding.py`
+# Updated: 10-28-2023
+
+import os
+import json
+import time
+import heapq
+import hashlib
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from ops.config import logger
+from ops.metrics import metrics
+from .embedding_cache import EmbeddingCache
+from .embedding_format import deserialize_embedding
+from .memo_writer import MemoWriter
+from .hybrid import RETRIEVAL_MODES, reciprocal_rank_fusion
+
+SHARD_KEYS = ("hash", "user")
+
+# Memos copied per step when rebalancing, bounding the memory of one transfer
+REBALANCE_BATCH_SIZE = 1000
+
+
+def jump_hash(key, n_buckets):
+    """
+    Maps a 64-bit key to one of `n_buckets` (jump consistent hash, Lamping and Veach).
+
+    Growing from n to n + 1 buckets moves only about 1 / (n + 1) of the keys, all of them
+    into the new bucket, which keeps rebalancing after adding a shard cheap.
+    """
+    bucket, jump = -1, 0
+    while jump < n_buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(input_text, user_id, n_shards, shard_key="hash"):
+    """
+    Returns the shard number a memo is stored in.
+
+    With shard_key "user" every memo of a user (tenant) lands on one shard, so queries filtered
+    by user_id touch a single shard; memos without a user are spread by input text. With "hash"
+    memos are spread evenly by input text.
+    """
+    key = user_id if shard_key == "user" and user_id is not None else input_text
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "little"), n_shards)
+
+
+def shard_path(db_filename, shard_number):
+    """
+    Returns the database file of one shard, e.g. "app.shard0.db" for "app.db".
+    """
+    root, extension = os.path.splitext(db_filename)
+    return f"{root}.shard{shard_number}{extension or '.db'}"
+
+
+class _Shard:
+    """
+    Runs in a shard process and serves the requests of the ShardedMemoStore for one shard.
+    """
+
+    def __init__(self, store_kwargs):
+        from .database import MemoStore
+        self.store = MemoStore(**store_kwargs)
+
+    def add(self, pairs, embeddings):
+        return self.store.add_many(pairs, batch_size=max(len(pairs), 1), embeddings=embeddings)
+
+    def search(self, query_text, query_embedding, **kwargs):
+        return self.store.get_related_memos(query_text, query_embedding=query_embedding, **kwargs)
+
+    def hybrid_candidates(self, query_text, query_embedding, **kwargs):
+        return self.store.hybrid_candidates(query_text, query_embedding=query_embedding, **kwargs)
+
+    def record_access(self, memo_ids):
+        self.store._record_access([(memo_id, None) for memo_id in memo_ids])
+
+    def count(self):
+        self.store._refresh_index()
+        return len(self.store.index)
+
+    def misplaced(self, shard_number, n_shards, shard_key):
+        rows = self.store.connections.reader().execute("SELECT id, input_text, user_id FROM memos")
+        return [memo_id for memo_id, input_text, user_id in rows
+                if shard_for(input_text, user_id, n_shards, shard_key) != shard_number]
+
+    def export(self, memo_ids):
+        """
+        Returns the memos as (pairs, embeddings) ready for `add` on another shard.
+
+        Retrieval statistics travel with the memos, so eviction and expiry treat a moved memo
+        as they did before the move.
+        """
+        # Retrievals still buffered in this shard would be lost with the deleted rows
+        self.store.flush_access_stats()
+        reader = self.store.connections.reader()
+        placeholders = ",".join("?" * len(memo_ids))
+        tags = {}
+        for tag, memo_id in reader.execute(
+                f"SELECT tag, memo_id FROM memo_tags WHERE memo_id IN ({placeholders})", memo_ids):
+            tags.setdefault(memo_id, []).append(tag)
+        pairs, embeddings = [], []
+        for row in reader.execute(
+                "SELECT id, input_text, output_text, input_embedding, output_embedding, embedding_dim, "
+                "embedding_dtype, user_id, session_id, source, created_at, times_seen, last_seen_at, "
+                "access_count, last_accessed_at "
+                f"FROM memos WHERE id IN ({placeholders}) ORDER BY id", memo_ids):
+            metadata = dict(zip(("user_id", "session_id", "source", "created_at", "times_seen",
+                                 "last_seen_at", "access_count", "last_accessed_at"), row[7:]))
+            metadata["tags"] = tags.get(row[0], [])
+            pairs.append((row[1], row[2], metadata))
+            embeddings.append((deserialize_embedding(row[3], row[5], row[6]),
+                               deserialize_embedding(row[4], row[5], row[6])))
+        return pairs, embeddings
+
+    def delete(self, memo_ids):
+        return self.store.delete_memos(memo_ids)
+
+    def compact(self):
+        return self.store.compact()
+
+    def close(self):
+        self.store.close()
+
+
+def _serve_shard(conn, store_kwargs):
+    """
+    Entry point of a shard process: answers (request id, method, args, kwargs) requests in order.
+    """
+    shard = _Shard(store_kwargs)
+    while True:
+        try:
+            request_id, method, args, kwargs = conn.recv()
+        except EOFError:
+            shard.close()
+            return
+        try:
+            result, error = getattr(shard, method)(*args, **kwargs), None
+        except Exception as e:
+            # Exceptions are re-raised in the parent; not every exception type pickles
+            result, error = None, RuntimeError(f"{type(e).__name__}: {e}")
+        conn.send((request_id, error, result))
+        if method == "close":
+            return
+
+
+class _ShardProcess:
+    """
+    Parent-side handle of a shard process. Requests are pipelined: `call` returns a Future
+    and a receiver thread resolves the futures as replies arrive.
+    """
+
+    def __init__(self, context, store_kwargs, name):
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve_shard, args=(child_conn, store_kwargs),
+                                       name=name, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._futures = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._receiver = threading.Thread(target=self._receive, name=f"{name}-receiver", daemon=True)
+        self._receiver.start()
+
+    def call(self, method, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if not self.process.is_alive():
+                raise RuntimeError(f"Shard process {self.process.name} is not running.")
+            request_id = next(self._request_ids)
+            self._futures[request_id] = future
+            self._conn.send((request_id, method, args, kwargs))
+        return future
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, error, result = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = self._futures.pop(request_id)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._lock:
+            pending, self._futures = self._futures, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Shard process {self.process.name} exited."))
+
+    def close(self, timeout=30.0):
+        try:
+            self.call("close").result(timeout=timeout)
+        except Exception as e:
+            logger.error(f"Failed to close shard {self.process.name}: {e}")
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._conn.close()
+
+
+class ShardedMemoStore:
+    """
+    A MemoStore partitioned across several SQLite files, each served by its own process.
+
+    Memos are routed to a shard by a consistent hash of their input text, or of their user
+    (`shard_key="user"`). A query is embedded once here, searched on every shard in parallel
+    (or only on the user's shard when routed by user and filtered by user_id), and the shards'
+    top-k lists are merged. Each shard process holds its own index and scans only its share of
+    the memos, so retrieval throughput grows with the number of cores.
+
+    The shard count is recorded in a manifest next to the shards. Opening the store with more
+    shards, or calling `add_shards`, moves the memos whose shard changed: each is copied to
+    its new shard before it is deleted from the old one, so an interrupted rebalance never
+    loses memos and is resumed the next time the store is opened.
+
+    Shard processes are started with the "spawn" method, so scripts creating a
+    ShardedMemoStore need the usual `if __name__ == "__main__":` guard.
+    """
+
+    def __init__(self, n_shards=None, shard_key="hash", verbosity=0, reset=False, db_filename="app.db",
+                 model_name='distilbert-base-nli-stsb-mean-tokens', embedding_cache_size=10000,
+                 persistent_embedding_cache=False, write_queue_size=1024, **store_kwargs):
+        """
+        Args:
+            n_shards (int, optional): Number of shards. Defaults to the recorded count, or the number of CPUs
+                for a new store. A larger count than recorded adds shards and rebalances.
+            shard_key (str, optional): "hash" (spread by input text) or "user" (one shard per user). Defaults to "hash".
+            verbosity (int, optional): Verbosity level. Defaults to 0.
+            reset (bool, optional): Whether to reset every shard. Defaults to False.
+            db_filename (str, optional): Base filename; shard i is stored in "<name>.shard<i>.db". Defaults to "app.db".
+            model_name (str, optional): Model name for generating embeddings.
+            embedding_cache_size (int, optional): Entries in the embedding LRU of this process. Defaults to 10000.
+            persistent_embedding_cache (bool, optional): Also cache embeddings in an SQLite file. Defaults to False.
+            write_queue_size (int, optional): Memos `queue_memo` buffers before blocking the caller. Defaults to 1024.
+            **store_kwargs: Other MemoStore settings, applied to every shard (e.g. index_mode, dedup_threshold,
+                retrieval_mode). Limits such as max_memos apply per shard.
+        """
+        if shard_key not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard_key: {shard_key}")
+        self.verbosity = verbosity
+        self.model_name = model_name
+        self.shard_key = shard_key
+        self.db_filename = db_filename
+        self.retrieval_mode = store_kwargs.get("retrieval_mode", "vector")
+        self.hybrid_vector_weight = store_kwargs.get("hybrid_vector_weight", 0.7)
+        self.hybrid_fallbacks = 0
+        self.path_to_db_file = os.path.join(os.path.dirname(__file__), db_filename)
+        self.path_to_manifest = os.path.splitext(self.path_to_db_file)[0] + ".shards.json"
+
+        # Embeddings are computed here only; the shard processes never load the model
+        self.embedding_cache = EmbeddingCache(
+            model_name, max_entries=embedding_cache_size,
+            path_to_cache_file=self.path_to_db_file + ".embeddings.db" if persistent_embedding_cache else None)
+        self.write_queue_size = write_queue_size
+        self._writer = None
+        self._store_kwargs = dict(store_kwargs, verbosity=verbosity, model_name=model_name,
+                                  embedding_cache_size=1, reset=reset)
+        self._resize_lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+
+        manifest = self._read_manifest()
+        if manifest is not None and manifest["shard_key"] != shard_key:
+            raise ValueError(
+                f"{self.path_to_manifest} records shard_key {manifest['shard_key']!r}; "
+                f"changing it would move every memo.")
+        recorded = manifest["n_shards"] if manifest is not None else 0
+        n_shards = n_shards or recorded or os.cpu_count() or 1
+        if n_shards < recorded:
+            raise ValueError(f"{self.path_to_manifest} records {recorded} shards; removing shards is not supported.")
+
+        self._shards = []
+        try:
+            self._start_shards(n_shards)
+            needs_rebalance = not reset and manifest is not None and (
+                n_shards > recorded or manifest.get("rebalancing"))
+            self._write_manifest(rebalancing=needs_rebalance)
+            if needs_rebalance:
+                self._rebalance()
+        except Exception:
+            self._close_shards()
+            raise
+        logger.debug("Opened %s memo shards for %s.", n_shards, self.path_to_db_file)
+
+    @property
+    def n_shards(self):
+        return len(self._shards)
+
+    @property
+    def model(self):
+        return self.embedding_cache.model
+
+    def warm_up(self):
+        """
+        Loads the embedding model now instead of on the first encode.
+        """
+        self.embedding_cache.model
+
+    def _read_manifest(self):
+        if not os.path.exists(self.path_to_manifest):
+            return None
+        with open(self.path_to_manifest, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, rebalancing=False):
+        temp_path = self.path_to_manifest + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"n_shards": self.n_shards, "shard_key": self.shard_key,
+                       "rebalancing": bool(rebalancing)}, f)
+        os.replace(temp_path, self.path_to_manifest)
+
+    def _start_shards(self, n_shards):
+        for shard_number in range(self.n_shards, n_shards):
+            store_kwargs = dict(self._store_kwargs,
+                                db_filename=shard_path(self.path_to_db_file, shard_number))
+            self._shards.append(
+                _ShardProcess(self._context, store_kwargs, name=f"memo-shard-{shard_number}"))
+
+    def _close_shards(self):
+        for shard in self._shards:
+            shard.close()
+
+    def _shard_of(self, input_text, metadata, n_shards=None):
+        return shard_for(input_text, (metadata or {}).get("user_id"), n_shards or self.n_shards, self.shard_key)
+
+    def add_shards(self, count=1):
+        """
+        Adds shards and moves the memos whose shard changed into them.
+
+        Returns:
+            int: The number of memos moved.
+        """
+        with self._resize_lock:
+            self.flush()
+            self._start_shards(self.n_shards + count)
+            self._write_manifest(rebalancing=True)
+            return self._rebalance()
+
+    def _rebalance(self):
+        start = time.perf_counter()
+        moved = 0
+        shards = list(self._shards)
+        misplaced = [shard.call("misplaced", shard_number, len(shards), self.shard_key)
+                     for shard_number, shard in enumerate(shards)]
+        for source, future in zip(shards, misplaced):
+            memo_ids = future.result()
+            for offset in range(0, len(memo_ids), REBALANCE_BATCH_SIZE):
+                batch_ids = memo_ids[offset:offset + REBALANCE_BATCH_SIZE]
+                pairs, embeddings = source.call("export", batch_ids).result()
+                targets = {}
+                for pair, embedding in zip(pairs, embeddings):
+                    pair_list, embedding_list = targets.setdefault(
+                        self._shard_of(pair[0], pair[2], len(shards)), ([], []))
+                    pair_list.append(pair)
+                    embedding_list.append(embedding)
+                # Copy first, then delete, so an interruption leaves duplicates rather than losses
+                for future in [shards[target].call("add", pair_list, embedding_list)
+                               for target, (pair_list, embedding_list) in targets.items()]:
+                    future.result()
+                source.call("delete", batch_ids).result()
+                moved += len(batch_ids)
+        self._write_manifest(rebalancing=False)
+        logger.info("Rebalanced %d memos across %d shards in %.2fs.",
+                    moved, len(shards), time.perf_counter() - start)
+        return moved
+
+    def shard_sizes(self):
+        """
+        Returns the number of memos on each shard.
+        """
+        return [future.result() for future in [shard.call("count") for shard in self._shards]]
+
+    def add_input_output_pair(self, input_text, output_text, **metadata):
+        """
+        Adds an input-output pair to its shard. Accepts the same metadata as MemoStore.
+        """
+        self.add_many([(input_text, output_text, metadata)])
+
+    def queue_memo(self, input_text, output_text, timeout=None, **metadata):
+        """
+        Queues an input-output pair for write-behind storage and returns immediately.
+        """
+        with self._resize_lock:
+            if self._writer is None:
+                self._writer = MemoWriter(self, max_queue_size=self.write_queue_size)
+        metadata.setdefault("created_at", time.time())
+        self._writer.submit(input_text, output_text, timeout=timeout, metadata=metadata)
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every memo queued before the call has been written.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most. Waits indefinitely if None.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        if self._writer is not None:
+            return self._writer.flush(timeout=timeout)
+        return True
+
+    def add_many(self, pairs, batch_size=256):
+        """
+        Adds many input-output pairs, embedding each batch once here and writing every
+        shard's share of it in parallel.
+
+        Returns:
+            int: The number of memos inserted.
+        """
+        pairs = iter(pairs)
+        added = 0
+        while True:
+            batch = list(itertools.islice(pairs, batch_size))
+            if not batch:
+                break
+            embeddings = self.embedding_cache.encode_many(
+                [pair[0] for pair in batch] + [pair[1] for pair in batch])
+            targets = {}
+            for position, pair in enumerate(batch):
+                pair_list, embedding_list = targets.setdefault(
+                    self._shard_of(pair[0], pair[2] if len(pair) > 2 else None), ([], []))
+                pair_list.append(pair)
+                embedding_list.append((embeddings[position], embeddings[len(batch) + position]))
+            futures = [self._shards[target].call("add", pair_list, embedding_list)
+                       for target, (pair_list, embedding_list) in targets.items()]
+            added += sum(future.result() for future in futures)
+            if self.verbosity >= 1:
+                logger.debug("Added %d memos.", added)
+        return added
+
+    def get_nearest_memo(self, query_text, read_your_writes=True, **filters):
+        """
+        Retrieves the nearest memo to the given query text across all shards.
+
+        Returns:
+            dict: The nearest memo with keys 'input_text' and 'output_text', or None.
+        """
+        memos = self.get_related_memos(query_text, n_results=1, threshold=None,
+                                       read_your_writes=read_your_writes, mode="vector", **filters)
+        if not memos:
+            return None
+        return {'input_text': memos[0]['input_text'], 'output_text': memos[0]['output_text']}
+
+    def get_related_memos(self, query_text, n_results=10, threshold=1.5, read_your_writes=True,
+                          mode=None, **filters):
+        """
+        Retrieves related memos from every shard and merges them into one ranking.
+
+        Accepts the arguments of `MemoStore.get_related_memos`. Vector results are merged by
+        distance. In hybrid mode every shard returns its full-text matches unfused, and they
+        are fused once here, so the ranks are global. BM25 ranks are compared across shards,
+        which holds while the shards' term statistics are alike, as hash routing keeps them.
+        Queries whose matches across all shards are too few fall back to the vector scan.
+
+        Returns:
+            list: The top `n_results` memos, as returned by `MemoStore.get_related_memos`.
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if read_your_writes:
+            self.flush()
+        query_embedding = self.embedding_cache.encode(query_text)
+        shards = self._shards
+        if self.shard_key == "user" and filters.get("user_id") is not None:
+            shards = [shards[self._shard_of(query_text, filters)]]
+        with metrics.span("axys_sharded_search_seconds", "Fan-out memo search latency across shards."):
+            if mode == "hybrid":
+                memos = self._hybrid_search(shards, query_text, query_embedding, n_results, threshold, filters)
+                if memos is not None:
+                    return memos
+                self.hybrid_fallbacks += 1
+            futures = [shard.call("search", query_text, query_embedding, n_results=n_results,
+                                  threshold=threshold, read_your_writes=False, mode="vector", **filters)
+                       for shard in shards]
+            memos = [memo for future in futures for memo in future.result()]
+        return heapq.nsmallest(n_results, memos, key=lambda memo: memo['distance'])
+
+    def _hybrid_search(self, shards, query_text, query_embedding, n_results, threshold, filters):
+        """
+        Fuses the full-text matches of every shard into one ranking, as `MemoStore` does for one.
+
+        Returns:
+            list: The top `n_results` memos with their fusion 'score', or None if the shards hold
+                too few matches and the caller should run the vector search instead.
+        """
+        futures = [shard.call("hybrid_candidates", query_text, query_embedding, threshold=threshold,
+                              read_your_writes=False, **filters)
+                   for shard in shards]
+        # Memos are keyed by (shard, id), since ids are only unique within a shard
+        matches, memos = [], {}
+        for number, future in enumerate(futures):
+            candidates = future.result()
+            if candidates is None:
+                continue
+            matches.extend((bm25, (number, memo_id)) for memo_id, bm25 in candidates['matches'])
+            memos.update(((number, memo['id']), memo) for memo in candidates['memos'])
+        if len(matches) < n_results or len(memos) < n_results:
+            return None
+
+        lexical_ranking = [key for _, key in sorted(matches)]
+        vector_ranking = sorted(memos, key=lambda key: memos[key]['distance'])
+        fused = [(key, score) for key, score in reciprocal_rank_fusion(
+            vector_ranking, lexical_ranking, self.hybrid_vector_weight) if key in memos][:n_results]
+
+        accessed = {}
+        results = []
+        for (number, memo_id), score in fused:
+            accessed.setdefault(number, []).append(memo_id)
+            memo = dict(memos[(number, memo_id)], score=score)
+            del memo['id']
+            results.append(memo)
+        # Not waited for; the retrieval statistics are buffered in the shards anyway
+        for number, memo_ids in accessed.items():
+            shards[number].call("record_access", memo_ids)
+        return results
+
+    def compact(self):
+        """
+        Runs `MemoStore.compact` on every shard in parallel.
+
+        Returns:
+            list: The stats of each shard.
+        """
+        return [future.result() for future in [shard.call("compact") for shard in self._shards]]
+
+    def prepopulate(self):
+        """
+        Adds a few arbitrary examples, just to make retrieval less trivial.
+        """
+        examples = [
+            ("What's the weather like?",
+             "I can't browse the internet to check the weather for you."),
+            ("Tell me a joke.",
+             "Why did the chicken cross the road? To get to the other side."),
+            ("How are you?", "I'm just a computer program, so I don't have feelings, but thanks for asking!")
+        ]
+        self.add_many((input_text, output_text, {"source": "prepopulate"})
+                      for input_text, output_text in examples)
+
+    def close(self):
+        """
+        Writes queued memos and closes every shard.
+        """
+        try:
+            if self._writer is not None:
+                self._writer.close()
+            self._close_shards()
+            self.embedding_cache.close()
+        except Exception as e:
+            logger.error(f"Failed to close sharded memo store: {e}")
+            raise
+
+
+def memo_store_from_config(config):
+    """
+    Opens the memo store described by a `TeachableAgent` teach_config.
+
+    A `ShardedMemoStore` when `n_shards` is set, otherwise a `MemoStore`. The database is
+    `db_filename` (default "app.db") inside `path_to_db_dir`, which is created if needed, or
+    inside the `db` package directory when no directory is given. Near-duplicate merging
+    is off unless `dedup_threshold` is set.
+
+    Args:
+        config (dict): The teach_config; None or {} gives the defaults.
+
+    Returns:
+        MemoStore or ShardedMemoStore: The opened store.
+    """
+    from .database import MemoStore
+
+    config = config or {}
+    store_class, settings = MemoStore, {}
+    if config.get("n_shards"):
+        # Spreads the memos over several SQLite files searched by parallel processes
+        store_class = ShardedMemoStore
+        settings = dict(n_shards=config["n_shards"], shard_key=config.get("shard_key", "hash"))
+    db_filename = config.get("db_filename", "app.db")
+    if config.get("path_to_db_dir"):
+        os.makedirs(config["path_to_db_dir"], exist_ok=True)
+        db_filename = os.path.join(os.path.abspath(config["path_to_db_dir"]), db_filename)
+    return store_class(
+        **settings,
+        verbosity=config.get("verbosity", 0),
+        reset=config.get("reset_db", False),
+        db_filename=db_filename,
+        dedup_threshold=config.get("dedup_threshold"),
+        max_memos=config.get("max_memos"),
+        eviction_policy=config.get("eviction_policy", "lru"),
+        memo_ttl=config.get("memo_ttl"),
+        maintenance_interval=config.get("maintenance_interval"),
+        retrieval_mode=config.get("retrieval_mode", "vector"),
+        embedding_dtype=config.get("embedding_dtype", "float32"),
+        index_dtype=config.get("index_dtype", "float32")
+    )
@@ -4,23 +4,104 @@
 # Filepath: `/main.py`
 # Updated: 10-28-2023
 
+import time
+startup_start = time.perf_counter()
+
+import argparse
 from agent.agent import AgentManager
 from ops.chat_manager import ChatManager
 from ops.config import logger
+from ops.metrics import metrics
 
 # Now you can use logger in main.py
 logger.debug("MAIN FILE: This is a debug message from main.py.")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="OpenMindAI (AXYS) chatbot")
+    parser.add_argument("--server", action="store_true",
+                        help="Serve many chat sessions over HTTP instead of the terminal chat.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=16,
+                        help="Threads serving HTTP requests.")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--max-in-flight", type=int, default=32,
+                        help="Messages processed at once before new ones are rejected with 503.")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Print terminal replies only once they are complete.")
+    parser.add_argument("--llm-backend", choices=["openai", "stub"], default="openai",
+                        help="'stub' answers locally with simulated latency, for offline testing.")
+    parser.add_argument("--llm-concurrency", type=int, default=8,
+                        help="LLM requests in flight at once across all sessions.")
+    parser.add_argument("--micro-batch", action="store_true",
+                        help="Coalesce concurrent LLM requests into batched requests.")
+    parser.add_argument("--micro-batch-wait", type=float, default=0.01,
+                        help="Seconds to wait for a micro-batch to fill.")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Collect latency histograms and counters (served at GET /metrics in server mode).")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Also write a Prometheus-format snapshot to this file periodically.")
+    parser.add_argument("--metrics-interval", type=float, default=15.0,
+                        help="Seconds between metrics snapshots.")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Answer near-identical prompts from a semantic cache instead of the LLM.")
+    parser.add_argument("--cache-threshold", type=float, default=0.92,
+                        help="Minimum cosine similarity for a cached reply to be reused.")
+    parser.add_argument("--cache-ttl", type=float, default=3600.0,
+                        help="Seconds a cached reply stays valid.")
+    parser.add_argument("--cache-size", type=int, default=1000)
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+
+    if args.metrics or args.metrics_file:
+        metrics.enable()
+        if args.metrics_file:
+            metrics.start_snapshots(args.metrics_file, args.metrics_interval)
+    try:
+        run(args)
+    finally:
+        # Writes the final snapshot
+        metrics.stop_snapshots()
+
+
+def run(args):
+    from agent.llm_backend import OpenAICompletionBackend, StubBackend, MicroBatcher
+    if args.llm_backend == "stub":
+        backend = StubBackend(max_concurrency=args.llm_concurrency)
+    else:
+        backend = OpenAICompletionBackend(max_concurrency=args.llm_concurrency)
+    if args.micro_batch:
+        backend = MicroBatcher(backend, max_wait=args.micro_batch_wait)
+
+    response_cache = None
+    if args.response_cache:
+        from db.response_cache import ResponseCache
+        response_cache = ResponseCache(threshold=args.cache_threshold, ttl=args.cache_ttl,
+                                       max_entries=args.cache_size)
+
     # Initialize an AgentManager
-    axys_agent_manager = AgentManager()
+    axys_agent_manager = AgentManager(backend=backend, response_cache=response_cache)
+
+    # Initialize a ChatManager for the AgentManager. In server mode every admitted message may
+    # run its stages at once, so the pipeline is sized to the admission limit.
+    chat_settings = {"max_workers": args.max_in_flight} if args.server else {}
+    axys_chat_manager = ChatManager(agent_manager=axys_agent_manager, **chat_settings)
+
+    if args.server:
+        from ops.chat_server import ChatServer
+        ChatServer(axys_chat_manager, host=args.host, port=args.port, max_workers=args.workers,
+                   max_sessions=args.max_sessions, max_in_flight=args.max_in_flight).serve_forever()
+        return
 
-    # Initialize a ChatManager for the AgentManager
-    axys_chat_manager = ChatManager(agent_manager=axys_agent_manager)
+    logger.info(
+        f"MAIN FILE: Ready for input {time.perf_counter() - startup_start:.2f}s after start.")
 
     # Start the terminal-based chat
-    axys_chat_manager.start_chat()
+    axys_chat_manager.start_chat(stream=not args.no_stream)
 
 
 if __name__ == "__main__":
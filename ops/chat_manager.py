@@ -4,9 +4,14 @@
 # Filepath: `/ops/chat_manager.py`
 # Updated: 10-28-2023
 
-from typing import Union, Dict, List, Optional
-from main import logger
+import time
+import threading
+from typing import Union, Dict, List, Optional, Iterator
+from ops.config import logger
+from ops.metrics import metrics
 from agent.agent import AgentManager
+from agent.context_assembler import ContextAssembler, ConversationContext
+from ops.pipeline import MessagePipeline
 import db.database as db
 
 
@@ -15,88 +20,277 @@ class ChatManager:
     Manages the chat functionalities for AgentManager.
     """
 
-    def __init__(self, agent_manager: AgentManager):
+    # Seconds to wait for each stage before carrying on without it
+    DEFAULT_STAGE_TIMEOUTS = {"analyze": 10.0, "store": 30.0, "reply": 60.0}
+    # Seconds the terminal chat waits for a cancelled reply to stop printing
+    CANCEL_JOIN_TIMEOUT = 1.0
+
+    def __init__(self, agent_manager: AgentManager, stage_timeouts: Optional[Dict[str, float]] = None,
+                 max_workers: int = 8, context_assembler: Optional[ContextAssembler] = None,
+                 max_history_messages: Optional[int] = 200):
+        """
+        Args:
+            agent_manager (AgentManager): The agents that handle each message.
+            stage_timeouts (dict, optional): Overrides for DEFAULT_STAGE_TIMEOUTS, in seconds.
+            max_workers (int, optional): Threads running the background stages, and separately the
+                replies. Size it to the number of messages handled at once. Defaults to 8.
+            context_assembler (ContextAssembler, optional): Fits history into the reply prompt's
+                token budget. Defaults to a ContextAssembler with its default 2048-token budget.
+            max_history_messages (int, optional): Messages a history keeps once older ones are
+                covered by its running summary. Unbounded if None. Defaults to 200.
+        """
         try:
             logger.info(
                 f"CHAT MANAGER: Successfully initialized ChatManager class.")
             self.agent_manager = agent_manager
             self.chat_history = []
+            self.context = ConversationContext()
+            self.context_assembler = context_assembler or ContextAssembler()
+            self.max_history_messages = max_history_messages
+            self.stage_timeouts = {**self.DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
+            self.pipeline = self._build_pipeline(max_workers)
         except Exception as e:
             logger.error(
                 f"CHAT MANAGER: Error ininitializing ChatManager class: {e}")
 
-    def handle_user_input(self, user_input: str):
+    def _build_pipeline(self, max_workers: int) -> MessagePipeline:
         """
-        Handles user input by passing it through the various agents.
+        Builds the per-message stages:
+
+            analyze
+            store
+            reply
+
+        None of them reads another's result, so all three start at once. The reply runs on
+        its own pool, so it never queues behind the analysis and storage of earlier messages,
+        and is returned as soon as the LLM answers.
         """
+        pipeline = MessagePipeline(max_workers=max_workers)
+        pipeline.add_stage("analyze", self._analyze,
+                           timeout=self.stage_timeouts["analyze"])
+        pipeline.add_stage("store", self._store,
+                           timeout=self.stage_timeouts["store"])
+        pipeline.add_stage("reply", self._reply,
+                           timeout=self.stage_timeouts["reply"], max_workers=max_workers)
+        return pipeline
+
+    def _analyze(self, user_input: str, results: Dict):
         # Analyze the text
         try:
-            logger.info(f"CHAT MANAGER: Successfully got text analyzer agent.")
             analyzer = self.agent_manager.get_text_analyzer_agent()
-        except Exception as e:
-            logger.error(
-                f"CHAT MANAGER: Error in getting TextAnalyzerAgent: {e}")
-        try:
-            logger.info(
-                f"CHAT MANAGER: Successfully got analyzer.analyze(user_input): {user_input}")
+            logger.debug("CHAT MANAGER: Successfully got text analyzer agent.")
             analysis = analyzer.analyze(
                 user_input, "Analyze the text carefully")
+            logger.debug(
+                "CHAT MANAGER: Successfully got analyzer.analyze(user_input): %s", user_input)
+            return analysis
         except Exception as e:
             logger.error(
                 f"CHAT MANAGER: Error executing `analyze` function: {e}")
+            raise
 
-        # Teachable agent considers memo storage or retrieval based on analysis and user input
+    def _store(self, user_input: str, results: Dict):
+        # Teachable agent considers memo storage based on analysis and user input
         try:
-            logger.info(f"CHAT MANAGER: Successfully got teachable agent.")
             teachable = self.agent_manager.get_teachable_agent()
+            logger.debug("CHAT MANAGER: Successfully got teachable agent.")
+            teachable.consider_memo_storage(
+                user_input, user_id=results.get("user_id"), session_id=results.get("session_id"))
+            logger.debug(
+                "CHAT MANAGER: Successfully got teachable.consider_memo_storage(user_input): %s", user_input)
         except Exception as e:
             logger.error(
-                f"CHAT MANAGER: Error in getting TeachableAgent: {e}")
-        try:
-            logger.info(
-                f"CHAT MANAGER: Successfully got teachable.consider_memo_retrieval(user_input): {user_input}")
-            teachable.consider_memo_storage(user_input)
-        except Exception as e:
-            logger.error(
-                f"CHAT MANAGER: Error in getting teachable.consider_memo_retrieval(user_input)")
+                f"CHAT MANAGER: Error in teachable.consider_memo_storage(user_input): {e}")
+            raise
 
+    def _reply(self, user_input: str, results: Dict):
         # Conversable agent generates a reply
         try:
-            logger.info(f"CHAT MANAGER: Successfully got conversable agent.")
             conversable = self.agent_manager.get_conversable_agent()
-        except Exception as e:
-            logger.error(
-                f"CHAT MANAGER: Error in getting ConversableAgent: {e}")
-        try:
-            logger.info(
-                f"CHAT MANAGER: Successfully got conversable.generate_reply(user_input): {user_input}")
+            logger.debug("CHAT MANAGER: Successfully got conversable agent.")
             reply = conversable.generate_reply(
-                [{'role': 'user', 'content': user_input}])
+                results.get("messages") or [{'role': 'user', 'content': user_input}])
+            logger.debug(
+                "CHAT MANAGER: Successfully got conversable.generate_reply(user_input): %s", user_input)
+            return reply
         except Exception as e:
             logger.error(
                 f"CHAT MANAGER: Error in getting conversable.generate_reply(user_input): {e}")
+            raise
+
+    def _recall(self, user_input: str, user_id: Optional[str]) -> List[Dict]:
+        # Memos the teachable agent recalls for this message, from the user's own memos only
         try:
-            logger.info(f"CHAT MANAGER: Successfully returned reply: {reply}")
-            return reply
+            teachable = self.agent_manager.get_teachable_agent()
+            return teachable.recall_memos(user_input, user_id=user_id)
+        except Exception as e:
+            logger.error(f"CHAT MANAGER: Error in recalling memos: {e}")
+            return []
+
+    def _assemble(self, user_input: str, chat_history: List[Dict], context: ConversationContext,
+                  user_id: Optional[str] = None) -> List[Dict]:
+        memos = self._recall(user_input, user_id)
+        try:
+            return self.context_assembler.assemble(user_input, chat_history, memos=memos,
+                                                   context=context)["messages"]
+        except Exception as e:
+            logger.error(f"CHAT MANAGER: Error in assembling the reply context: {e}")
+            return [{'role': 'user', 'content': user_input}]
+
+    def _record_turn(self, user_input: str, reply: str, chat_history: List[Dict], context: ConversationContext):
+        chat_history.append({'role': 'user', 'content': user_input})
+        chat_history.append({'role': 'assistant', 'content': reply})
+        if self.max_history_messages is not None:
+            self.context_assembler.trim_history(chat_history, context, self.max_history_messages)
+
+    def handle_user_input(self, user_input: str, chat_history: Optional[List[Dict]] = None,
+                          context: Optional[ConversationContext] = None,
+                          user_id: Optional[str] = None, session_id: Optional[str] = None):
+        """
+        Handles user input by passing it through the various agents.
+
+        Analysis, memo storage and reply generation run concurrently; the reply is returned
+        as soon as it is ready while the other stages finish in the background. The reply
+        prompt holds the message plus as much of the history (and its running summary) and
+        of the memos the teachable agent recalls for it as the context assembler's token
+        budget allows.
+
+        Args:
+            user_input (str): The user message.
+            chat_history (list, optional): History to record the turn in, e.g. a server session's.
+                Defaults to this ChatManager's own `chat_history`.
+            context (ConversationContext, optional): The history's summary state, kept by the
+                caller alongside `chat_history`. Defaults to this ChatManager's own when
+                `chat_history` is not given either.
+            user_id (str, optional): The user the message's memos are stored under and recalled from.
+            session_id (str, optional): The session the message's memos are stored under.
+        """
+        if chat_history is None:
+            chat_history, context = self.chat_history, self.context
+        context = context or ConversationContext()
+        metrics.inc("axys_messages_total", help_text="User messages handled.")
+        with metrics.span("axys_message_seconds", "Time from user message to reply."):
+            messages = self._assemble(user_input, chat_history, context, user_id)
+            reply = self.pipeline.run(user_input, target="reply", context={
+                "messages": messages, "user_id": user_id, "session_id": session_id})
+        if reply is None:
+            reply = "CHAT MANAGER: Sorry, I couldn't generate a reply in time."
+        self._record_turn(user_input, reply, chat_history, context)
+        logger.debug("CHAT MANAGER: Successfully returned reply: %s", reply)
+        return reply
+
+    def handle_user_input_stream(self, user_input: str,
+                                 cancel_event: Optional[threading.Event] = None,
+                                 chat_history: Optional[List[Dict]] = None,
+                                 context: Optional[ConversationContext] = None,
+                                 user_id: Optional[str] = None,
+                                 session_id: Optional[str] = None) -> Iterator[str]:
+        """
+        Like `handle_user_input`, but yields the reply in chunks as the LLM produces them.
+
+        Analysis and memo storage are started in the background as usual; the turn is added
+        to `chat_history` once the stream ends, including when it is cancelled part-way. The
+        whole stream is bounded by the "reply" stage timeout.
+
+        Args:
+            user_input (str): The user message.
+            cancel_event (threading.Event, optional): Set it to stop the reply and close its request.
+            chat_history (list, optional): History to record the turn in. Defaults to this
+                ChatManager's own `chat_history`.
+            context (ConversationContext, optional): The history's summary state, as for `handle_user_input`.
+            user_id (str, optional): The user the message's memos are stored under and recalled from.
+            session_id (str, optional): The session the message's memos are stored under.
+        """
+        if chat_history is None:
+            chat_history, context = self.chat_history, self.context
+        context = context or ConversationContext()
+        metrics.inc("axys_messages_total", help_text="User messages handled.")
+        start = time.perf_counter()
+        self.pipeline.run(user_input, skip=("reply",),
+                          context={"user_id": user_id, "session_id": session_id})
+        chunks = []
+        try:
+            conversable = self.agent_manager.get_conversable_agent()
+            messages = self._assemble(user_input, chat_history, context, user_id)
+            for chunk in conversable.generate_reply(messages, stream=True, cancel_event=cancel_event,
+                                                    timeout=self.stage_timeouts["reply"]):
+                if not chunks:
+                    metrics.observe("axys_first_chunk_seconds", time.perf_counter() - start,
+                                    "Time from user message to the first streamed reply chunk.")
+                chunks.append(chunk)
+                yield chunk
+        except TimeoutError as e:
+            metrics.inc("axys_stage_timeouts_total", help_text="Stages abandoned after their timeout.",
+                        stage="reply")
+            logger.error(f"CHAT MANAGER: {e}")
+            yield "CHAT MANAGER: Sorry, I couldn't generate a reply in time."
         except Exception as e:
             logger.error(
-                f"CHAT MANAGER: Error in returning reply: {e}")
+                f"CHAT MANAGER: Error in streaming conversable.generate_reply(user_input): {e}")
+            yield "CHAT MANAGER: Sorry, I couldn't generate a reply."
+        finally:
+            reply = "".join(chunks)
+            self._record_turn(user_input, reply, chat_history, context)
+            logger.debug("CHAT MANAGER: Successfully streamed reply: %s", reply)
+
+    def close(self):
+        """
+        Waits for in-flight stages (such as memo storage) and closes the agents.
+        """
+        try:
+            self.pipeline.shutdown(wait=True)
+            self.agent_manager.shutdown()
+        except Exception as e:
+            logger.error(f"CHAT MANAGER: Error in closing ChatManager: {e}")
 
-    def start_chat(self):
+    def start_chat(self, stream: bool = True):
         """
         Starts a terminal-based chat with the user.
+
+        Agents are warmed up in the background, so input is accepted right away; the first
+        message waits only for the agents it still needs.
+
+        Args:
+            stream (bool, optional): Print replies chunk by chunk as they arrive. Sending a new
+                message while a reply is still streaming cancels it. Defaults to True.
         """
+        self.agent_manager.warm_up()
         print("Hello! How can I assist you today?")
+        streaming = None  # (thread, cancel_event) of the reply being printed
         try:
+            print("> ", end="", flush=True)
             while True:
-                user_input = input("> ")
+                user_input = input() if stream else input("> ")
+                if streaming is not None:
+                    thread, cancel_event = streaming
+                    if thread.is_alive():
+                        cancel_event.set()
+                        thread.join(self.CANCEL_JOIN_TIMEOUT)
+                        if thread.is_alive():
+                            logger.warning("CHAT MANAGER: Cancelled reply is still stopping; continuing.")
+                        print("[cancelled]")
+                    streaming = None
+
                 if user_input.lower() == "quit":
                     print("Goodbye!")
-                    self.agent_manager.get_teachable_agent().close_db()
+                    self.close()
                     break
 
-                reply = self.handle_user_input(user_input)
-                print(reply)
+                if stream:
+                    cancel_event = threading.Event()
+                    thread = threading.Thread(
+                        target=self._print_stream, args=(user_input, cancel_event), daemon=True)
+                    thread.start()
+                    streaming = (thread, cancel_event)
+                else:
+                    reply = self.handle_user_input(user_input)
+                    print(reply)
         except Exception as e:
             logger.error(
                 f"CHAT MANAGER: Catch-all error in start_chat: {e}")
+
+    def _print_stream(self, user_input: str, cancel_event: threading.Event):
+        for chunk in self.handle_user_input_stream(user_input, cancel_event):
+            print(chunk, end="", flush=True)
+        if not cancel_event.is_set():
+            print("\n> ", end="", flush=True)
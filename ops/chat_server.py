@@ -0,0 +1,289 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Chat Server
+# Filepath: `/ops/chat_server.py`
+# Updated: 10-28-2023
+
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+from ops.config import logger
+from ops.metrics import metrics
+from ops.chat_manager import ChatManager
+from agent.context_assembler import ConversationContext
+
+
+class ChatSession:
+    """
+    State for one user's conversation: its own history, serialized message handling.
+
+    Memos taught in the session are stored under its `user_id` and `session_id`, and recalled
+    only from that user's memos. The user id defaults to the session id.
+    """
+
+    def __init__(self, session_id: str, user_id: Optional[str] = None):
+        self.session_id = session_id
+        self.user_id = user_id or session_id
+        self.chat_history: List[Dict] = []
+        # Running summary of the history's older messages, updated incrementally
+        self.context = ConversationContext()
+        self.last_active = time.monotonic()
+        # Messages within one session are answered in order
+        self.lock = threading.Lock()
+
+
+class ChatServer:
+    """
+    Hosts many concurrent chat sessions in one process over a small JSON/HTTP API.
+
+    All sessions share one ChatManager, and through it one set of agents, one embedding
+    model and one MemoStore. Requests are served by a fixed worker pool, and admission
+    control rejects new sessions or messages with HTTP 503 instead of queueing without bound.
+    Create the ChatManager with `max_workers` of at least `max_in_flight`, so every admitted
+    message gets a pipeline worker instead of waiting out its stage timeouts.
+
+    Endpoints:
+        POST   /sessions                    {"user_id": ...} (optional) -> {"session_id": ..., "user_id": ...}
+        POST   /sessions/<id>/messages      {"content": ...} -> {"reply": ...}
+        GET    /sessions/<id>/history       -> {"chat_history": [...]}
+        DELETE /sessions/<id>
+        GET    /health
+        GET    /metrics                     Prometheus text format, when metrics are enabled
+    """
+
+    def __init__(self, chat_manager: ChatManager, host: str = "127.0.0.1", port: int = 8080,
+                 max_workers: int = 16, max_sessions: int = 1000, max_in_flight: int = 32,
+                 session_ttl: float = 3600.0):
+        """
+        Args:
+            chat_manager (ChatManager): Shared chat manager (and agents) for every session.
+            host (str, optional): Address to bind. Defaults to "127.0.0.1".
+            port (int, optional): Port to bind. Defaults to 8080.
+            max_workers (int, optional): Threads serving HTTP requests. Defaults to 16.
+            max_sessions (int, optional): Open sessions allowed at once. Defaults to 1000.
+            max_in_flight (int, optional): Messages processed at once; more are rejected. Defaults to 32.
+            session_ttl (float, optional): Seconds of inactivity before a session is dropped. Defaults to 3600.
+        """
+        self.chat_manager = chat_manager
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.sessions: Dict[str, ChatSession] = {}
+        self.sessions_lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.rejected = 0
+        self.active_messages = 0
+        self.httpd = _PooledHTTPServer((host, port), _make_handler(self), max_workers)
+        metrics.gauge("axys_server_sessions", "Open chat sessions.", self._session_count)
+        metrics.gauge("axys_server_messages_in_flight", "Messages being processed.",
+                      self._active_messages)
+        metrics.gauge("axys_server_rejected_total", "Sessions and messages rejected at capacity.",
+                      self._rejected, kind="counter")
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def _session_count(self):
+        return len(self.sessions)
+
+    def _active_messages(self):
+        return self.active_messages
+
+    def _rejected(self):
+        return self.rejected
+
+    def create_session(self, user_id: Optional[str] = None) -> Optional[ChatSession]:
+        with self.sessions_lock:
+            self._expire_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                self.rejected += 1
+                return None
+            session = ChatSession(uuid.uuid4().hex, user_id)
+            self.sessions[session.session_id] = session
+        logger.debug("CHAT SERVER: Opened session %s.", session.session_id)
+        return session
+
+    def get_session(self, session_id: str) -> Optional[ChatSession]:
+        with self.sessions_lock:
+            return self.sessions.get(session_id)
+
+    def close_session(self, session_id: str) -> bool:
+        with self.sessions_lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        expired = [session_id for session_id, session in self.sessions.items()
+                   if now - session.last_active > self.session_ttl]
+        for session_id in expired:
+            del self.sessions[session_id]
+        if expired:
+            logger.info("CHAT SERVER: Expired %s idle sessions.", len(expired))
+
+    def handle_message(self, session: ChatSession, content: str) -> Optional[str]:
+        """
+        Answers one message, or returns None when the server is at capacity.
+        """
+        if not self.in_flight.acquire(blocking=False):
+            with self.sessions_lock:
+                self.rejected += 1
+            return None
+        with self.sessions_lock:
+            self.active_messages += 1
+        try:
+            with session.lock:
+                session.last_active = time.monotonic()
+                return self.chat_manager.handle_user_input(
+                    content, chat_history=session.chat_history, context=session.context,
+                    user_id=session.user_id, session_id=session.session_id)
+        finally:
+            with self.sessions_lock:
+                self.active_messages -= 1
+            self.in_flight.release()
+
+    def health(self) -> Dict:
+        with self.sessions_lock:
+            sessions = len(self.sessions)
+        return {'sessions': sessions, 'rejected': self.rejected}
+
+    def serve_forever(self):
+        logger.info("CHAT SERVER: Listening on %s:%s.", self.address[0], self.address[1])
+        self.chat_manager.agent_manager.warm_up()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.chat_manager.close()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+class _PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands each connection to a fixed-size thread pool.
+
+    At most `max_queued` accepted connections wait for a worker. Beyond that the accept loop
+    stops accepting until a worker frees up, so further clients wait in the listen backlog
+    instead of an unbounded executor queue.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers, max_queued=None):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="chat-server")
+        self._slots = threading.BoundedSemaphore(
+            max_workers + (max_workers if max_queued is None else max_queued))
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self.executor.submit(self._process_request, request, client_address)
+        except RuntimeError:
+            # Closing; the executor no longer accepts connections
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def _make_handler(server: ChatServer):
+    # HTTP/1.0: one request per connection, so idle keep-alive clients never pin a worker
+    class ChatRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug("CHAT SERVER: %s " + format, self.address_string(), *args)
+
+        def _send(self, status, body=None, headers=None):
+            payload = json.dumps(body if body is not None else {}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_text(self, status, text, content_type):
+            payload = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _busy(self):
+            self._send(503, {'error': "Server at capacity, retry shortly."}, {"Retry-After": "1"})
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _route(self):
+            parts = [part for part in self.path.split("/") if part]
+            session = server.get_session(parts[1]) if len(parts) >= 2 and parts[0] == "sessions" else None
+            return parts, session
+
+        def do_GET(self):
+            parts, session = self._route()
+            if parts == ["health"]:
+                self._send(200, server.health())
+            elif parts == ["metrics"] and metrics.enabled:
+                self._send_text(200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+            elif len(parts) == 3 and parts[2] == "history" and session:
+                with session.lock:
+                    self._send(200, {'chat_history': list(session.chat_history)})
+            else:
+                self._send(404, {'error': "Not found"})
+
+        def do_POST(self):
+            parts, session = self._route()
+            if parts == ["sessions"]:
+                try:
+                    user_id = self._read_json().get("user_id")
+                except (ValueError, AttributeError):
+                    self._send(400, {'error': "Expected an optional JSON body with 'user_id'."})
+                    return
+                session = server.create_session(None if user_id is None else str(user_id))
+                if session is None:
+                    self._busy()
+                else:
+                    self._send(201, {'session_id': session.session_id, 'user_id': session.user_id})
+            elif len(parts) == 3 and parts[2] == "messages" and session:
+                try:
+                    content = self._read_json()["content"]
+                except (ValueError, KeyError, TypeError):
+                    content = None
+                if not isinstance(content, str):
+                    self._send(400, {'error': "Expected a JSON object with a string 'content'."})
+                    return
+                reply = server.handle_message(session, content)
+                if reply is None:
+                    self._busy()
+                else:
+                    self._send(200, {'reply': reply})
+            else:
+                self._send(404, {'error': "Not found"})
+
+        def do_DELETE(self):
+            parts, _ = self._route()
+            if len(parts) == 2 and parts[0] == "sessions" and server.close_session(parts[1]):
+                self._send(200, {'session_id': parts[1], 'closed': True})
+            else:
+                self._send(404, {'error': "Not found"})
+
+    return ChatRequestHandler
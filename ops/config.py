@@ -6,7 +6,12 @@
 
 import os
 import json
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+from collections import OrderedDict
 
 # Initialize logging
 script_dir = os.path.dirname(__file__)
@@ -16,21 +21,165 @@ logs_dir = os.path.join(script_dir, '..', 'logs')
 if not os.path.exists(logs_dir):
     os.makedirs(logs_dir)
 
-log_file_path = os.path.join(logs_dir, 'app.log')
-
-logging.basicConfig(
-    filename=log_file_path,
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)-8s %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Logging settings, all overridable from the environment
+log_file_path = os.environ.get('AXYS_LOG_FILE', os.path.join(logs_dir, 'app.log'))
+log_level = os.environ.get('AXYS_LOG_LEVEL', 'INFO').upper()
+log_format = os.environ.get('AXYS_LOG_FORMAT', 'text')           # "text" or "json"
+log_max_bytes = int(os.environ.get('AXYS_LOG_MAX_BYTES', 10 * 1024 * 1024))
+log_backup_count = int(os.environ.get('AXYS_LOG_BACKUPS', 5))
+log_rotate_when = os.environ.get('AXYS_LOG_ROTATE_WHEN', 'midnight')
+log_sample_rate = float(os.environ.get('AXYS_LOG_SAMPLE_RATE', 1.0))
+log_queue_size = int(os.environ.get('AXYS_LOG_QUEUE_SIZE', 10000))
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    Rotates the log file on a schedule (`when`) or as soon as it grows past `max_bytes`.
+    """
+
+    def __init__(self, filename, max_bytes=0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if self.max_bytes > 0 and self.stream is not None:
+            if self.stream.tell() >= self.max_bytes:
+                return True
+        return super().shouldRollover(record)
+
+    def rotation_filename(self, default_name):
+        # Size rollovers can happen several times per period; number them instead of
+        # overwriting the period's earlier backup
+        name = super().rotation_filename(default_name)
+        candidate, number = name, 1
+        while os.path.exists(candidate):
+            candidate = f"{name}.{number}"
+            number += 1
+        return candidate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps 1 in every `round(1 / rate)` records per message template at INFO and below.
+
+    Warnings and errors always pass. Sampling is by template (`record.msg`, before the
+    arguments are merged), so one chatty call site cannot crowd out the others. Counts are
+    kept for the `max_templates` most recently seen templates, so messages formatted before
+    logging (each its own template) cannot grow the table without bound.
+    """
+
+    def __init__(self, rate, max_templates=1024):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.max_templates = max_templates
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.every == 1:
+            return True
+        if self.every == 0:
+            return False
+        with self.lock:
+            count = self.counts.pop(record.msg, 0)
+            self.counts[record.msg] = count + 1
+            if len(self.counts) > self.max_templates:
+                self.counts.popitem(last=False)
+        return count % self.every == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the background listener without formatting or blocking the caller.
+
+    Messages are formatted by the listener thread. If the queue is full the record is
+    dropped and counted instead of stalling the request that logged it.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The default QueueHandler formats here, on the caller's thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _configure_logging():
+    if log_format == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    file_handler = SizeAndTimeRotatingFileHandler(
+        log_file_path, max_bytes=log_max_bytes, when=log_rotate_when,
+        backupCount=log_backup_count, encoding='utf-8', delay=True)
+    file_handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=log_queue_size))
+    if log_sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(log_sample_rate))
+    listener = logging.handlers.QueueListener(
+        queue_handler.queue, file_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(log_level)
+    root.addHandler(queue_handler)
+    listener.start()
+
+    def stop():
+        # Drains whatever is still queued when the process exits
+        if listener._thread is None:
+            return
+        listener.stop()
+        if queue_handler.dropped:
+            file_handler.handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': "Dropped %d log records because the log queue was full.",
+                'args': (queue_handler.dropped,)}))
+        file_handler.close()
+
+    atexit.register(stop)
+    return queue_handler, listener
+
+
+log_queue_handler, log_listener = _configure_logging()
 
 logger = logging.getLogger(__name__)
 
 # Load API keys from JSON
 json_path = os.path.join(script_dir, 'OAI_CONFIG_LIST.json')
-with open(json_path, 'r') as f:
-    api_config_list = json.load(f)
+if os.path.exists(json_path):
+    with open(json_path, 'r') as f:
+        api_config_list = json.load(f)
+else:
+    # Offline tools (benchmarks, migrations) run without keys
+    logger.warning("No API config found at %s; continuing without API keys.", json_path)
+    api_config_list = [{}]
 
 # Create dictionary to hold API keys
 api_keys = {}
@@ -0,0 +1,238 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Metrics
+# Filepath: `/ops/metrics.py`
+# Updated: 10-28-2023
+
+import os
+import time
+import bisect
+import weakref
+import threading
+from contextlib import contextmanager
+
+# Seconds; fine-grained at the low end for SQLite and cache lookups, up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricsRegistry:
+    """
+    In-process counters, histograms and gauges, rendered in the Prometheus text format.
+
+    Disabled by default: until `enable()` is called, `span`, `inc` and `observe` return at
+    once, so instrumented code pays one attribute check. Gauges are callbacks evaluated only
+    when the metrics are rendered.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._help = {}
+        self._types = {}
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> _Histogram
+        self._callbacks = {}   # name -> (callable, weak)
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+        self._snapshot_stop = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._types:
+            self._types[name] = kind
+            self._help[name] = help_text
+
+    def inc(self, name, amount=1, help_text="", **labels):
+        """
+        Adds `amount` to a counter.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, help_text="", buckets=DEFAULT_BUCKETS, **labels):
+        """
+        Records one value in a histogram.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                self._declare(name, "histogram", help_text)
+                histogram = self._histograms.setdefault(key, _Histogram(buckets))
+        histogram.observe(value)
+
+    @contextmanager
+    def _timed(self, name, help_text, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help_text, **labels)
+
+    def span(self, name, help_text="", **labels):
+        """
+        Times a block into the `name` histogram, in seconds.
+
+        Usage:
+            with metrics.span("axys_sqlite_query_seconds", query="fetch_memos"):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._timed(name, help_text, labels)
+
+    def gauge(self, name, help_text, func, kind="gauge"):
+        """
+        Registers a callback read at render time, e.g. a queue depth or an existing counter.
+
+        Bound methods are held weakly, so registering one does not keep its object alive.
+        Registering the same name again replaces the earlier callback.
+
+        Args:
+            name (str): Metric name.
+            help_text (str): HELP line.
+            func (callable): Returns the current value.
+            kind (str, optional): "gauge", or "counter" for monotonically increasing values.
+        """
+        weak = hasattr(func, "__self__")
+        with self._lock:
+            self._types[name] = kind
+            self._help[name] = help_text
+            self._callbacks[name] = (weakref.WeakMethod(func) if weak else func, weak)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+            callbacks = dict(self._callbacks)
+            types, helps = dict(self._types), dict(self._help)
+
+        def header(name):
+            if helps.get(name):
+                lines.append(f"# HELP {name} {helps[name]}")
+            lines.append(f"# TYPE {name} {types[name]}")
+
+        for name in sorted({key[0] for key in counters}):
+            header(name)
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name in sorted({key[0] for key in histograms}):
+            header(name)
+            for (metric, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                with histogram.lock:
+                    counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+                cumulative = 0
+                for bound, bucket_count in zip(list(histogram.buckets) + [float("inf")], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} "
+                                 f"{cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name, (func, weak) in sorted(callbacks.items()):
+            if weak:
+                func = func()
+                if func is None:
+                    continue
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            header(name)
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        """
+        Writes the rendered metrics to `path` atomically, e.g. for the node exporter's textfile collector.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def start_snapshots(self, path, interval=15.0):
+        """
+        Writes a snapshot every `interval` seconds from a daemon thread until `stop_snapshots`.
+        """
+        if self._snapshot_thread is not None:
+            return
+        self._snapshot_stop.clear()
+
+        def run():
+            while not self._snapshot_stop.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        self._snapshot_thread = threading.Thread(target=run, name="metrics-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def stop_snapshots(self):
+        if self._snapshot_thread is not None:
+            self._snapshot_stop.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# Process-wide registry used by every instrumented module
+metrics = MetricsRegistry()
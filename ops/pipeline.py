@@ -0,0 +1,242 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Message Pipeline
+# Filepath: `/ops/pipeline.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional
+from ops.config import logger
+from ops.metrics import metrics
+
+
+class Stage:
+    """
+    One step of the per-message pipeline.
+
+    Args:
+        name (str): Unique stage name.
+        func (Callable): Called as `func(user_input, results)`, where `results` maps each
+            dependency's name to its value (None if that dependency failed or timed out).
+        depends_on (list, optional): Names of stages whose results this stage needs.
+        timeout (float, optional): Seconds dependents and callers wait for this stage. None waits forever.
+        executor (ThreadPoolExecutor, optional): Dedicated pool for this stage. None uses the shared pool.
+    """
+
+    def __init__(self, name: str, func: Callable, depends_on: Optional[List[str]] = None,
+                 timeout: Optional[float] = None, executor: Optional[ThreadPoolExecutor] = None):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on or [])
+        self.timeout = timeout
+        self.executor = executor
+
+
+class _MessageRun:
+    """
+    The stages of one message: a result future per stage, and the dependencies each
+    dependent still waits for.
+    """
+
+    def __init__(self, pipeline, user_input, context, skip):
+        self.pipeline = pipeline
+        self.user_input = user_input
+        self.context = context
+        self.futures = {name: Future() for name in pipeline.stages}
+        self.started = {}
+        # Dependency name -> value its dependents see, once it finished, failed or timed out
+        self.settled = {}
+        self._waiting = {stage.name: set(stage.depends_on) for stage in pipeline.stages.values()
+                         if stage.depends_on and stage.name not in skip}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def submit(self, stage):
+        self.started[stage.name] = time.perf_counter()
+        executor = stage.executor or self.pipeline.executor
+        self.pipeline._stage_started()
+        try:
+            future = executor.submit(self._run_stage, stage)
+        except RuntimeError as e:
+            # The pipeline was shut down without waiting
+            self.pipeline._stage_finished()
+            self.futures[stage.name].set_exception(e)
+            self.settle(stage.name, None)
+            return
+        if stage.timeout is not None and self.pipeline._has_dependents(stage.name):
+            timer = threading.Timer(stage.timeout, self._timed_out, args=(stage,))
+            timer.daemon = True
+            self._timers[stage.name] = timer
+            timer.start()
+        future.add_done_callback(lambda done: self._finished(stage, done))
+
+    def _run_stage(self, stage):
+        results = dict(self.context or {})
+        results.update({dependency: self.settled.get(dependency) for dependency in stage.depends_on})
+        with metrics.span("axys_stage_seconds", "Pipeline stage latency.", stage=stage.name):
+            return stage.func(self.user_input, results)
+
+    def _finished(self, stage, done):
+        timer = self._timers.pop(stage.name, None)
+        if timer is not None:
+            timer.cancel()
+        try:
+            error = done.exception()
+            if error is None:
+                self.futures[stage.name].set_result(done.result())
+                self.settle(stage.name, done.result())
+            else:
+                metrics.inc("axys_stage_failures_total", help_text="Stages that raised.", stage=stage.name)
+                logger.error(f"PIPELINE: Stage '{stage.name}' failed: {error}")
+                self.futures[stage.name].set_exception(error)
+                self.settle(stage.name, None)
+        finally:
+            self.pipeline._stage_finished()
+
+    def _timed_out(self, stage):
+        if self.futures[stage.name].done():
+            return
+        metrics.inc("axys_stage_timeouts_total", help_text="Stages abandoned after their timeout.",
+                    stage=stage.name)
+        logger.error(
+            f"PIPELINE: Stage '{stage.name}' exceeded its {stage.timeout}s timeout; its dependents continue without it.")
+        self.settle(stage.name, None)
+
+    def settle(self, name, value):
+        """
+        Records the value dependents see for `name` and submits every dependent now ready.
+        """
+        with self._lock:
+            if name in self.settled:
+                return
+            self.settled[name] = value
+            ready = []
+            for dependent, waiting in self._waiting.items():
+                waiting.discard(name)
+                if not waiting:
+                    ready.append(dependent)
+            for dependent in ready:
+                del self._waiting[dependent]
+        for dependent in ready:
+            self.submit(self.pipeline.stages[dependent])
+
+    def wait(self, name):
+        """
+        Waits for one stage within its timeout, returning None if it fails or runs over.
+        """
+        stage = self.pipeline.stages[name]
+        timeout = stage.timeout
+        if timeout is not None and name in self.started:
+            timeout = max(0.0, timeout - (time.perf_counter() - self.started[name]))
+        try:
+            return self.futures[name].result(timeout=timeout)
+        except FutureTimeoutError:
+            metrics.inc("axys_stage_timeouts_total", help_text="Stages abandoned after their timeout.",
+                        stage=name)
+            logger.error(
+                f"PIPELINE: Stage '{name}' exceeded its {stage.timeout}s timeout; continuing without it.")
+        except Exception:
+            # Already counted and logged when the stage finished
+            pass
+        return None
+
+
+class MessagePipeline:
+    """
+    Runs the stages for one message concurrently, following an explicit dependency graph.
+
+    Stages without dependencies are submitted as soon as the message arrives. A stage with
+    dependencies is submitted once each of them has finished, failed or run past its
+    timeout, so it never holds a worker while it waits. `run` returns as soon as the
+    requested stage finishes, and the remaining stages complete in the background.
+
+    A stage added with `max_workers` runs on a pool of its own, so it never queues behind
+    the background stages of earlier messages.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.stages: Dict[str, Stage] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="pipeline")
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    def add_stage(self, name: str, func: Callable, depends_on: Optional[List[str]] = None,
+                  timeout: Optional[float] = None, max_workers: Optional[int] = None):
+        """
+        Adds a stage after the stages it depends on.
+
+        Args:
+            name (str): Unique stage name.
+            func (Callable): Called as `func(user_input, results)`; see Stage.
+            depends_on (list, optional): Names of stages already added whose results this stage needs.
+            timeout (float, optional): Seconds dependents and callers wait for this stage.
+            max_workers (int, optional): Run the stage on a dedicated pool of this many threads
+                instead of the shared one.
+        """
+        for dependency in depends_on or []:
+            if dependency not in self.stages:
+                raise ValueError(
+                    f"PIPELINE: Stage '{name}' depends on unknown stage '{dependency}'")
+        executor = None
+        if max_workers is not None:
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"pipeline-{name}")
+        self.stages[name] = Stage(name, func, depends_on, timeout, executor)
+        return self
+
+    def _has_dependents(self, name):
+        return any(name in stage.depends_on for stage in self.stages.values())
+
+    def _stage_started(self):
+        with self._idle:
+            self._in_flight += 1
+
+    def _stage_finished(self):
+        with self._idle:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.notify_all()
+
+    def run(self, user_input: str, target: Optional[str] = None, skip: tuple = (),
+            context: Optional[Dict] = None):
+        """
+        Starts the stages for `user_input` and returns the result of `target`.
+
+        Args:
+            user_input (str): The user message.
+            target (str, optional): The stage whose result the caller needs (e.g. "reply").
+                If None, returns immediately and every stage runs in the background.
+            skip (tuple, optional): Stages the caller runs itself, e.g. a streamed reply. Their
+                dependents see None for them.
+            context (dict, optional): Extra entries every stage finds in its `results`, e.g. the
+                assembled prompt messages.
+
+        Returns:
+            The target stage's result, or None if it failed, timed out or no target was given.
+        """
+        message = _MessageRun(self, user_input, context, skip)
+        for stage in self.stages.values():
+            if stage.name in skip:
+                message.futures[stage.name].set_result(None)
+                message.settle(stage.name, None)
+            elif not stage.depends_on:
+                message.submit(stage)
+        if target is None:
+            return None
+        return message.wait(target)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops accepting messages, by default letting in-flight stages (e.g. memo storage) finish.
+        """
+        if wait:
+            # Dependents are submitted as their dependencies finish, so the pools stay open until then
+            with self._idle:
+                self._idle.wait_for(lambda: not self._in_flight)
+        self.executor.shutdown(wait=wait)
+        for stage in self.stages.values():
+            if stage.executor is not None:
+                stage.executor.shutdown(wait=wait)
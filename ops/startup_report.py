@@ -0,0 +1,82 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Startup Report
+# Filepath: `/ops/startup_report.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Default budget for importing `main` (everything that runs before the prompt is shown)
+DEFAULT_STARTUP_BUDGET_MS = float(os.environ.get("STARTUP_BUDGET_MS", 1500))
+
+root_dir = os.path.join(os.path.dirname(__file__), '..')
+
+
+def measure_import_times(module="main"):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime` and parses the report.
+
+    Args:
+        module (str, optional): Module to import. Defaults to "main".
+
+    Returns:
+        list: (module_name, self_us, cumulative_us, depth) tuples in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def startup_report(module="main", budget_ms=DEFAULT_STARTUP_BUDGET_MS, top=15):
+    """
+    Summarizes import time for `module` and checks it against the startup budget.
+
+    Returns:
+        dict: 'total_ms', 'budget_ms', 'within_budget' and 'slowest' (top-level imports by cumulative ms).
+    """
+    entries = measure_import_times(module)
+    # Depth-0 entries are the top-level imports; their cumulative times add up to the total
+    top_level = [(name, cumulative_us / 1000) for name, _, cumulative_us, depth in entries if depth == 0]
+    total_ms = sum(ms for _, ms in top_level)
+    return {
+        'total_ms': total_ms,
+        'budget_ms': budget_ms,
+        'within_budget': total_ms <= budget_ms,
+        'slowest': sorted(top_level, key=lambda item: item[1], reverse=True)[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report import time before the chat prompt and check it against a budget.")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_STARTUP_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    report = startup_report(args.module, args.budget_ms, args.top)
+    print(f"{'cumulative ms':>14}  module")
+    for name, ms in report['slowest']:
+        print(f"{ms:>14.1f}  {name}")
+    status = "OK" if report['within_budget'] else "OVER BUDGET"
+    print(f"\nTotal import time: {report['total_ms']:.1f} ms (budget {report['budget_ms']:.0f} ms) {status}")
+    sys.exit(0 if report['within_budget'] else 1)
+
+
+if __name__ == "__main__":
+    main()
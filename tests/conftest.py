@@ -0,0 +1,113 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Test Configuration
+# Filepath: `/tests/conftest.py`
+# Updated: 10-28-2023
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Set before ops.config is imported, so records logged while the tests are collected stay
+# out of the tracked logs/app.log too
+os.environ.setdefault('AXYS_LOG_FILE', os.path.join(tempfile.gettempdir(), 'axys-tests.log'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bench.memo_store import FakeEmbeddingModel, FAKE_MODEL_NAME  # noqa: E402
+from db.embedding_model import register_model  # noqa: E402
+from ops.config import log_listener  # noqa: E402
+from agent.llm_backend import read_stream  # noqa: E402
+from ops.chat_manager import ChatManager  # noqa: E402
+
+# MemoStore's default model, replaced so tests never load sentence_transformers
+DEFAULT_MODEL_NAME = 'distilbert-base-nli-stsb-mean-tokens'
+
+
+@pytest.fixture(scope="session", autouse=True)
+def log_file(tmp_path_factory):
+    # Moves the log file handler into the session's temporary directory
+    path = tmp_path_factory.mktemp("logs") / "app.log"
+    handler = log_listener.handlers[0]
+    handler.acquire()
+    try:
+        if handler.stream is not None:
+            handler.stream.close()
+            handler.stream = None
+        handler.baseFilename = str(path)
+    finally:
+        handler.release()
+    return path
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_embeddings():
+    model = FakeEmbeddingModel(64)
+    register_model(FAKE_MODEL_NAME, model)
+    register_model(DEFAULT_MODEL_NAME, model)
+    return model
+
+
+class _Conversable:
+    # The parts of ConversableAgent.generate_reply that ChatManager relies on, without autogen
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_reply(self, messages=None, stream=False, cancel_event=None, timeout=None):
+        prompt = messages[-1]['content']
+        if stream:
+            return read_stream(self.backend.stream(prompt), cancel_event, timeout)
+        return self.backend.complete(prompt)
+
+
+class _Teachable:
+    def __init__(self):
+        self.stored = []
+
+    def consider_memo_storage(self, comment, user_id=None, session_id=None):
+        self.stored.append((comment, user_id, session_id))
+
+    def recall_memos(self, comment, user_id=None):
+        return []
+
+
+class _Analyzer:
+    def analyze(self, text_to_analyze, analysis_instructions):
+        return "analysis"
+
+
+class FakeAgentManager:
+    def __init__(self, backend):
+        self.conversable = _Conversable(backend)
+        self.teachable = _Teachable()
+        self.analyzer = _Analyzer()
+
+    def warm_up(self, background=True):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def get_conversable_agent(self):
+        return self.conversable
+
+    def get_teachable_agent(self):
+        return self.teachable
+
+    def get_text_analyzer_agent(self):
+        return self.analyzer
+
+
+@pytest.fixture
+def make_manager():
+    managers = []
+
+    def make_manager(backend, **settings):
+        manager = ChatManager(FakeAgentManager(backend), **settings)
+        managers.append(manager)
+        return manager
+
+    yield make_manager
+    for manager in managers:
+        manager.close()
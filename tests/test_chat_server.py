@@ -0,0 +1,49 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Chat Server Tests
+# Filepath: `/tests/test_chat_server.py`
+# Updated: 10-28-2023
+
+import json
+import threading
+import http.client
+
+import pytest
+
+from agent.llm_backend import StubBackend
+from ops.chat_server import ChatServer
+
+
+@pytest.fixture
+def server(make_manager):
+    server = ChatServer(make_manager(StubBackend(first_token_delay=0, token_delay=0)), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def request(server, method, path, body=None):
+    conn = http.client.HTTPConnection(*server.address, timeout=5)
+    try:
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_session_message_round_trip(server):
+    status, session = request(server, "POST", "/sessions", json.dumps({"user_id": "alice"}))
+    assert status == 201 and session['user_id'] == "alice"
+    path = f"/sessions/{session['session_id']}/messages"
+    assert request(server, "POST", path, json.dumps({"content": "hi"})) == (200, {'reply': "You said: hi"})
+
+
+@pytest.mark.parametrize("body", ["not json", "[]", '"x"', "{}", '{"content": 5}', '{"content": null}'])
+def test_malformed_message_is_rejected(server, body):
+    _, session = request(server, "POST", "/sessions")
+    status, response = request(server, "POST", f"/sessions/{session['session_id']}/messages", body)
+    assert status == 400
+    assert "content" in response['error']
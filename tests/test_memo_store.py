@@ -0,0 +1,188 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Store Tests
+# Filepath: `/tests/test_memo_store.py`
+# Updated: 10-28-2023
+
+import time
+
+import pytest
+
+from bench.memo_store import FAKE_MODEL_NAME, make_texts
+from db.database import MemoStore
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    stores = []
+
+    def open_store(name="memos.db", **settings):
+        store = MemoStore(db_filename=str(tmp_path / name), model_name=FAKE_MODEL_NAME, **settings)
+        stores.append(store)
+        return store
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_exact_index_finds_nearest(open_store):
+    store = open_store()
+    texts = make_texts(200, seed=1)
+    store.add_many((text, f"answer {i}") for i, text in enumerate(texts))
+    assert len(store.index) == 200
+    memo = store.get_nearest_memo(texts[42])
+    assert memo == {'input_text': texts[42], 'output_text': "answer 42"}
+    related = store.get_related_memos(texts[7], n_results=5)
+    assert related[0]['input_text'] == texts[7]
+    assert [memo['distance'] for memo in related] == sorted(memo['distance'] for memo in related)
+
+
+def test_index_survives_reopen(open_store):
+    texts = make_texts(100, seed=6)
+    store = open_store("reopen.db")
+    store.add_many((text, "out") for text in texts)
+    store.close()
+    reopened = open_store("reopen.db")
+    assert len(reopened.index) == 100
+    assert reopened.get_nearest_memo(texts[10])['input_text'] == texts[10]
+
+
+def test_ivf_index_trains_in_background(open_store):
+    store = open_store(index_mode="ivf", ivf_train_threshold=300, n_lists=8, nprobe=8)
+    texts = make_texts(400, seed=2)
+    store.add_many((text, "out") for text in texts)
+    # Inserts only request training; the maintenance job runs it
+    assert wait_for(lambda: store.index.is_trained)
+    assert store.get_nearest_memo(texts[123])['input_text'] == texts[123]
+
+
+def test_queued_memos_are_read_back(open_store):
+    store = open_store()
+    for i in range(50):
+        store.queue_memo(f"queued memo {i} about w{i}", "out", user_id="alice")
+    assert store.flush(timeout=5.0)
+    assert len(store.get_related_memos("queued memo", n_results=100, threshold=2.0)) == 50
+
+
+def test_metadata_filters_and_reset(open_store):
+    store = open_store()
+    store.add_input_output_pair("my cat is called Tom", "Noted.", user_id="alice", tags=["pets"])
+    store.add_input_output_pair("my cat is called Felix", "Noted.", user_id="bob")
+    assert [memo['input_text'] for memo in store.get_related_memos("cat", user_id="bob")] == \
+        ["my cat is called Felix"]
+    assert [memo['input_text'] for memo in store.get_related_memos("cat", tags=["pets"])] == \
+        ["my cat is called Tom"]
+    store.reset_db()
+    assert store.get_related_memos("cat") == []
+    store.add_input_output_pair("my cat is called Tom", "Noted.", tags=["pets"])
+    assert len(store.get_related_memos("cat", tags=["pets"])) == 1
+
+
+def test_dedup_merges_repeated_memos(open_store):
+    store = open_store(dedup_threshold=0.05)
+    store.add_input_output_pair("my dog is called Rex", "Noted.", user_id="alice")
+    store.add_input_output_pair("my dog is called Rex", "Noted.", user_id="alice")
+    store.add_input_output_pair("my dog is called Rex", "Noted.", user_id="bob")
+    rows = store.connections.reader().execute(
+        "SELECT user_id, times_seen FROM memos ORDER BY user_id").fetchall()
+    assert rows == [("alice", 2), ("bob", 1)]
+    assert store.duplicates_merged == 1
+
+
+def test_dedup_finds_the_users_copy_among_other_users(open_store):
+    store = open_store(dedup_threshold=0.05)
+    store.add_many(("thanks", "You're welcome!", {"user_id": f"user{i}"}) for i in range(8))
+    store.add_input_output_pair("thanks", "You're welcome!", user_id="user7")
+    assert store.duplicates_merged == 1
+    assert store.connections.reader().execute(
+        "SELECT times_seen FROM memos WHERE user_id = 'user7'").fetchall() == [(2,)]
+
+
+def test_dedup_accepts_memos_without_created_at(open_store):
+    # Rows moved from a legacy shard have a NULL created_at
+    store = open_store(dedup_threshold=0.05)
+    store.add_input_output_pair("my dog is called Rex", "Noted.")
+    embeddings = [(store.embedding_cache.encode("my dog is called Rex"),
+                   store.embedding_cache.encode("Noted."))]
+    assert store.add_many([("my dog is called Rex", "Noted.", {"created_at": None})],
+                          embeddings=embeddings) == 0
+    assert store.connections.reader().execute(
+        "SELECT times_seen, last_seen_at IS NOT NULL FROM memos").fetchall() == [(2, 1)]
+
+
+def test_offline_deduplicate(open_store):
+    store = open_store()
+    store.add_many([("my dog is called Rex", "Noted.")] * 3 + [("my cat is called Tom", "Noted.")])
+    assert store.deduplicate(dry_run=True)['removed'] == 2
+    assert len(store.index) == 4
+    stats = store.deduplicate()
+    assert (stats['groups'], stats['removed']) == (1, 2)
+    assert len(store.index) == 2
+
+
+def test_eviction_runs_off_the_write_path(open_store):
+    store = open_store(max_memos=100, eviction_policy="oldest")
+    texts = make_texts(150, seed=3)
+    store.add_many((text, "out") for text in texts)
+    # The insert only wakes the maintenance job, which evicts down to 95% of capacity
+    assert wait_for(lambda: len(store.index) <= 95)
+    assert store.evicted == 55
+    # The oldest memos went first
+    assert store.connections.reader().execute("SELECT MIN(id) FROM memos").fetchone() == (56,)
+
+
+def test_lru_eviction_keeps_retrieved_memos(open_store):
+    store = open_store(eviction_policy="lru")
+    texts = make_texts(20, seed=4)
+    store.add_many((text, "out") for text in texts)
+    store.get_nearest_memo(texts[0])
+    assert store.evict(max_memos=10) == 10
+    remaining = {memo['input_text'] for memo in store.get_related_memos("w0", n_results=20, threshold=2.0)}
+    assert texts[0] in remaining
+
+
+def test_expired_memos_are_deleted_without_a_capacity(open_store):
+    store = open_store(memo_ttl=0.2)
+    store.add_many((f"short-lived memo {i}", "out") for i in range(10))
+    assert wait_for(lambda: len(store.index) == 0)
+    assert store.evicted == 10
+    assert store.get_related_memos("short-lived memo", threshold=2.0) == []
+
+
+def test_hybrid_retrieval_fuses_and_falls_back(open_store):
+    store = open_store(retrieval_mode="hybrid")
+    store.add_many([
+        ("the quarterly report is due on friday", "Noted."),
+        ("the garden needs watering every morning", "Noted."),
+        ("the report template lives in the shared drive", "Noted."),
+        ("my favourite colour is green", "Noted."),
+    ])
+    related = store.get_related_memos("quarterly report", n_results=2, threshold=2.0)
+    assert related[0]['input_text'] == "the quarterly report is due on friday"
+    assert all('score' in memo for memo in related)
+    assert store.hybrid_fallbacks == 0
+    # No lexical match, so the vector scan answers
+    assert len(store.get_related_memos("zebra", n_results=2, threshold=2.0)) == 2
+    assert store.hybrid_fallbacks == 1
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_embeddings(open_store, dtype):
+    store = open_store(embedding_dtype=dtype, index_dtype=dtype)
+    texts = make_texts(200, seed=5)
+    store.add_many((text, "out") for text in texts)
+    hits = sum(store.get_nearest_memo(text)['input_text'] == text for text in texts[:50])
+    assert hits >= 49
+    row_types = store.connections.reader().execute(
+        "SELECT DISTINCT embedding_dtype FROM memos").fetchall()
+    assert row_types == [(dtype,)]
@@ -0,0 +1,33 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Store Configuration Tests
+# Filepath: `/tests/test_memo_store_config.py`
+# Updated: 10-28-2023
+
+from db.database import MemoStore
+from db.sharding import memo_store_from_config
+
+
+def test_store_from_teach_config(tmp_path):
+    db_dir = tmp_path / "teachable"
+    store = memo_store_from_config({"path_to_db_dir": str(db_dir), "max_memos": 100,
+                                    "retrieval_mode": "hybrid"})
+    try:
+        assert isinstance(store, MemoStore)
+        assert store.path_to_db_file == str(db_dir / "app.db")
+        assert store.dedup_threshold is None
+        assert store.max_memos == 100
+        store.add_input_output_pair("My dog is called Rex", "Noted.")
+        assert store.get_nearest_memo("My dog is called Rex")["input_text"] == "My dog is called Rex"
+    finally:
+        store.close()
+    assert (db_dir / "app.db").exists()
+
+
+def test_store_filename_and_dedup_from_teach_config(tmp_path):
+    store = memo_store_from_config({"db_filename": str(tmp_path / "memos.db"), "dedup_threshold": 0.05})
+    try:
+        assert store.path_to_db_file == str(tmp_path / "memos.db")
+        assert store.dedup_threshold == 0.05
+    finally:
+        store.close()
@@ -0,0 +1,57 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Memo Writer Tests
+# Filepath: `/tests/test_memo_writer.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+
+import pytest
+
+from db.memo_writer import MemoWriter
+
+
+class _Store:
+    # Records what MemoWriter hands to MemoStore.add_many
+    def __init__(self):
+        self.memos = []
+
+    def add_many(self, pairs, batch_size=256):
+        self.memos.extend(pairs)
+        return len(pairs)
+
+
+def test_submit_after_close_is_rejected():
+    store = _Store()
+    writer = MemoWriter(store)
+    writer.submit("my dog is called Rex", "Noted.")
+    writer.close()
+    assert store.memos == [("my dog is called Rex", "Noted.", None)]
+    with pytest.raises(RuntimeError):
+        writer.submit("my cat is called Tom", "Noted.")
+
+
+def test_every_accepted_memo_is_written_when_closing_concurrently():
+    store = _Store()
+    writer = MemoWriter(store, max_queue_size=8, max_wait=0.001)
+    accepted = []
+
+    def submit_until_closed(worker):
+        for i in range(100000):
+            try:
+                writer.submit(f"memo {worker}-{i}", "out")
+            except RuntimeError:
+                return
+            accepted.append(1)
+
+    threads = [threading.Thread(target=submit_until_closed, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    while len(accepted) < 200:
+        time.sleep(0.001)
+    writer.close()
+    for thread in threads:
+        thread.join()
+    assert writer.flush(timeout=1.0)
+    assert len(store.memos) == len(accepted)
@@ -0,0 +1,87 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Message Pipeline Tests
+# Filepath: `/tests/test_pipeline.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+
+import pytest
+
+from ops.pipeline import MessagePipeline
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = MessagePipeline(max_workers=4)
+    yield pipeline
+    pipeline.shutdown(wait=True)
+
+
+def test_dependent_sees_results_and_context(pipeline):
+    pipeline.add_stage("analyze", lambda text, results: text.upper())
+    pipeline.add_stage("reply", lambda text, results: (results["analyze"], results["session"]),
+                       depends_on=["analyze"])
+    assert pipeline.run("hi", target="reply", context={"session": "s1"}) == ("HI", "s1")
+
+
+def test_independent_stages_run_concurrently(pipeline):
+    pipeline.add_stage("store", lambda text, results: time.sleep(0.3))
+    pipeline.add_stage("reply", lambda text, results: "done", max_workers=2)
+    start = time.perf_counter()
+    assert pipeline.run("hi", target="reply") == "done"
+    assert time.perf_counter() - start < 0.2
+
+
+def test_target_timeout_returns_none(pipeline):
+    release = threading.Event()
+    pipeline.add_stage("reply", lambda text, results: release.wait(5), timeout=0.1)
+    start = time.perf_counter()
+    assert pipeline.run("hi", target="reply") is None
+    assert time.perf_counter() - start < 1.0
+    release.set()
+
+
+def test_dependent_runs_after_dependency_timeout(pipeline):
+    release = threading.Event()
+    pipeline.add_stage("analyze", lambda text, results: release.wait(5) and "late", timeout=0.1)
+    pipeline.add_stage("reply", lambda text, results: ("reply", results["analyze"]),
+                       depends_on=["analyze"], timeout=2.0)
+    start = time.perf_counter()
+    assert pipeline.run("hi", target="reply") == ("reply", None)
+    assert time.perf_counter() - start < 1.0
+    release.set()
+
+
+def test_failed_dependency_is_seen_as_none(pipeline):
+    def fail(text, results):
+        raise ValueError("boom")
+
+    pipeline.add_stage("analyze", fail)
+    pipeline.add_stage("reply", lambda text, results: results["analyze"], depends_on=["analyze"])
+    assert pipeline.run("hi", target="reply") is None
+    assert pipeline.run("hi", target="analyze") is None
+
+
+def test_skipped_stage_unblocks_dependents(pipeline):
+    done = threading.Event()
+    pipeline.add_stage("reply", lambda text, results: "never")
+    pipeline.add_stage("log", lambda text, results: done.set() or results["reply"], depends_on=["reply"])
+    assert pipeline.run("hi", skip=("reply",)) is None
+    assert done.wait(1.0)
+
+
+def test_shutdown_waits_for_background_stages():
+    pipeline = MessagePipeline(max_workers=2)
+    stored = []
+    pipeline.add_stage("store", lambda text, results: time.sleep(0.1) or stored.append(text))
+    pipeline.add_stage("index", lambda text, results: stored.append("indexed"), depends_on=["store"])
+    pipeline.run("memo")
+    pipeline.shutdown(wait=True)
+    assert stored == ["memo", "indexed"]
+
+
+def test_unknown_dependency_is_rejected(pipeline):
+    with pytest.raises(ValueError):
+        pipeline.add_stage("reply", lambda text, results: None, depends_on=["missing"])
@@ -0,0 +1,55 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Response Cache Tests
+# Filepath: `/tests/test_response_cache.py`
+# Updated: 10-28-2023
+
+import pytest
+
+from agent.context_assembler import render_prompt
+from bench.memo_store import FAKE_MODEL_NAME
+from db.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(model_name=FAKE_MODEL_NAME, threshold=0.9, max_entries=3)
+
+
+def conversation(*contents):
+    roles = ["user", "assistant"]
+    return [{'role': roles[i % 2], 'content': content} for i, content in enumerate(contents)]
+
+
+def test_exact_and_semantic_hits(cache):
+    cache.put("What is the capital of France?", "Paris.", latency=1.0)
+    assert cache.get("what is the  capital of france?") == "Paris."
+    assert cache.get("What is the capital city of France?") == "Paris."
+    assert cache.get("Tell me a joke.") is None
+    stats = cache.stats()
+    assert (stats['exact_hits'], stats['semantic_hits'], stats['misses']) == (1, 1, 1)
+    assert stats['saved_seconds'] == 2.0
+
+
+def test_repeated_multi_message_prompt_hits(cache):
+    prompt = render_prompt(conversation("my dog is called Rex", "Noted.", "what is my dog called?"))
+    cache.put(prompt, "Rex.", semantic=False)
+    assert cache.get(render_prompt(conversation("my dog is called Rex", "Noted.", "what is my dog called?")),
+                     semantic=False) == "Rex."
+    # The same question after different history is a different prompt
+    other = render_prompt(conversation("my dog is called Max", "Noted.", "what is my dog called?"))
+    assert cache.get(other, semantic=False) is None
+    # Prompts with history are never matched by meaning
+    assert cache.get(other) is None
+    assert cache.stats()['exact_hits'] == 1
+
+
+def test_mixed_entries_share_the_capacity(cache):
+    cache.put("first question", "one")
+    cache.put(render_prompt(conversation("hi", "hello", "second question")), "two", semantic=False)
+    cache.put("third question", "three")
+    cache.put("fourth question", "four")
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['evictions'] == 1
+    assert cache.get("first question") is None
+    assert cache.get("fourth question") == "four"
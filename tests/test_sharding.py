@@ -0,0 +1,101 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Sharded Memo Store Tests
+# Filepath: `/tests/test_sharding.py`
+# Updated: 10-28-2023
+
+import sqlite3
+
+import pytest
+
+from bench.memo_store import FAKE_MODEL_NAME, make_texts
+from db.sharding import ShardedMemoStore, jump_hash, shard_for, shard_path
+
+
+@pytest.fixture
+def open_sharded(tmp_path):
+    stores = []
+
+    def open_sharded(n_shards=None, **settings):
+        store = ShardedMemoStore(n_shards=n_shards, db_filename=str(tmp_path / "memos.db"),
+                                 model_name=FAKE_MODEL_NAME, **settings)
+        stores.append(store)
+        return store
+
+    yield open_sharded
+    for store in stores:
+        store.close()
+
+
+def test_jump_hash_only_moves_keys_into_the_new_bucket():
+    keys = range(0, 2 ** 40, 2 ** 40 // 2000)
+    for n_buckets in (1, 2, 5):
+        for key in keys:
+            before, after = jump_hash(key, n_buckets), jump_hash(key, n_buckets + 1)
+            assert after in (before, n_buckets)
+
+
+def test_memos_are_placed_by_hash(open_sharded):
+    store = open_sharded(2)
+    texts = make_texts(100, seed=7)
+    assert store.add_many((text, "out") for text in texts) == 100
+    expected = [0, 0]
+    for text in texts:
+        expected[shard_for(text, None, 2)] += 1
+    assert store.shard_sizes() == expected
+    assert store.get_nearest_memo(texts[17]) == {'input_text': texts[17], 'output_text': "out"}
+    related = store.get_related_memos(texts[3], n_results=5)
+    assert related[0]['input_text'] == texts[3]
+    assert [memo['distance'] for memo in related] == sorted(memo['distance'] for memo in related)
+
+
+def test_user_routing_keeps_a_user_on_one_shard(open_sharded):
+    store = open_sharded(2, shard_key="user")
+    for user_id in ("alice", "bob", "carol"):
+        store.add_many((f"{user_id} note {i} about w{i}", "out", {"user_id": user_id}) for i in range(10))
+    related = store.get_related_memos("note", n_results=20, threshold=2.0, user_id="bob")
+    assert len(related) == 10
+    assert all(memo['input_text'].startswith("bob") for memo in related)
+
+
+def test_add_shards_rebalances_and_reopens(open_sharded, tmp_path):
+    store = ShardedMemoStore(n_shards=2, db_filename=str(tmp_path / "memos.db"), model_name=FAKE_MODEL_NAME)
+    try:
+        texts = make_texts(300, seed=8)
+        store.add_many((text, f"answer {i}") for i, text in enumerate(texts))
+        probes = texts[::30]
+        nearest = [store.get_nearest_memo(text) for text in probes]
+        moved = store.add_shards(1)
+        sizes = store.shard_sizes()
+        assert sum(sizes) == 300
+        assert moved == sizes[2] > 0
+        assert [store.get_nearest_memo(text) for text in probes] == nearest
+    finally:
+        store.close()
+    # Each probe was retrieved once before and once after the move, and its count moved with it
+    access_counts = {}
+    for number in range(3):
+        with sqlite3.connect(shard_path(str(tmp_path / "memos.db"), number)) as conn:
+            access_counts.update(conn.execute("SELECT input_text, access_count FROM memos WHERE access_count > 0"))
+    assert {text: access_counts.get(text) for text in probes} == {text: 2 for text in probes}
+    reopened = open_sharded()
+    assert reopened.n_shards == 3
+    assert reopened.shard_sizes() == sizes
+    with pytest.raises(ValueError):
+        open_sharded(2)
+
+
+def test_hybrid_results_are_fused_in_the_parent(open_sharded):
+    store = open_sharded(2, retrieval_mode="hybrid")
+    store.add_many([
+        ("the quarterly report is due on friday", "Noted."),
+        ("the garden needs watering every morning", "Noted."),
+        ("the report template lives in the shared drive", "Noted."),
+        ("my favourite colour is green", "Noted."),
+    ])
+    related = store.get_related_memos("quarterly report", n_results=2, threshold=2.0)
+    assert related[0]['input_text'] == "the quarterly report is due on friday"
+    assert all('score' in memo and 'id' not in memo for memo in related)
+    assert store.hybrid_fallbacks == 0
+    assert len(store.get_related_memos("zebra", n_results=2, threshold=2.0)) == 2
+    assert store.hybrid_fallbacks == 1
@@ -0,0 +1,108 @@
+# OpenMindAI
+# Version: AXYS
+# Module: Streaming and Cancellation Tests
+# Filepath: `/tests/test_streaming.py`
+# Updated: 10-28-2023
+
+import time
+import threading
+
+import pytest
+
+from agent.llm_backend import StubBackend, read_stream
+
+
+def free_slots(backend):
+    acquired = 0
+    while backend._slots.acquire(blocking=False):
+        acquired += 1
+    for _ in range(acquired):
+        backend._slots.release()
+    return acquired
+
+
+def test_read_stream_yields_every_chunk():
+    backend = StubBackend(reply="one two three", first_token_delay=0, token_delay=0)
+    assert "".join(read_stream(backend.stream("hi"))) == "one two three"
+    assert free_slots(backend) == backend.max_concurrency
+
+
+def test_read_stream_cancel_stops_at_once_and_frees_the_slot():
+    backend = StubBackend(reply=" ".join(["word"] * 50), first_token_delay=0, token_delay=0.05,
+                          max_concurrency=1)
+    cancel_event = threading.Event()
+    chunks = []
+    start = time.perf_counter()
+    for chunk in read_stream(backend.stream("hi"), cancel_event, poll_interval=0.01):
+        chunks.append(chunk)
+        if len(chunks) == 2:
+            cancel_event.set()
+    assert time.perf_counter() - start < 0.5
+    assert len(chunks) == 2
+    # The stream is closed once its pending token arrives
+    deadline = time.monotonic() + 1.0
+    while free_slots(backend) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert free_slots(backend) == 1
+
+
+def test_read_stream_timeout_raises():
+    backend = StubBackend(reply=" ".join(["word"] * 50), first_token_delay=0, token_delay=0.05)
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        for _ in read_stream(backend.stream("hi"), timeout=0.2, poll_interval=0.01):
+            pass
+    assert time.perf_counter() - start < 0.5
+
+
+def test_reply_is_returned_and_recorded(make_manager):
+    backend = StubBackend(first_token_delay=0, token_delay=0)
+    manager = make_manager(backend)
+    history = []
+    reply = manager.handle_user_input("remember that my dog is called Rex", chat_history=history,
+                                      user_id="alice", session_id="s1")
+    assert reply == "You said: remember that my dog is called Rex"
+    assert [message['role'] for message in history] == ["user", "assistant"]
+    manager.pipeline.shutdown(wait=True)
+    assert manager.agent_manager.teachable.stored == [("remember that my dog is called Rex", "alice", "s1")]
+
+
+def test_slow_reply_times_out(make_manager):
+    manager = make_manager(StubBackend(first_token_delay=1.0), stage_timeouts={"reply": 0.1})
+    start = time.perf_counter()
+    reply = manager.handle_user_input("hi", chat_history=[])
+    assert "couldn't generate a reply in time" in reply
+    assert time.perf_counter() - start < 0.5
+
+
+def test_stream_yields_chunks_and_records_turn(make_manager):
+    manager = make_manager(StubBackend(reply="a b c", first_token_delay=0, token_delay=0))
+    history = []
+    chunks = list(manager.handle_user_input_stream("hi", chat_history=history))
+    assert chunks == ["a", " b", " c"]
+    assert history[-1] == {'role': 'assistant', 'content': "a b c"}
+
+
+def test_stream_timeout_yields_apology(make_manager):
+    backend = StubBackend(reply=" ".join(["word"] * 50), first_token_delay=0, token_delay=0.05)
+    manager = make_manager(backend, stage_timeouts={"reply": 0.2})
+    history = []
+    start = time.perf_counter()
+    chunks = list(manager.handle_user_input_stream("hi", chat_history=history))
+    assert time.perf_counter() - start < 0.6
+    assert "couldn't generate a reply in time" in chunks[-1]
+    assert history[0] == {'role': 'user', 'content': "hi"}
+
+
+def test_cancelled_stream_records_partial_reply(make_manager):
+    backend = StubBackend(reply=" ".join(["word"] * 50), first_token_delay=0, token_delay=0.05)
+    manager = make_manager(backend)
+    cancel_event = threading.Event()
+    history = []
+    chunks = []
+    for chunk in manager.handle_user_input_stream("hi", cancel_event, chat_history=history):
+        chunks.append(chunk)
+        if len(chunks) == 3:
+            cancel_event.set()
+    assert len(chunks) == 3
+    assert history[-1] == {'role': 'assistant', 'content': "word word word"}